@@ -1,109 +1,716 @@
 
 import sqlite3
 import os
+import queue
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
 DB_NAME = "documents.db"
 
-def get_db_connection():
-    conn = sqlite3.connect(DB_NAME)
+# Connection pool settings (override via environment / .env)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "8"))              # idle connections kept open
+DB_BUSY_TIMEOUT_MS = int(os.getenv("DB_BUSY_TIMEOUT_MS", "5000"))
+DB_CACHE_SIZE_KB = int(os.getenv("DB_CACHE_SIZE_KB", "16384"))  # page cache per connection
+DB_MMAP_SIZE = int(os.getenv("DB_MMAP_SIZE", str(256 * 1024 * 1024)))
+DB_STATEMENT_CACHE = 256                                        # prepared statements kept per connection
+DB_THREADS = int(os.getenv("DB_THREADS", str(DB_POOL_SIZE)))    # threads for run_db()
+
+# LIFO so the most recently used (warmest cache) connection is handed out first
+_pool = queue.LifoQueue(maxsize=DB_POOL_SIZE)
+_db_executor = None
+
+
+class PooledConnection(sqlite3.Connection):
+    """
+    sqlite3 connection whose close() hands it back to the pool instead of closing it,
+    so existing `conn = get_db_connection() ... conn.close()` code is pooled as-is.
+    """
+
+    def close(self):
+        try:
+            # Never hand out a connection with a half-finished transaction
+            if self.in_transaction:
+                self.rollback()
+            self.row_factory = sqlite3.Row
+            _pool.put_nowait(self)
+        except (queue.Full, sqlite3.Error):
+            super().close()
+
+
+def _open_connection():
+    # check_same_thread=False: pooled connections move between request and worker
+    # threads, but each is only used by one thread at a time while checked out
+    conn = sqlite3.connect(
+        DB_NAME,
+        factory=PooledConnection,
+        check_same_thread=False,
+        cached_statements=DB_STATEMENT_CACHE,
+        timeout=DB_BUSY_TIMEOUT_MS / 1000,
+    )
     conn.row_factory = sqlite3.Row
+    # WAL lets readers run while the processing workers write
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA busy_timeout={DB_BUSY_TIMEOUT_MS}")
+    conn.execute(f"PRAGMA cache_size=-{DB_CACHE_SIZE_KB}")
+    conn.execute(f"PRAGMA mmap_size={DB_MMAP_SIZE}")
+    conn.execute("PRAGMA temp_store=MEMORY")
     return conn
 
-def init_db():
-    conn = get_db_connection()
+def get_db_connection():
+    try:
+        return _pool.get_nowait()
+    except queue.Empty:
+        return _open_connection()
+
+def with_db_connection(conn, func):
+    """
+    Run func(conn) on the caller's connection, or on a pooled one that is committed and
+    returned afterwards when `conn` is None (for helpers that can join a caller's transaction).
+    """
+    own_conn = conn is None
+    if own_conn:
+        conn = get_db_connection()
     try:
-        # Create table with new schema if it doesn't exist
-        conn.execute('''
-            CREATE TABLE IF NOT EXISTS documents (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id TEXT NOT NULL,
-                filename TEXT NOT NULL,
-                file_path TEXT NOT NULL,
-                title TEXT,
-                content_type TEXT,
-                upload_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                file_size INTEGER,
-                extracted_text TEXT,
-                processing_status TEXT DEFAULT 'pending',
-                error_message TEXT,
-                category TEXT DEFAULT 'Uncategorized'
-            )
-        ''')
+        result = func(conn)
+        if own_conn:
+            conn.commit()
+        return result
+    finally:
+        if own_conn:
+            conn.close()
+
+def close_db_pool():
+    """
+    Close idle pooled connections and the DB thread pool. Called on app shutdown.
+    """
+    global _db_executor
+    while True:
+        try:
+            conn = _pool.get_nowait()
+        except queue.Empty:
+            break
+        sqlite3.Connection.close(conn)
+    if _db_executor is not None:
+        _db_executor.shutdown(wait=False)
+        _db_executor = None
+
+async def run_db(func, *args, **kwargs):
+    """
+    Run a blocking database helper on the DB thread pool so it doesn't stall the event loop.
+    """
+    global _db_executor
+    if _db_executor is None:
+        _db_executor = ThreadPoolExecutor(max_workers=DB_THREADS, thread_name_prefix="db")
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_db_executor, lambda: func(*args, **kwargs))
+
+# --- Schema Migrations ---
+# Each migration runs once, in order, inside its own transaction. The schema version
+# is kept in PRAGMA user_version. To change the schema, append a new migration.
+
+def _migration_1_base_schema(conn):
+    """
+    Documents table, FTS index, processing queue and dedup cache. Idempotent, so it
+    also upgrades databases created before versioning (user_version 0).
+    """
+    # Create table with new schema if it doesn't exist
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS documents (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id TEXT NOT NULL,
+            filename TEXT NOT NULL,
+            file_path TEXT NOT NULL,
+            title TEXT,
+            content_type TEXT,
+            upload_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            file_size INTEGER,
+            extracted_text TEXT,
+            processing_status TEXT DEFAULT 'pending',
+            error_message TEXT,
+            category TEXT DEFAULT 'Uncategorized',
+            content_hash TEXT
+        )
+    ''')
+    
+    # Databases created before versioned migrations may lack later columns
+    cursor = conn.cursor()
+    cursor.execute("PRAGMA table_info(documents)")
+    columns = [info[1] for info in cursor.fetchall()]
+    
+    if 'extracted_text' not in columns:
+        print("Migrating database: adding extracted_text column")
+        conn.execute("ALTER TABLE documents ADD COLUMN extracted_text TEXT")
+        
+    if 'processing_status' not in columns:
+        print("Migrating database: adding processing_status column")
+        conn.execute("ALTER TABLE documents ADD COLUMN processing_status TEXT DEFAULT 'pending'")
         
-        # Check if columns exist (migration for existing db)
-        cursor = conn.cursor()
-        cursor.execute("PRAGMA table_info(documents)")
-        columns = [info[1] for info in cursor.fetchall()]
-        print(columns)
+    if 'error_message' not in columns:
+        print("Migrating database: adding error_message column")
+        conn.execute("ALTER TABLE documents ADD COLUMN error_message TEXT")
         
-        if 'extracted_text' not in columns:
-            print("Migrating database: adding extracted_text column")
-            conn.execute("ALTER TABLE documents ADD COLUMN extracted_text TEXT")
-            
-        if 'processing_status' not in columns:
-            print("Migrating database: adding processing_status column")
-            conn.execute("ALTER TABLE documents ADD COLUMN processing_status TEXT DEFAULT 'pending'")
-            
-        if 'error_message' not in columns:
-            print("Migrating database: adding error_message column")
-            conn.execute("ALTER TABLE documents ADD COLUMN error_message TEXT")
-            
-        if 'category' not in columns:
-            print("Migrating database: adding category column")
-            conn.execute("ALTER TABLE documents ADD COLUMN category TEXT DEFAULT 'Uncategorized'")
-            
-        # --- Full Text Search Setup ---
-        # Create FTS virtual table
-        conn.execute('''
-            CREATE VIRTUAL TABLE IF NOT EXISTS documents_fts USING fts5(
-                title,
-                extracted_text,
-                category,
-                content='documents',
-                content_rowid='id'
-            )
-        ''')
-
-        # Triggers to keep FTS table in sync
-        # INSERT Trigger
-        conn.execute('''
-            CREATE TRIGGER IF NOT EXISTS documents_ai AFTER INSERT ON documents BEGIN
-                INSERT INTO documents_fts(rowid, title, extracted_text, category) 
-                VALUES (new.id, new.title, new.extracted_text, new.category);
-            END;
-        ''')
-
-        # DELETE Trigger
-        conn.execute('''
-            CREATE TRIGGER IF NOT EXISTS documents_ad AFTER DELETE ON documents BEGIN
-                INSERT INTO documents_fts(documents_fts, rowid, title, extracted_text, category) 
-                VALUES('delete', old.id, old.title, old.extracted_text, old.category);
-            END;
-        ''')
-
-        # UPDATE Trigger
-        conn.execute('''
-            CREATE TRIGGER IF NOT EXISTS documents_au AFTER UPDATE ON documents BEGIN
-                INSERT INTO documents_fts(documents_fts, rowid, title, extracted_text, category) 
-                VALUES('delete', old.id, old.title, old.extracted_text, old.category);
-                INSERT INTO documents_fts(rowid, title, extracted_text, category) 
-                VALUES (new.id, new.title, new.extracted_text, new.category);
-            END;
-        ''')
-
-        # Populate FTS if empty (Migration)
-        cursor.execute("SELECT count(*) as count FROM documents_fts")
-        fts_count = cursor.fetchone()['count']
-        if fts_count == 0:
-            cursor.execute("SELECT count(*) as count FROM documents")
-            doc_count = cursor.fetchone()['count']
-            if doc_count > 0:
-                 print("Migrating database: Populating FTS index...")
-                 conn.execute("INSERT INTO documents_fts(rowid, title, extracted_text, category) SELECT id, title, extracted_text, category FROM documents")
-
-        conn.commit()
-        print(f"Database {DB_NAME} initialized successfully.")
+    if 'category' not in columns:
+        print("Migrating database: adding category column")
+        conn.execute("ALTER TABLE documents ADD COLUMN category TEXT DEFAULT 'Uncategorized'")
+        
+    if 'content_hash' not in columns:
+        print("Migrating database: adding content_hash column")
+        conn.execute("ALTER TABLE documents ADD COLUMN content_hash TEXT")
+        
+    # --- Full Text Search Setup ---
+    # Create FTS virtual table
+    conn.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS documents_fts USING fts5(
+            title,
+            extracted_text,
+            category,
+            content='documents',
+            content_rowid='id'
+        )
+    ''')
+
+    # Triggers to keep FTS table in sync
+    # INSERT Trigger
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS documents_ai AFTER INSERT ON documents BEGIN
+            INSERT INTO documents_fts(rowid, title, extracted_text, category) 
+            VALUES (new.id, new.title, new.extracted_text, new.category);
+        END;
+    ''')
+
+    # DELETE Trigger
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS documents_ad AFTER DELETE ON documents BEGIN
+            INSERT INTO documents_fts(documents_fts, rowid, title, extracted_text, category) 
+            VALUES('delete', old.id, old.title, old.extracted_text, old.category);
+        END;
+    ''')
+
+    # UPDATE Trigger
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS documents_au AFTER UPDATE ON documents BEGIN
+            INSERT INTO documents_fts(documents_fts, rowid, title, extracted_text, category) 
+            VALUES('delete', old.id, old.title, old.extracted_text, old.category);
+            INSERT INTO documents_fts(rowid, title, extracted_text, category) 
+            VALUES (new.id, new.title, new.extracted_text, new.category);
+        END;
+    ''')
+
+    # --- Processing Job Queue ---
+    # Durable queue consumed by services/job_queue.py. A job is leased by a
+    # worker while running; expired leases are put back in the queue.
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS processing_jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            document_id INTEGER NOT NULL,
+            user_id TEXT NOT NULL,
+            file_path TEXT NOT NULL,
+            status TEXT DEFAULT 'queued',
+            attempts INTEGER DEFAULT 0,
+            lease_owner TEXT,
+            lease_expires_at REAL,
+            last_error TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+    # At most one active (queued/running) job per document
+    conn.execute('''
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_jobs_active_document
+        ON processing_jobs(document_id) WHERE status IN ('queued', 'running')
+    ''')
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_jobs_status
+        ON processing_jobs(status, id)
+    ''')
+
+    # --- Dedup Cache (services/cache_service.py) ---
+    # SHA-256 of the uploaded file -> LLM results
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS extraction_cache (
+            content_hash TEXT PRIMARY KEY,
+            extracted_text TEXT,
+            category TEXT,
+            hits INTEGER DEFAULT 0,
+            last_used_at REAL
+        )
+    ''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_extraction_cache_lru ON extraction_cache(last_used_at)")
+
+    # SHA-256 of a rendered PDF page -> OCR text
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS page_cache (
+            page_hash TEXT PRIMARY KEY,
+            text TEXT,
+            hits INTEGER DEFAULT 0,
+            last_used_at REAL
+        )
+    ''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_page_cache_lru ON page_cache(last_used_at)")
+
+    # Populate FTS if empty (Migration)
+    cursor.execute("SELECT count(*) as count FROM documents_fts")
+    fts_count = cursor.fetchone()['count']
+    if fts_count == 0:
+        cursor.execute("SELECT count(*) as count FROM documents")
+        doc_count = cursor.fetchone()['count']
+        if doc_count > 0:
+             print("Migrating database: Populating FTS index...")
+             conn.execute("INSERT INTO documents_fts(rowid, title, extracted_text, category) SELECT id, title, extracted_text, category FROM documents")
+
+
+def _migration_2_access_path_indexes(conn):
+    """
+    Indexes for every documents access path used by the API and the job queue.
+    """
+    # List: WHERE user_id = ? ORDER BY upload_date DESC, id DESC (keyset pagination)
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_documents_user_date
+        ON documents(user_id, upload_date, id)
+    ''')
+    # List by category + category GROUP BY (covering for the counts query)
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_documents_user_category_date
+        ON documents(user_id, category, upload_date, id)
+    ''')
+    # Job recovery looks for unfinished documents; partial, so it stays tiny
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_documents_unfinished
+        ON documents(id) WHERE processing_status IN ('pending', 'processing')
+    ''')
+    # Job recovery looks for running jobs with an expired lease
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_jobs_running_lease
+        ON processing_jobs(lease_expires_at) WHERE status = 'running'
+    ''')
+    # Per-user running job count in the queue's claim query
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_jobs_user_status
+        ON processing_jobs(user_id, status)
+    ''')
+    conn.execute("ANALYZE")
+
+def _migration_3_category_counts(conn):
+    """
+    Per-user document counts by category, kept exact by triggers so the
+    sidebar doesn't aggregate over every document. NULL categories are stored as ''.
+    """
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS category_counts (
+            user_id TEXT NOT NULL,
+            category TEXT NOT NULL,
+            count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_id, category)
+        ) WITHOUT ROWID
+    ''')
+
+    # INSERT Trigger
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS category_counts_ai AFTER INSERT ON documents BEGIN
+            INSERT INTO category_counts(user_id, category, count)
+            VALUES (new.user_id, COALESCE(new.category, ''), 1)
+            ON CONFLICT(user_id, category) DO UPDATE SET count = count + 1;
+        END;
+    ''')
+
+    # DELETE Trigger
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS category_counts_ad AFTER DELETE ON documents BEGIN
+            UPDATE category_counts SET count = count - 1
+            WHERE user_id = old.user_id AND category = COALESCE(old.category, '');
+            DELETE FROM category_counts
+            WHERE user_id = old.user_id AND category = COALESCE(old.category, '') AND count <= 0;
+        END;
+    ''')
+
+    # UPDATE Trigger (only when the document moves between counters)
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS category_counts_au AFTER UPDATE OF user_id, category ON documents
+        WHEN old.user_id IS NOT new.user_id OR COALESCE(old.category, '') IS NOT COALESCE(new.category, '')
+        BEGIN
+            UPDATE category_counts SET count = count - 1
+            WHERE user_id = old.user_id AND category = COALESCE(old.category, '');
+            DELETE FROM category_counts
+            WHERE user_id = old.user_id AND category = COALESCE(old.category, '') AND count <= 0;
+            INSERT INTO category_counts(user_id, category, count)
+            VALUES (new.user_id, COALESCE(new.category, ''), 1)
+            ON CONFLICT(user_id, category) DO UPDATE SET count = count + 1;
+        END;
+    ''')
+
+    rebuild_category_counts(conn)
+
+def _migration_4_fts_user_column(conn):
+    """
+    Rebuild documents_fts with the owner's user_id as a fourth column, so searches can
+    restrict matches to one user inside the FTS index (see routes.documents._search_documents).
+    The column is indexed rather than UNINDEXED: FTS5 only checks UNINDEXED values after
+    a row matched, which wouldn't skip other users' matches.
+    """
+    conn.execute("DROP TRIGGER IF EXISTS documents_ai")
+    conn.execute("DROP TRIGGER IF EXISTS documents_ad")
+    conn.execute("DROP TRIGGER IF EXISTS documents_au")
+    conn.execute("DROP TABLE IF EXISTS documents_fts")
+
+    conn.execute('''
+        CREATE VIRTUAL TABLE documents_fts USING fts5(
+            title,
+            extracted_text,
+            category,
+            user_id,
+            content='documents',
+            content_rowid='id'
+        )
+    ''')
+
+    # INSERT Trigger
+    conn.execute('''
+        CREATE TRIGGER documents_ai AFTER INSERT ON documents BEGIN
+            INSERT INTO documents_fts(rowid, title, extracted_text, category, user_id)
+            VALUES (new.id, new.title, new.extracted_text, new.category, new.user_id);
+        END;
+    ''')
+
+    # DELETE Trigger
+    conn.execute('''
+        CREATE TRIGGER documents_ad AFTER DELETE ON documents BEGIN
+            INSERT INTO documents_fts(documents_fts, rowid, title, extracted_text, category, user_id)
+            VALUES('delete', old.id, old.title, old.extracted_text, old.category, old.user_id);
+        END;
+    ''')
+
+    # UPDATE Trigger (status/error updates don't touch the index)
+    conn.execute('''
+        CREATE TRIGGER documents_au AFTER UPDATE OF title, extracted_text, category, user_id ON documents BEGIN
+            INSERT INTO documents_fts(documents_fts, rowid, title, extracted_text, category, user_id)
+            VALUES('delete', old.id, old.title, old.extracted_text, old.category, old.user_id);
+            INSERT INTO documents_fts(rowid, title, extracted_text, category, user_id)
+            VALUES (new.id, new.title, new.extracted_text, new.category, new.user_id);
+        END;
+    ''')
+
+    conn.execute("INSERT INTO documents_fts(documents_fts) VALUES('rebuild')")
+
+def _migration_5_trigram_index(conn):
+    """
+    Trigram index over titles and extracted text for search-as-you-type
+    (services/suggest_service.py). Matches any substring of 3+ characters,
+    e.g. the middle of an invoice number, which the word tokenizer can't.
+    """
+    conn.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS documents_trigram USING fts5(
+            title,
+            extracted_text,
+            user_id,
+            content='documents',
+            content_rowid='id',
+            tokenize='trigram'
+        )
+    ''')
+
+    # INSERT Trigger
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS documents_trigram_ai AFTER INSERT ON documents BEGIN
+            INSERT INTO documents_trigram(rowid, title, extracted_text, user_id)
+            VALUES (new.id, new.title, new.extracted_text, new.user_id);
+        END;
+    ''')
+
+    # DELETE Trigger
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS documents_trigram_ad AFTER DELETE ON documents BEGIN
+            INSERT INTO documents_trigram(documents_trigram, rowid, title, extracted_text, user_id)
+            VALUES('delete', old.id, old.title, old.extracted_text, old.user_id);
+        END;
+    ''')
+
+    # UPDATE Trigger
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS documents_trigram_au AFTER UPDATE OF title, extracted_text, user_id ON documents BEGIN
+            INSERT INTO documents_trigram(documents_trigram, rowid, title, extracted_text, user_id)
+            VALUES('delete', old.id, old.title, old.extracted_text, old.user_id);
+            INSERT INTO documents_trigram(rowid, title, extracted_text, user_id)
+            VALUES (new.id, new.title, new.extracted_text, new.user_id);
+        END;
+    ''')
+
+    conn.execute("INSERT INTO documents_trigram(documents_trigram) VALUES('rebuild')")
+
+def _migration_6_document_chunks(conn):
+    """
+    Embedded chunks of each document's extracted text for semantic search
+    (services/embedding_service.py). Vectors are float32 blobs, unit length.
+    """
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS document_chunks (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            document_id INTEGER NOT NULL,
+            user_id TEXT NOT NULL,
+            chunk_index INTEGER NOT NULL,
+            text TEXT NOT NULL,
+            model TEXT NOT NULL,
+            embedding BLOB NOT NULL
+        )
+    ''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_chunks_document ON document_chunks(document_id, chunk_index)")
+    # Re-uploads of an indexed file copy its chunks instead of embedding again
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_documents_content_hash ON documents(content_hash)")
+
+    # Chunks go away with their document, and are stale once its text changes
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS document_chunks_ad AFTER DELETE ON documents BEGIN
+            DELETE FROM document_chunks WHERE document_id = old.id;
+        END;
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS document_chunks_au AFTER UPDATE OF extracted_text, user_id ON documents
+        WHEN old.extracted_text IS NOT new.extracted_text OR old.user_id IS NOT new.user_id
+        BEGIN
+            DELETE FROM document_chunks WHERE document_id = old.id;
+        END;
+    ''')
+
+def _migration_7_document_pages(conn):
+    """
+    Text of each page stored separately (services/page_service.py), plus the progress
+    counters of documents being processed. Existing texts are split into their pages.
+    A page's id is page_service.page_id(document_id, page_number), so the pages of
+    a document are a rowid range.
+    """
+    # page markers and ids are defined there
+    from services.page_service import split_pages, page_id, PAGE_ID_SPAN
+
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS document_pages (
+            id INTEGER PRIMARY KEY,
+            document_id INTEGER NOT NULL,
+            page_number INTEGER NOT NULL,
+            text TEXT NOT NULL
+        )
+    ''')
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS document_pages_ad AFTER DELETE ON documents BEGIN
+            DELETE FROM document_pages
+            WHERE id BETWEEN old.id * {PAGE_ID_SPAN} + 1 AND old.id * {PAGE_ID_SPAN} + {PAGE_ID_SPAN - 1};
+        END;
+    ''')
+
+    cursor = conn.cursor()
+    cursor.execute("PRAGMA table_info(documents)")
+    columns = [info[1] for info in cursor.fetchall()]
+    if 'pages_done' not in columns:
+        conn.execute("ALTER TABLE documents ADD COLUMN pages_done INTEGER")
+    if 'pages_total' not in columns:
+        conn.execute("ALTER TABLE documents ADD COLUMN pages_total INTEGER")
+
+    rows = conn.execute("SELECT id, extracted_text FROM documents WHERE extracted_text IS NOT NULL").fetchall()
+    for row in rows:
+        pages = split_pages(row['extracted_text'])
+        conn.executemany(
+            "INSERT OR IGNORE INTO document_pages (id, document_id, page_number, text) VALUES (?, ?, ?, ?)",
+            [(page_id(row['id'], number), row['id'], number, text) for number, text in pages]
+        )
+        conn.execute(
+            "UPDATE documents SET pages_done = ?, pages_total = ? WHERE id = ?",
+            (len(pages), len(pages), row['id'])
+        )
+
+def _migration_8_page_search_index(conn):
+    """
+    FTS index of each page's text (document_pages_fts), kept in sync page by page.
+    documents_fts still decides which documents match a search, over their whole text;
+    this index then finds the page a result matches best on and cuts its snippet.
+    Its rowids are the page ids, so one document's pages are a rowid range.
+    Also stops documents_fts/documents_trigram from reindexing unchanged values.
+    """
+    conn.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS document_pages_fts USING fts5(
+            text,
+            content='document_pages',
+            content_rowid='id'
+        )
+    ''')
+
+    # INSERT Trigger
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS document_pages_fts_ai AFTER INSERT ON document_pages BEGIN
+            INSERT INTO document_pages_fts(rowid, text) VALUES (new.id, new.text);
+        END;
+    ''')
+
+    # DELETE Trigger
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS document_pages_fts_ad AFTER DELETE ON document_pages BEGIN
+            INSERT INTO document_pages_fts(document_pages_fts, rowid, text) VALUES ('delete', old.id, old.text);
+        END;
+    ''')
+
+    # UPDATE Trigger (a re-extracted page reindexes only that page)
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS document_pages_fts_au AFTER UPDATE OF text ON document_pages
+        WHEN old.text IS NOT new.text
+        BEGIN
+            INSERT INTO document_pages_fts(document_pages_fts, rowid, text) VALUES ('delete', old.id, old.text);
+            INSERT INTO document_pages_fts(rowid, text) VALUES (new.id, new.text);
+        END;
+    ''')
+
+    conn.execute("INSERT INTO document_pages_fts(document_pages_fts) VALUES('rebuild')")
+
+    # The whole-document indexes are only rewritten when an indexed value changed, not
+    # whenever an UPDATE sets it again (same category, text rebuilt from unchanged pages)
+    conn.execute("DROP TRIGGER IF EXISTS documents_au")
+    conn.execute('''
+        CREATE TRIGGER documents_au AFTER UPDATE OF title, extracted_text, category, user_id ON documents
+        WHEN old.title IS NOT new.title OR old.extracted_text IS NOT new.extracted_text
+          OR old.category IS NOT new.category OR old.user_id IS NOT new.user_id
+        BEGIN
+            INSERT INTO documents_fts(documents_fts, rowid, title, extracted_text, category, user_id)
+            VALUES('delete', old.id, old.title, old.extracted_text, old.category, old.user_id);
+            INSERT INTO documents_fts(rowid, title, extracted_text, category, user_id)
+            VALUES (new.id, new.title, new.extracted_text, new.category, new.user_id);
+        END;
+    ''')
+    conn.execute("DROP TRIGGER IF EXISTS documents_trigram_au")
+    conn.execute('''
+        CREATE TRIGGER documents_trigram_au AFTER UPDATE OF title, extracted_text, user_id ON documents
+        WHEN old.title IS NOT new.title OR old.extracted_text IS NOT new.extracted_text OR old.user_id IS NOT new.user_id
+        BEGIN
+            INSERT INTO documents_trigram(documents_trigram, rowid, title, extracted_text, user_id)
+            VALUES('delete', old.id, old.title, old.extracted_text, old.user_id);
+            INSERT INTO documents_trigram(rowid, title, extracted_text, user_id)
+            VALUES (new.id, new.title, new.extracted_text, new.user_id);
+        END;
+    ''')
+
+def _migration_9_job_options(conn):
+    """
+    Per-job processing options (JSON), e.g. a reprocess limited to some pages.
+    """
+    cursor = conn.cursor()
+    cursor.execute("PRAGMA table_info(processing_jobs)")
+    columns = [info[1] for info in cursor.fetchall()]
+    if 'options' not in columns:
+        conn.execute("ALTER TABLE processing_jobs ADD COLUMN options TEXT")
+
+def _migration_10_page_chunks(conn):
+    """
+    Embedded chunks per page: a re-extracted page only invalidates (and gets re-embedded)
+    its own chunks instead of all of the document's. page_number is NULL for chunks of
+    the whole text embedded before; they go away when any page of the document changes.
+    """
+    cursor = conn.cursor()
+    cursor.execute("PRAGMA table_info(document_chunks)")
+    columns = [info[1] for info in cursor.fetchall()]
+    if 'page_number' not in columns:
+        conn.execute("ALTER TABLE document_chunks ADD COLUMN page_number INTEGER")
+    conn.execute("DROP INDEX IF EXISTS idx_chunks_document")
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_chunks_document_page
+        ON document_chunks(document_id, page_number, chunk_index)
+    ''')
+
+    # The text is rebuilt from the pages, so only a new owner invalidates every chunk
+    conn.execute("DROP TRIGGER IF EXISTS document_chunks_au")
+    conn.execute('''
+        CREATE TRIGGER document_chunks_au AFTER UPDATE OF user_id ON documents
+        WHEN old.user_id IS NOT new.user_id
+        BEGIN
+            DELETE FROM document_chunks WHERE document_id = old.id;
+        END;
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS document_pages_chunks_ad AFTER DELETE ON document_pages BEGIN
+            DELETE FROM document_chunks WHERE document_id = old.document_id AND page_number = old.page_number;
+            DELETE FROM document_chunks WHERE document_id = old.document_id AND page_number IS NULL;
+        END;
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS document_pages_chunks_au AFTER UPDATE OF text ON document_pages
+        WHEN old.text IS NOT new.text
+        BEGIN
+            DELETE FROM document_chunks WHERE document_id = old.document_id AND page_number = old.page_number;
+            DELETE FROM document_chunks WHERE document_id = old.document_id AND page_number IS NULL;
+        END;
+    ''')
+
+MIGRATIONS = [
+    (1, "base schema", _migration_1_base_schema),
+    (2, "access path indexes", _migration_2_access_path_indexes),
+    (3, "category counters", _migration_3_category_counts),
+    (4, "per-user search index", _migration_4_fts_user_column),
+    (5, "trigram search index", _migration_5_trigram_index),
+    (6, "document chunks", _migration_6_document_chunks),
+    (7, "document pages", _migration_7_document_pages),
+    (8, "page search index", _migration_8_page_search_index),
+    (9, "job options", _migration_9_job_options),
+    (10, "page chunks", _migration_10_page_chunks),
+]
+
+# --- Category counter maintenance (python manage.py rebuild-counts / verify-counts) ---
+def rebuild_category_counts(conn):
+    """
+    Recompute category_counts from documents. The caller commits.
+    """
+    conn.execute("DELETE FROM category_counts")
+    conn.execute('''
+        INSERT INTO category_counts(user_id, category, count)
+        SELECT user_id, COALESCE(category, ''), COUNT(*)
+        FROM documents
+        GROUP BY user_id, COALESCE(category, '')
+    ''')
+
+def verify_category_counts(conn):
+    """
+    Compare category_counts against a fresh aggregate of documents.
+    Returns a list of (user_id, category, stored, actual) for every mismatch.
+    """
+    rows = conn.execute('''
+        WITH actual AS (
+            SELECT user_id, COALESCE(category, '') AS category, COUNT(*) AS count
+            FROM documents
+            GROUP BY user_id, COALESCE(category, '')
+        )
+        SELECT a.user_id, a.category, COALESCE(c.count, 0), a.count
+        FROM actual a
+        LEFT JOIN category_counts c ON c.user_id = a.user_id AND c.category = a.category
+        WHERE c.count IS NOT a.count
+        UNION ALL
+        SELECT c.user_id, c.category, c.count, 0
+        FROM category_counts c
+        WHERE NOT EXISTS (
+            SELECT 1 FROM actual a WHERE a.user_id = c.user_id AND a.category = c.category
+        )
+    ''').fetchall()
+    return [tuple(row) for row in rows]
+
+def get_schema_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+def init_db():
+    """
+    Bring the database up to the latest schema version.
+    """
+    conn = get_db_connection()
+    try:
+        current = get_schema_version(conn)
+        for version, name, migrate in MIGRATIONS:
+            if version <= current:
+                continue
+            print(f"Migrating database: v{version} ({name})")
+            # Explicit BEGIN: sqlite3 would otherwise autocommit each DDL statement
+            conn.execute("BEGIN")
+            try:
+                migrate(conn)
+                conn.execute(f"PRAGMA user_version = {version}")
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+        print(f"Database {DB_NAME} initialized successfully (schema v{MIGRATIONS[-1][0]}).")
     except Exception as e:
         print(f"Error initializing database: {e}")
     finally:
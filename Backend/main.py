@@ -7,7 +7,10 @@ Available Endpoints:
     GET /api/random-quote    - Sample endpoint to connect Frontend and Backend (generates random quote using Gemini LLM)
 
 To run this server:
-    uvicorn main:app --reload
+    uvicorn main:app --reload --timeout-graceful-shutdown 5
+
+(Open /api/events streams never finish on their own; without the timeout a reload or
+shutdown waits for every browser tab to disconnect.)
 
 The server will start at: http://localhost:8000
 API documentation will be available at: http://localhost:8000/docs
@@ -16,7 +19,7 @@ Setup:
     1. Install dependencies: pip install -r requirements.txt
     2. Get your Google API key from: https://makersuite.google.com/app/apikey
     3. Create a .env file in the Backend directory with: GOOGLE_API_KEY=your_api_key_here
-    4. Run the server: uvicorn main:app --reload
+    4. Run the server: uvicorn main:app --reload --timeout-graceful-shutdown 5
 """
 
 import os
@@ -43,17 +46,23 @@ else:
 from contextlib import asynccontextmanager
 
 # ... existing imports ...
-from database import init_db
+from database import init_db, close_db_pool, run_db
 from routes import documents
+from services import job_queue, render_service, cache_service, rate_limiter
 
 # Define lifespan context manager
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    # Startup: Init DB and create uploads dir
+    # Startup: Init DB, create uploads dir and start the processing workers
     init_db()
     if not os.path.exists("uploads"):
         os.makedirs("uploads")
+    await job_queue.start_workers()
     yield
+    # Shutdown: stop workers (unfinished jobs are requeued), the render pool and DB pool
+    await job_queue.stop_workers()
+    render_service.shutdown_render_pool()
+    close_db_pool()
 
 app = FastAPI(title="Backend API", version="0.1.0", lifespan=lifespan)
 
@@ -78,6 +87,20 @@ async def root():
 async def health_check():
     return {"status": "healthy"}
 
+@app.get("/api/cache/stats")
+async def cache_stats():
+    """
+    Hit/miss metrics and sizes of the extraction dedup cache.
+    """
+    return {"success": True, "stats": await run_db(cache_service.get_cache_stats)}
+
+@app.get("/api/llm/stats")
+async def llm_stats():
+    """
+    Client-side Gemini rate limiter counters.
+    """
+    return {"success": True, "stats": rate_limiter.get_limiter_stats()}
+
 @app.get("/api/random-quote")
 async def get_random_quote():
     """
@@ -0,0 +1,394 @@
+"""
+Backend maintenance commands
+
+Usage:
+    python manage.py migrate        - Apply pending schema migrations to documents.db
+    python manage.py check-plans    - Run every API/queue query against a scratch database and
+                                      fail if EXPLAIN QUERY PLAN shows a full table scan
+    python manage.py verify-counts  - Compare the category_counts table with the documents table
+    python manage.py rebuild-counts - Recompute category_counts from the documents table
+    python manage.py embed-backfill - Embed processed documents that aren't in the semantic index yet
+    python manage.py bench-vectors [--chunks N] [--dims D]
+                                    - Time semantic top-k queries over N synthetic chunks
+    python manage.py prune-thumbnails - Delete preview images no document refers to anymore
+    python manage.py bench-render FILE... - Compare OCR image sizes of the render profile with
+                                      plain 72 DPI PNG pages (set TEXT_LAYER_ENABLED=0 to render all pages)
+
+check-plans and verify-counts exit with status 1 on a problem, so they can run in CI.
+"""
+
+import os
+import re
+import sys
+import sqlite3
+import struct
+import argparse
+import tempfile
+from dotenv import load_dotenv
+
+load_dotenv()
+
+import database
+
+# Statements run on behalf of another one (by a trigger or an FTS5 table) are traced
+# with a "-- " prefix and unbound parameters; they are checked like the others
+NESTED_STATEMENT = re.compile(r"^-- (?!TRIGGER\b)")
+# Statements that have no query plan worth checking: transaction control, trigger
+# markers ("-- TRIGGER ...") and FTS5's lookups on its own shadow tables, which are
+# keyed by segment, term or rowid. Lookups in an FTS5 table's content table are checked.
+SKIP_STATEMENTS = re.compile(
+    r"^\s*(?:PRAGMA|BEGIN|COMMIT|ROLLBACK|ANALYZE|CREATE|SAVEPOINT|RELEASE|--)"
+    r"|'main'\.'\w+_(?:data|idx|docsize|config)'",
+    re.IGNORECASE,
+)
+# "SCAN documents" / "SCAN d" / "SCAN documents USING COVERING INDEX ..." are full scans;
+# "SCAN document_pages_fts VIRTUAL TABLE ..." is an FTS index lookup and is fine
+TABLE_SCAN = re.compile(r"^SCAN ([\w.]+)(?![\w.]| VIRTUAL TABLE)")
+SUBQUERY = re.compile(r"^(?:MATERIALIZE|CO-ROUTINE) \w+")
+SCAN_INDEX = re.compile(r"USING (?:COVERING )?INDEX (\w+)")
+
+
+def cmd_migrate(args):
+    database.init_db()
+    conn = database.get_db_connection()
+    try:
+        print(f"Schema version: {database.get_schema_version(conn)}")
+    finally:
+        conn.close()
+    return 0
+
+
+def cmd_verify_counts(args):
+    database.init_db()
+    conn = database.get_db_connection()
+    try:
+        mismatches = database.verify_category_counts(conn)
+    finally:
+        conn.close()
+
+    for user_id, category, stored, actual in mismatches:
+        print(f"{user_id} / {category or 'Uncategorized'}: stored {stored}, actual {actual}")
+    if mismatches:
+        print(f"{len(mismatches)} category counter(s) out of sync. Run 'python manage.py rebuild-counts'.")
+        return 1
+    print("Category counters match the documents table.")
+    return 0
+
+
+def cmd_rebuild_counts(args):
+    database.init_db()
+    conn = database.get_db_connection()
+    try:
+        # IMMEDIATE: no document writes (and trigger updates) between the delete and the re-insert
+        conn.execute("BEGIN IMMEDIATE")
+        database.rebuild_category_counts(conn)
+        conn.commit()
+        total = conn.execute("SELECT COUNT(*) FROM category_counts").fetchone()[0]
+    finally:
+        conn.close()
+    print(f"Rebuilt {total} category counter(s).")
+    return 0
+
+
+def cmd_embed_backfill(args):
+    import asyncio
+    from services import embedding_service
+
+    database.init_db()
+    if not embedding_service.is_enabled():
+        print("Semantic search is disabled (EMBEDDING_PROVIDER=none).")
+        return 1
+    count = asyncio.run(embedding_service.backfill())
+    print(f"Indexed {count} document(s).")
+    return 0
+
+
+def cmd_prune_thumbnails(args):
+    from services import thumbnail_service
+
+    database.init_db()
+    removed = thumbnail_service.prune()
+    print(f"Removed {removed} preview image(s).")
+    return 0
+
+
+def cmd_bench_render(args):
+    import base64
+    import fitz
+    from services import render_service
+
+    total_before = total_after = 0
+    for file_path in args.files:
+        if file_path.lower().endswith(".pdf"):
+            with fitz.open(file_path) as doc:
+                for i, page in enumerate(doc):
+                    result = render_service._render_page(file_path, i)
+                    if "text" in result:
+                        print(f"{file_path} p{i + 1}: text layer, not rendered")
+                        continue
+                    before = len(page.get_pixmap().tobytes("png"))
+                    after = len(base64.b64decode(result["b64_data"]))
+                    dpi = render_service._choose_dpi(page)
+                    print(f"{file_path} p{i + 1}: {before} -> {after} bytes ({result['mime_type']}, {dpi:.0f} DPI)")
+                    total_before += before
+                    total_after += after
+        else:
+            result = render_service._prepare_image(file_path, "image/jpeg")
+            before = os.path.getsize(file_path)
+            after = len(base64.b64decode(result["b64_data"]))
+            print(f"{file_path}: {before} -> {after} bytes ({result['mime_type']})")
+            total_before += before
+            total_after += after
+
+    if total_after:
+        print(f"\nTotal: {total_before} -> {total_after} bytes ({total_before / total_after:.1f}x smaller)")
+    return 0
+
+
+def cmd_bench_vectors(args):
+    import time
+    import numpy as np
+    from services.vector_index import VectorIndex
+
+    with tempfile.TemporaryDirectory() as tmp:
+        database.DB_NAME = os.path.join(tmp, "bench.db")
+        database.init_db()
+
+        # One large tenant holding every chunk: the worst case for a query
+        rng = np.random.default_rng(0)
+        conn = database.get_db_connection()
+        for start in range(0, args.chunks, 10000):
+            count = min(10000, args.chunks - start)
+            vectors = rng.standard_normal((count, args.dims), dtype=np.float32)
+            vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+            conn.executemany(
+                "INSERT INTO document_chunks (document_id, user_id, chunk_index, text, model, embedding) VALUES (?, ?, ?, ?, ?, ?)",
+                [(start + i, "bench", 0, "", "bench", vectors[i].tobytes()) for i in range(count)]
+            )
+        conn.commit()
+        conn.close()
+
+        index = VectorIndex()
+        started = time.perf_counter()
+        index.search("bench", np.ones(args.dims, dtype=np.float32), 10, "bench")
+        print(f"Loaded {args.chunks} x {args.dims} vectors in {time.perf_counter() - started:.2f}s")
+
+        timings = []
+        for _ in range(50):
+            query = rng.standard_normal(args.dims, dtype=np.float32)
+            started = time.perf_counter()
+            index.search("bench", query / np.linalg.norm(query), 40, "bench")
+            timings.append((time.perf_counter() - started) * 1000)
+        database.close_db_pool()
+
+    timings.sort()
+    print(f"top-40 query: median {timings[len(timings) // 2]:.1f} ms, p95 {timings[int(len(timings) * 0.95)]:.1f} ms")
+    return 0
+
+
+def _seed(conn, users=20, docs_per_user=100):
+    from services import page_service
+
+    categories = ["Invoice", "Receipt", "Contract", "Note", "Letter", "Form", "Other"]
+    rows = []
+    for u in range(users):
+        for d in range(docs_per_user):
+            rows.append((
+                f"user-{u}", f"file-{u}-{d}.pdf", f"uploads/file-{u}-{d}.pdf", f"Document {d}",
+                "application/pdf", f"2026-01-{1 + d % 28:02d} 10:00:00", 1000,
+                f"Sample invoice text {d} for user {u}", ["pending", "completed", "completed", "completed", "completed",
+                                                         "failed", "completed", "completed", "completed", "completed"][d % 10],
+                categories[d % len(categories)],
+            ))
+    conn.executemany('''
+        INSERT INTO documents (user_id, filename, file_path, title, content_type, upload_date, file_size,
+                               extracted_text, processing_status, category)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', rows)
+    conn.execute('''
+        INSERT INTO processing_jobs (document_id, user_id, file_path)
+        SELECT id, user_id, file_path FROM documents WHERE processing_status = 'pending'
+    ''')
+    conn.execute('''
+        INSERT INTO document_chunks (document_id, user_id, page_number, chunk_index, text, model, embedding)
+        SELECT id, user_id, 1, 0, extracted_text, 'check', ?
+        FROM documents
+    ''', (struct.pack("2f", 1.0, 0.0),))
+    conn.execute('''
+        INSERT INTO document_pages (id, document_id, page_number, text)
+        SELECT id * ? + 1, id, 1, extracted_text FROM documents
+    ''', (page_service.PAGE_ID_SPAN,))
+    conn.execute("ANALYZE")
+    conn.commit()
+
+
+def _plan_cases():
+    """
+    (name, callable) pairs that exercise each query the API and the job queue run.
+    """
+    from routes import documents
+    from services import job_queue, suggest_service, embedding_service, thumbnail_service, cache_service, page_service
+    from services.search_query import parse_search
+
+    def search(query, offset=0):
+        return documents._search_documents("user-1", parse_search(query), 20, offset)
+
+    upload = {
+        "title": "new.pdf", "filename": "new.pdf", "file_path": "uploads/new.pdf",
+        "content_type": "application/pdf", "file_size": 10, "content_hash": "0" * 64,
+    }
+    return [
+        ("upload document", lambda: documents._save_uploaded_document("user-1", upload)),
+        ("list documents", lambda: documents._list_documents("user-1")),
+        ("list documents, next page", lambda: documents._list_documents("user-1", None, 50, ("2026-01-15 10:00:00", 10**9))),
+        ("list documents by category", lambda: documents._list_documents("user-1", "Invoice")),
+        ("list documents by category, next page", lambda: documents._list_documents("user-1", "Invoice", 50, ("2026-01-15 10:00:00", 10**9))),
+        ("document details", lambda: documents._get_document(150, "user-1")),
+        ("document file", lambda: documents._get_document_file(150, "user-1")),
+        ("thumbnail: document source", lambda: thumbnail_service._get_document_source(150)),
+        ("thumbnail: store content hash", lambda: cache_service.store_content_hash(150, "1" * 64)),
+        ("category counts", lambda: documents._get_categories_with_counts("user-1")),
+        ("search", lambda: search("invoice")),
+        ("search, next page", lambda: search("invoice", 20)),
+        ("search, boolean and fields", lambda: search('title:document "sample invoice" NOT contract')),
+        ("search, pages of unfinished documents", lambda: search("invoice unknown")),
+        ("suggest, short prefix", lambda: suggest_service.find_suggestions("user-1", "in")),
+        ("suggest, trigram", lambda: suggest_service.find_suggestions("user-1", "voice text 1")),
+        ("semantic: load document to index", lambda: embedding_service._load_for_indexing(150, "check")),
+        ("semantic: search chunks", lambda: embedding_service._search_chunks("user-1", [1.0, 0.0], 10, "check")),
+        ("search count", lambda: documents._count_search_matches("user-1", parse_search("invoice"))),
+        ("update category", lambda: documents._update_document_category(150, "user-1", "Receipt")),
+        ("delete document", lambda: documents._delete_document_helper(151, "user-1")),
+        ("pages: start processing", lambda: page_service.start_pages(152, 3)),
+        ("pages: save page", lambda: page_service.save_page(152, 2, "Page two")),
+        ("pages: re-extract page", lambda: page_service.save_page(152, 1, "Page one again")),
+        ("pages: store cached text", lambda: page_service.store_pages(153, "--- Page 1 ---\nOne\n\n--- Page 2 ---\nTwo")),
+        ("reprocess document", lambda: documents._queue_reprocess(154, "user-1", {"pages": [1]})),
+        ("reprocess: categorize only", lambda: documents._queue_reprocess(155, "user-1", {"mode": "categorize"})),
+        ("retry failed documents", lambda: documents._queue_failed_documents("user-2")),
+        ("queue: recover jobs", job_queue.recover_jobs),
+        ("queue: claim job", job_queue._claim_job),
+    ]
+
+
+def _partial_indexes(conn):
+    """
+    Names of partial indexes. Scanning one only visits the rows matching its WHERE.
+    """
+    rows = conn.execute("SELECT name, sql FROM sqlite_master WHERE type = 'index' AND sql IS NOT NULL")
+    return {name for name, sql in rows if re.search(r"\bWHERE\b", sql, re.IGNORECASE)}
+
+
+def _is_full_scan(detail, partial_indexes, subqueries):
+    scan = TABLE_SCAN.match(detail)
+    if not scan or scan.group(1) in subqueries:
+        return False
+    index = SCAN_INDEX.search(detail)
+    return not (index and index.group(1) in partial_indexes)
+
+
+def _trace_pooled_connections(callback):
+    """
+    Pass every SQL statement (with bound values expanded) run by the helpers under test
+    to `callback`: the pool is filled with connections opened and traced here, and the
+    cases run one at a time, so every connection they check out is one of these.
+    """
+    database.close_db_pool()
+    connections = [database.get_db_connection() for _ in range(database.DB_POOL_SIZE)]
+    for conn in connections:
+        conn.set_trace_callback(callback)
+        conn.close()
+
+
+def cmd_check_plans(args):
+    # Only plans are inspected, the LLM client is never called
+    os.environ.setdefault("GOOGLE_API_KEY", "not-needed-for-plan-checks")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        database.DB_NAME = os.path.join(tmp, "plans.db")
+        database.init_db()
+
+        conn = database.get_db_connection()
+        _seed(conn)
+        conn.close()
+
+        captured = []
+        _trace_pooled_connections(captured.append)
+        explain_conn = sqlite3.connect(database.DB_NAME)
+        partial_indexes = _partial_indexes(explain_conn)
+        failures = 0
+
+        try:
+            for name, run in _plan_cases():
+                captured.clear()
+                run()
+                # Trigger bodies are reported once per statement they fire for; check each once
+                statements = [(NESTED_STATEMENT.sub("", sql), bool(NESTED_STATEMENT.match(sql))) for sql in captured]
+                statements = list(dict.fromkeys(
+                    (sql, nested) for sql, nested in statements if not SKIP_STATEMENTS.search(sql)
+                ))
+
+                print(f"== {name}")
+                for sql, nested in statements:
+                    params = [None] * sql.count("?") if nested else []
+                    plan = [row[3] for row in explain_conn.execute(f"EXPLAIN QUERY PLAN {sql}", params)]
+                    # Scanning a subquery's already-limited result (MATERIALIZE m ... SCAN m) is fine
+                    subqueries = {detail.split()[1] for detail in plan if SUBQUERY.match(detail)}
+                    scans = [detail for detail in plan if _is_full_scan(detail, partial_indexes, subqueries)]
+                    print(f"   {'FAIL' if scans else 'ok  '} {' '.join(sql.split())[:100]}")
+                    for detail in plan:
+                        print(f"        {detail}")
+                    if scans:
+                        failures += 1
+        finally:
+            explain_conn.close()
+
+        # The cases above insert, recategorize and delete documents: the counters must have kept up
+        conn = database.get_db_connection()
+        try:
+            mismatches = database.verify_category_counts(conn)
+        finally:
+            conn.close()
+            database.close_db_pool()
+        if mismatches:
+            print(f"\nCategory counters out of sync after the run: {mismatches}")
+            failures += 1
+
+    if failures:
+        print(f"\n{failures} statement(s) fall back to a full table scan.")
+        return 1
+    print("\nAll query plans use indexes.")
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Backend maintenance commands")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("migrate", help="apply pending schema migrations")
+    subparsers.add_parser("check-plans", help="fail if any API query does a full table scan")
+    subparsers.add_parser("verify-counts", help="fail if category counters don't match the documents")
+    subparsers.add_parser("rebuild-counts", help="recompute category counters from the documents")
+    subparsers.add_parser("embed-backfill", help="embed processed documents missing from the semantic index")
+    subparsers.add_parser("prune-thumbnails", help="delete preview images of deleted documents")
+    bench_render = subparsers.add_parser("bench-render", help="compare OCR image sizes with plain PNG rendering")
+    bench_render.add_argument("files", nargs="+")
+    bench = subparsers.add_parser("bench-vectors", help="time semantic top-k queries on synthetic vectors")
+    bench.add_argument("--chunks", type=int, default=100000)
+    bench.add_argument("--dims", type=int, default=768)
+
+    args = parser.parse_args()
+    commands = {
+        "migrate": cmd_migrate,
+        "check-plans": cmd_check_plans,
+        "verify-counts": cmd_verify_counts,
+        "rebuild-counts": cmd_rebuild_counts,
+        "embed-backfill": cmd_embed_backfill,
+        "bench-vectors": cmd_bench_vectors,
+        "prune-thumbnails": cmd_prune_thumbnails,
+        "bench-render": cmd_bench_render,
+    }
+    return commands[args.command](args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,12 +1,24 @@
 
-from fastapi import APIRouter, File, UploadFile, HTTPException, Form, BackgroundTasks
-from fastapi.responses import JSONResponse
-import shutil
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 import os
+import json
 import uuid
-from datetime import datetime
-from database import get_db_connection
-from services.llm_service import process_document
+import base64
+import asyncio
+from datetime import datetime, timezone
+from email.utils import formatdate, parsedate_to_datetime
+from urllib.parse import quote
+from database import get_db_connection, run_db
+from services.job_queue import enqueue_document
+from services import cache_service, suggest_service, embedding_service, thumbnail_service, page_service, event_bus
+from services.upload_service import (
+    receive_multipart, receive_body, store_file, archive_format, iter_archive, UploadError
+)
+from services.search_query import (
+    parse_search, match_expression, page_match_expression, matches_document, build_match_expression,
+    CONTENT_COLUMNS, SearchQueryError
+)
 import pydantic
 
 router = APIRouter()
@@ -15,56 +27,96 @@ UPLOAD_DIR = "uploads"
 ALLOWED_EXTENSIONS = {".jpg", ".jpeg", ".png", ".pdf"}
 MAX_FILE_SIZE = 10 * 1024 * 1024  # 10 MB
 
-@router.post("/api/documents")
-async def upload_document(
-    background_tasks: BackgroundTasks,
-    file: UploadFile = File(...),
-    user_id: str = Form(...)  # Get user_id from form data
-):
-    try:
-        # 1. Validate File
-        file_ext = os.path.splitext(file.filename)[1].lower()
-        if file_ext not in ALLOWED_EXTENSIONS:
-            raise HTTPException(status_code=400, detail="Invalid file type. Only JPG, PNG, and PDF allowed.")
-        
-        # Check file size (Note: UploadFile doesn't strictly enforce size before reading, 
-        # but we can check content-length header or read chunks. 
-        # For simplicity in this learning context, we trust content-length or handle during write, 
-        # but here we'll assume basic validation passed or add chunk reading if needed.
-        # Let's trust content-length if available for now for quick rejection)
-        # if file.size > MAX_FILE_SIZE: ... (UploadFile.size isn't always available directly without spooling)
-
-        # 2. Prepare Storage
-        if not os.path.exists(UPLOAD_DIR):
-            os.makedirs(UPLOAD_DIR)
-
-        # Generate unique filename
-        unique_filename = f"{uuid.uuid4()}{file_ext}"
-        file_path = os.path.join(UPLOAD_DIR, unique_filename)
-
-        # 3. Save File
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-
-        # 4. Prepare Metadata
-        title = file.filename
-        content_type = file.content_type
-        file_size = os.path.getsize(file_path)
-
-        # 5. Save to Database
-        conn = get_db_connection()
-        cursor = conn.cursor()
+# Multipart body is parsed by hand (see services/upload_service.py), so describe it for /docs
+UPLOAD_REQUEST_SCHEMA = {
+    "requestBody": {
+        "required": True,
+        "content": {
+            "multipart/form-data": {
+                "schema": {
+                    "type": "object",
+                    "required": ["file", "user_id"],
+                    "properties": {
+                        "file": {"type": "string", "format": "binary"},
+                        "user_id": {"type": "string"}
+                    }
+                }
+            }
+        }
+    }
+}
+
+def _insert_uploaded_document(conn, user_id: str, file_info: dict):
+    """
+    Helper function to insert a stored upload and queue it for processing.
+    Re-uploads of an already processed file reuse its results and skip the LLM; their
+    job only renders the previews and indexes them for semantic search.
+    Runs inside the caller's transaction; returns the new document id.
+    """
+    cursor = conn.cursor()
+    cached = cache_service.lookup_document(file_info['content_hash'], conn=conn)
+
+    if cached:
         cursor.execute('''
-            INSERT INTO documents (user_id, filename, file_path, title, content_type, file_size)
-            VALUES (?, ?, ?, ?, ?, ?)
-        ''', (user_id, unique_filename, file_path, title, content_type, file_size))
-        
+            INSERT INTO documents (user_id, filename, file_path, title, content_type, file_size,
+                                   content_hash, extracted_text, category, processing_status)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, 'completed')
+        ''', (user_id, file_info['filename'], file_info['file_path'], file_info['title'],
+              file_info['content_type'], file_info['file_size'], file_info['content_hash'],
+              cached['extracted_text'], cached['category']))
         document_id = cursor.lastrowid
+        page_service.store_pages(document_id, cached['extracted_text'], conn=conn)
+        enqueue_document(document_id, user_id, file_info['file_path'], conn=conn, options={"mode": "index"})
+        return document_id
+
+    cursor.execute('''
+        INSERT INTO documents (user_id, filename, file_path, title, content_type, file_size, content_hash)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''', (user_id, file_info['filename'], file_info['file_path'], file_info['title'],
+          file_info['content_type'], file_info['file_size'], file_info['content_hash']))
+    document_id = cursor.lastrowid
+
+    # Queue Processing (same transaction, so a crash can't lose the job)
+    enqueue_document(document_id, user_id, file_info['file_path'], conn=conn)
+    return document_id
+
+def _save_uploaded_document(user_id: str, file_info: dict):
+    conn = get_db_connection()
+    try:
+        document_id = _insert_uploaded_document(conn, user_id, file_info)
         conn.commit()
+        return document_id
+    finally:
         conn.close()
 
-        # 6. Trigger Background Processing
-        background_tasks.add_task(process_document, document_id, file_path)
+@router.post("/api/documents", openapi_extra=UPLOAD_REQUEST_SCHEMA)
+async def upload_document(request: Request):
+    """
+    Upload a document (multipart form: `file`, `user_id`).
+    The body is streamed: the size limit is enforced while bytes arrive, the real
+    type is sniffed from magic bytes and the content hash is computed in the same pass.
+    """
+    try:
+        # 1. Validate and Save File (streamed straight to UPLOAD_DIR)
+        try:
+            fields, files = await receive_multipart(request, UPLOAD_DIR, MAX_FILE_SIZE, ALLOWED_EXTENSIONS)
+        except UploadError as ue:
+            raise HTTPException(status_code=ue.status_code, detail=ue.detail)
+
+        user_id = fields.get("user_id")
+        if not files or not user_id:
+            for file_info in files:
+                os.remove(file_info['file_path'])
+            raise HTTPException(status_code=400, detail="Both 'file' and 'user_id' are required.")
+
+        file_info = files[0]
+        title = file_info['title']
+        file_path = file_info['file_path']
+
+        # 2. Save to Database
+        document_id = await run_db(_save_uploaded_document, user_id, file_info)
+        suggest_service.invalidate_user(user_id)
+        event_bus.publish(user_id, "created", document_ids=[document_id])
 
         return JSONResponse(
             status_code=201,
@@ -78,66 +130,310 @@ async def upload_document(
             }
         )
 
+    except HTTPException as he:
+        raise he
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@router.get("/api/documents")
-async def get_documents(user_id: str, category: str = None):
+# Bulk upload: many files in one request, stored and inserted in batched transactions
+BULK_MAX_FILES = int(os.getenv("BULK_MAX_FILES", "1000"))
+BULK_MAX_ARCHIVE_SIZE = int(os.getenv("BULK_MAX_ARCHIVE_MB", "2048")) * 1024 * 1024
+BULK_BATCH_SIZE = 100
+
+BULK_UPLOAD_REQUEST_SCHEMA = {
+    "requestBody": {
+        "required": True,
+        "content": {
+            "multipart/form-data": {
+                "schema": {
+                    "type": "object",
+                    "required": ["file"],
+                    "properties": {
+                        "file": {"type": "array", "items": {"type": "string", "format": "binary"}}
+                    }
+                }
+            },
+            "application/zip": {"schema": {"type": "string", "format": "binary"}},
+            "application/x-tar": {"schema": {"type": "string", "format": "binary"}},
+        }
+    }
+}
+
+def _save_uploaded_batch(user_id: str, file_infos: list):
     """
-    Retrieve all documents for a specific user, optionally filtered by category.
+    Helper function to insert a batch of stored uploads in one transaction. Returns their ids.
     """
+    conn = get_db_connection()
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        if category and category != "All Categories":
-            cursor.execute('''
-                SELECT id, title, upload_date, content_type, file_path, extracted_text, processing_status, category 
-                FROM documents 
-                WHERE user_id = ? AND category = ?
-                ORDER BY upload_date DESC
-            ''', (user_id, category))
+        document_ids = [_insert_uploaded_document(conn, user_id, file_info) for file_info in file_infos]
+        conn.commit()
+        return document_ids
+    finally:
+        conn.close()
+
+def _store_archive_entry(name: str, open_entry):
+    with open_entry() as entry:
+        return store_file(entry, name, UPLOAD_DIR, MAX_FILE_SIZE, ALLOWED_EXTENSIONS)
+
+async def _multipart_items(files: list):
+    for index, file_info in enumerate(files):
+        if "error" in file_info:
+            yield index, file_info['title'], None, file_info['error']
+        else:
+            yield index, file_info['title'], file_info, None
+
+async def _archive_items(archive_path: str):
+    """
+    Store the archive's files one by one (off the event loop), then delete the archive.
+    Yields (index, name, file_info, None) or (index, name, None, error).
+    """
+    entries = iter_archive(archive_path)
+    try:
+        index = 0
+        while True:
+            entry = await asyncio.to_thread(next, entries, None)
+            if entry is None:
+                break
+            name, open_entry = entry
+            if index >= BULK_MAX_FILES:
+                yield index, name, None, f"Too many files. Maximum is {BULK_MAX_FILES} per upload."
+                break
+            try:
+                yield index, name, await asyncio.to_thread(_store_archive_entry, name, open_entry), None
+            except Exception as e:
+                # Wrong type, too large, or a damaged entry: report it and go on
+                yield index, name, None, str(e)
+            index += 1
+    finally:
+        await asyncio.to_thread(entries.close)
+        await asyncio.to_thread(os.remove, archive_path)
+
+async def _bulk_ingest(user_id: str, items):
+    """
+    Insert stored uploads in batches of BULK_BATCH_SIZE, yielding one NDJSON line
+    per file as its batch commits, then a summary line.
+    """
+    counts = {"created": 0, "rejected": 0, "failed": 0}
+    batch = []
+
+    async def save_batch():
+        try:
+            document_ids = await run_db(_save_uploaded_batch, user_id, [info for _, _, info in batch])
+            event_bus.publish(user_id, "created", document_ids=document_ids)
+            results = [
+                {"index": index, "name": name, "status": "created", "document_id": document_id}
+                for (index, name, _), document_id in zip(batch, document_ids)
+            ]
+        except Exception as e:
+            for _, _, info in batch:
+                await asyncio.to_thread(os.remove, info['file_path'])
+            results = [{"index": index, "name": name, "status": "failed", "detail": str(e)} for index, name, _ in batch]
+        batch.clear()
+        for result in results:
+            counts[result['status']] += 1
+        return "".join(json.dumps(result) + "\n" for result in results)
+
+    error = None
+    try:
+        try:
+            async for index, name, file_info, rejection in items:
+                if rejection:
+                    counts["rejected"] += 1
+                    yield json.dumps({"index": index, "name": name, "status": "rejected", "detail": rejection}) + "\n"
+                    continue
+                batch.append((index, name, file_info))
+                if len(batch) >= BULK_BATCH_SIZE:
+                    yield await save_batch()
+        except Exception as e:
+            # Unreadable archive: keep what was stored so far
+            error = str(e)
+        if batch:
+            yield await save_batch()
+        yield json.dumps({"done": True, **counts, "error": error}) + "\n"
+    finally:
+        await items.aclose()
+        # Client went away mid-batch: drop the files that never got a row
+        for _, _, info in batch:
+            if os.path.exists(info['file_path']):
+                os.remove(info['file_path'])
+        if counts["created"]:
+            suggest_service.invalidate_user(user_id)
+
+@router.post("/api/documents/bulk", openapi_extra=BULK_UPLOAD_REQUEST_SCHEMA)
+async def bulk_upload_documents(request: Request, user_id: str):
+    """
+    Upload many documents at once: a multipart form with any number of `file` parts,
+    or a ZIP / TAR (optionally compressed) archive as the raw request body.
+    Responds with NDJSON: one line per file ({index, name, status, document_id | detail})
+    as soon as its batch is saved, and a final {done, created, rejected, failed} line.
+    """
+    try:
+        if request.headers.get("content-type", "").startswith("multipart/form-data"):
+            try:
+                _, files = await receive_multipart(
+                    request, UPLOAD_DIR, MAX_FILE_SIZE, ALLOWED_EXTENSIONS,
+                    max_files=BULK_MAX_FILES, collect_errors=True
+                )
+            except UploadError as ue:
+                raise HTTPException(status_code=ue.status_code, detail=ue.detail)
+            if not files:
+                raise HTTPException(status_code=400, detail="No files uploaded.")
+            items = _multipart_items(files)
         else:
-            cursor.execute('''
-                SELECT id, title, upload_date, content_type, file_path, extracted_text, processing_status, category 
-                FROM documents 
-                WHERE user_id = ? 
-                ORDER BY upload_date DESC
-            ''', (user_id,))
+            if not os.path.exists(UPLOAD_DIR):
+                os.makedirs(UPLOAD_DIR)
+            archive_path = os.path.join(UPLOAD_DIR, f".bulk-{uuid.uuid4()}.part")
+            try:
+                await receive_body(request, archive_path, BULK_MAX_ARCHIVE_SIZE)
+            except UploadError as ue:
+                raise HTTPException(status_code=ue.status_code, detail=ue.detail)
+            if await asyncio.to_thread(archive_format, archive_path) is None:
+                await asyncio.to_thread(os.remove, archive_path)
+                raise HTTPException(status_code=400, detail="Expected a ZIP or TAR archive, or a multipart form of files.")
+            items = _archive_items(archive_path)
+
+        return StreamingResponse(_bulk_ingest(user_id, items), media_type="application/x-ndjson")
+
+    except HTTPException as he:
+        raise he
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+PREVIEW_CHARS = 150
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+# Response field -> SQL expression needed to build it (id/upload_date are always fetched for the cursor).
+# The preview is cut inside SQLite so full extracted texts never leave the database.
+LIST_FIELDS = {
+    "id": [],
+    "date": [],
+    "title": ["title"],
+    "category": ["category"],
+    "status": ["processing_status"],
+    "preview": [f"substr(extracted_text, 1, {PREVIEW_CHARS + 1}) AS preview_text", "processing_status"],
+    "file_path": ["file_path"],
+    "content_type": ["content_type"],
+    "progress": ["pages_done", "pages_total"],
+}
+DEFAULT_LIST_FIELDS = ["id", "title", "category", "date", "preview", "status", "progress", "file_path"]
+
+def _encode_cursor(upload_date: str, document_id: int):
+    return base64.urlsafe_b64encode(f"{upload_date}|{document_id}".encode()).decode()
+
+def _decode_cursor(cursor: str):
+    try:
+        upload_date, document_id = base64.urlsafe_b64decode(cursor.encode()).decode().rsplit("|", 1)
+        return upload_date, int(document_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def _list_documents(user_id: str, category: str = None, limit: int = DEFAULT_PAGE_SIZE,
+                    after: tuple = None, fields=DEFAULT_LIST_FIELDS):
+    """
+    Helper function to fetch one page of a user's documents, newest first, optionally
+    filtered by category. Keyset pagination on (upload_date, id): `after` is the
+    (upload_date, id) of the last row of the previous page. Fetches limit + 1 rows
+    so the caller can tell whether another page exists.
+    """
+    columns = ["id", "upload_date"]
+    for field in fields:
+        for column in LIST_FIELDS[field]:
+            if column not in columns:
+                columns.append(column)
+
+    conditions = ["user_id = ?"]
+    params = [user_id]
+    if category and category != "All Categories":
+        conditions.append("category = ?")
+        params.append(category)
+    if after:
+        conditions.append("(upload_date, id) < (?, ?)")
+        params.extend(after)
+
+    sql = f'''
+        SELECT {", ".join(columns)}
+        FROM documents
+        WHERE {" AND ".join(conditions)}
+        ORDER BY upload_date DESC, id DESC
+        LIMIT ?
+    '''
+    params.append(limit + 1)
+
+    conn = get_db_connection()
+    try:
+        return conn.execute(sql, params).fetchall()
+    finally:
+        conn.close()
+
+def _build_preview(row):
+    # Create a preview of the text (first 150 chars)
+    if row['preview_text']:
+        text = row['preview_text']
+        return text[:PREVIEW_CHARS] + "..." if len(text) > PREVIEW_CHARS else text
+    elif row['processing_status'] == 'processing':
+        return "Processing document..."
+    elif row['processing_status'] == 'failed':
+        return "Processing failed."
+    return "No text extracted."
+
+@router.get("/api/documents")
+async def get_documents(user_id: str, category: str = None, limit: int = DEFAULT_PAGE_SIZE,
+                        cursor: str = None, fields: str = None):
+    """
+    Retrieve a page of documents for a specific user, optionally filtered by category.
+    Pass the returned `next_cursor` as `cursor` to get the following page.
+    `fields` is an optional comma-separated subset of the document fields to return.
+    """
+    try:
+        limit = max(1, min(limit, MAX_PAGE_SIZE))
+        after = _decode_cursor(cursor) if cursor else None
+
+        selected = DEFAULT_LIST_FIELDS
+        if fields:
+            selected = [f.strip() for f in fields.split(",") if f.strip()]
+            unknown = [f for f in selected if f not in LIST_FIELDS]
+            if unknown:
+                raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+
+        rows = await run_db(_list_documents, user_id, category, limit, after, selected)
+        has_more = len(rows) > limit
+        rows = rows[:limit]
         
         documents = []
-        rows = cursor.fetchall()
         
         for row in rows:
-            # Create a preview of the text (first 150 chars)
-            preview_text = ""
-            if row['extracted_text']:
-                preview_text = row['extracted_text'][:150] + "..." if len(row['extracted_text']) > 150 else row['extracted_text']
-            elif row['processing_status'] == 'processing':
-                preview_text = "Processing document..."
-            elif row['processing_status'] == 'failed':
-                preview_text = "Processing failed."
-            else:
-                preview_text = "No text extracted."
-
-            documents.append({
-                "id": row['id'],
-                "title": row['title'],
-                "category": row['category'] if row['category'] else "Uncategorized", 
-                "date": row['upload_date'], # You might want to format this
-                "preview": preview_text,
-                "status": row['processing_status'],
-                "file_path": row['file_path'] # Optional, depending on if frontend needs it direct
-            })
-            
-        conn.close()
+            document = {}
+            for field in selected:
+                if field == "id":
+                    document["id"] = row['id']
+                elif field == "date":
+                    document["date"] = row['upload_date']
+                elif field == "category":
+                    document["category"] = row['category'] if row['category'] else "Uncategorized"
+                elif field == "status":
+                    document["status"] = row['processing_status']
+                elif field == "preview":
+                    document["preview"] = _build_preview(row)
+                elif field == "progress":
+                    document["pages_done"] = row['pages_done']
+                    document["pages_total"] = row['pages_total']
+                else:
+                    document[field] = row[field]
+            documents.append(document)
         
+        next_cursor = _encode_cursor(rows[-1]['upload_date'], rows[-1]['id']) if has_more else None
+
         return {
             "success": True,
             "count": len(documents),
-            "documents": documents
+            "documents": documents,
+            "has_more": has_more,
+            "next_cursor": next_cursor
         }
 
+    except HTTPException as he:
+        raise he
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -147,7 +443,7 @@ async def get_categories(user_id: str):
     Retrieve all categories with document counts.
     """
     try:
-        categories = _get_categories_with_counts(user_id)
+        categories = await run_db(_get_categories_with_counts, user_id)
         return {
             "success": True,
             "categories": categories
@@ -155,23 +451,32 @@ async def get_categories(user_id: str):
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@router.get("/api/documents/{document_id}")
-async def get_document_details(document_id: int, user_id: str):
+def _get_document(document_id: int, user_id: str):
     """
-    Retrieve details for a single document.
+    Helper function to fetch a single document owned by the user (or None).
     """
+    conn = get_db_connection()
+    cursor = conn.cursor()
+
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
         cursor.execute('''
-            SELECT id, title, upload_date, content_type, file_path, extracted_text, processing_status, file_size, category
+            SELECT id, title, upload_date, content_type, file_path, extracted_text, processing_status, file_size, category,
+                   pages_done, pages_total
             FROM documents 
             WHERE id = ? AND user_id = ?
         ''', (document_id, user_id))
         
-        row = cursor.fetchone()
+        return cursor.fetchone()
+    finally:
         conn.close()
+
+@router.get("/api/documents/{document_id}")
+async def get_document_details(document_id: int, user_id: str):
+    """
+    Retrieve details for a single document.
+    """
+    try:
+        row = await run_db(_get_document, document_id, user_id)
         
         if not row:
             raise HTTPException(status_code=404, detail="Document not found")
@@ -186,6 +491,8 @@ async def get_document_details(document_id: int, user_id: str):
                 "content_type": row['content_type'],
                 "file_size": row['file_size'],
                 "status": row['processing_status'],
+                "pages_done": row['pages_done'],
+                "pages_total": row['pages_total'],
                 "extracted_text": row['extracted_text'],
                 "file_path": row['file_path']
             }
@@ -198,41 +505,150 @@ async def get_document_details(document_id: int, user_id: str):
 
 from fastapi.responses import FileResponse
 
-@router.get("/api/documents/file/{document_id}")
-async def get_document_file(document_id: int, user_id: str):
+# A document's file never changes after upload, so its content hash is a strong
+# validator: a browser or PDF viewer revalidating its copy gets an empty 304.
+FILE_CACHE_MAX_AGE = int(os.getenv("FILE_CACHE_MAX_AGE", "3600"))
+# Let a front proxy send the bytes instead of streaming them through Python:
+#   nginx    - X-Accel-Redirect: FILE_OFFLOAD_PREFIX + the stored path (an `internal` location)
+#   sendfile - X-Sendfile: absolute path (Apache mod_xsendfile, lighttpd)
+FILE_OFFLOAD = os.getenv("FILE_OFFLOAD", "").lower()
+FILE_OFFLOAD_PREFIX = os.getenv("FILE_OFFLOAD_PREFIX", "/protected/")
+
+def _http_date(timestamp: str):
     """
-    Serve the original file for a document.
+    SQLite CURRENT_TIMESTAMP (UTC) as an HTTP date, or None if it can't be parsed.
     """
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('SELECT file_path, content_type FROM documents WHERE id = ? AND user_id = ?', (document_id, user_id))
-        row = cursor.fetchone()
+        moment = datetime.strptime(timestamp[:19], "%Y-%m-%d %H:%M:%S").replace(tzinfo=timezone.utc)
+    except (TypeError, ValueError):
+        return None
+    return formatdate(moment.timestamp(), usegmt=True)
+
+def _is_not_modified(request: Request, etag: str, last_modified: str = None):
+    """
+    Whether the client's cached copy is current (If-None-Match, else If-Modified-Since).
+    """
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+        return "*" in tags or etag in tags
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since and last_modified:
+        try:
+            return parsedate_to_datetime(if_modified_since) >= parsedate_to_datetime(last_modified)
+        except (TypeError, ValueError):
+            return False
+    return False
+
+async def _send_file(path: str, media_type: str, headers: dict, filename: str = None):
+    """
+    Response for a stored file: handed to the proxy when FILE_OFFLOAD is set, otherwise
+    a FileResponse (which answers Range / If-Range requests with 206 partial content).
+    """
+    if filename:
+        headers["Content-Disposition"] = f'inline; filename="{filename}"'
+    if FILE_OFFLOAD == "nginx":
+        headers["X-Accel-Redirect"] = FILE_OFFLOAD_PREFIX + quote(os.path.normpath(path).replace(os.sep, "/").lstrip("/"))
+        return Response(media_type=media_type, headers=headers)
+    if FILE_OFFLOAD == "sendfile":
+        headers["X-Sendfile"] = os.path.abspath(path)
+        return Response(media_type=media_type, headers=headers)
+
+    # One stat, shared with FileResponse (it would otherwise stat again)
+    stat_result = await asyncio.to_thread(os.stat, path)
+    return FileResponse(path, media_type=media_type, headers=headers, stat_result=stat_result)
+
+def _get_document_file(document_id: int, user_id: str):
+    """
+    Helper function to fetch the stored file location of a document (or None).
+    """
+    conn = get_db_connection()
+
+    try:
+        return conn.execute(
+            'SELECT id, file_path, content_type, content_hash, upload_date FROM documents WHERE id = ? AND user_id = ?',
+            (document_id, user_id)
+        ).fetchone()
+    finally:
         conn.close()
+
+@router.get("/api/documents/file/{document_id}")
+async def get_document_file(document_id: int, user_id: str, request: Request):
+    """
+    Serve the original file for a document. Supports conditional requests
+    (If-None-Match / If-Modified-Since) and byte ranges for partial loading.
+    """
+    try:
+        row = await run_db(_get_document_file, document_id, user_id)
         
         if not row:
             raise HTTPException(status_code=404, detail="Document not found")
             
         file_path = row['file_path']
-        content_type = row['content_type']
-        
-        if not os.path.exists(file_path):
-            raise HTTPException(status_code=404, detail="File not found on server")
-            
-        return FileResponse(
-            file_path, 
-            media_type=content_type, 
-            filename=os.path.basename(file_path),
-            content_disposition_type='inline'
-        )
+        content_hash = await cache_service.ensure_content_hash(row['id'], file_path, row['content_hash'])
+        headers = {
+            "ETag": f'"{content_hash}"',
+            "Cache-Control": f"private, max-age={FILE_CACHE_MAX_AGE}",
+        }
+        last_modified = _http_date(row['upload_date'])
+        if last_modified:
+            headers["Last-Modified"] = last_modified
+
+        if _is_not_modified(request, headers["ETag"], last_modified):
+            return Response(status_code=304, headers=headers)
+
+        return await _send_file(file_path, row['content_type'], headers, filename=os.path.basename(file_path))
 
     except HTTPException as he:
         raise he
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="File not found on server")
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@router.get("/api/documents/{document_id}/thumbnail")
+async def get_document_thumbnail(document_id: int, user_id: str, request: Request,
+                                 size: str = thumbnail_service.DEFAULT_THUMBNAIL_SIZE, page: int = 1):
+    """
+    Serve a JPEG preview of one page of a document (the image itself for image uploads).
+    `size` is one of small / medium / large. Previews never change, so browsers
+    may cache them indefinitely and revalidate with If-None-Match.
+    """
+    try:
+        if size not in thumbnail_service.THUMBNAIL_SIZES:
+            raise HTTPException(
+                status_code=400,
+                detail=f"size must be one of: {', '.join(thumbnail_service.THUMBNAIL_SIZES)}"
+            )
+        if page < 1:
+            raise HTTPException(status_code=400, detail="page must be 1 or greater")
+
+        row = await run_db(_get_document_file, document_id, user_id)
+        if not row:
+            raise HTTPException(status_code=404, detail="Document not found")
+
+        content_hash = await cache_service.ensure_content_hash(row['id'], row['file_path'], row['content_hash'])
+        headers = {
+            "ETag": thumbnail_service.thumbnail_etag(content_hash, size, page),
+            "Cache-Control": thumbnail_service.THUMBNAIL_CACHE_CONTROL,
+        }
+        if _is_not_modified(request, headers["ETag"]):
+            return Response(status_code=304, headers=headers)
+
+        path = await thumbnail_service.get_thumbnail(row['file_path'], content_hash, size, page)
+        if path is None:
+            raise HTTPException(status_code=404, detail="Page not found")
+
+        return await _send_file(path, "image/jpeg", headers)
+
+    except HTTPException as he:
+        raise he
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="File not found on server")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
 
 # Helper Functions for Category Management
 def _get_categories_with_counts(user_id: str):
@@ -243,34 +659,27 @@ def _get_categories_with_counts(user_id: str):
     cursor = conn.cursor()
     
     try:
-        # Group by category and count documents
+        # Counters maintained by triggers (see database._migration_3_category_counts),
+        # one row per category in use, so this doesn't touch the documents table
         cursor.execute('''
-            SELECT category, COUNT(*) as count
-            FROM documents 
+            SELECT category, count
+            FROM category_counts
             WHERE user_id = ?
-            GROUP BY category
         ''', (user_id,))
         
         rows = cursor.fetchall()
-        categories = []
         
         # Define standard categories to ensure they always appear even if count is 0
         standard_categories = ["Invoice", "Receipt", "Contract", "Note", "Letter", "Form", "Other", "Uncategorized"]
         category_counts = {cat: 0 for cat in standard_categories}
+        standard_by_lower = {cat.lower(): cat for cat in standard_categories}
         
         # Update with actual counts
         for row in rows:
             cat_name = row['category'] if row['category'] else "Uncategorized"
-            # Normalize case just in case
-            found = False
-            for std_cat in standard_categories:
-                if std_cat.lower() == cat_name.lower():
-                    category_counts[std_cat] += row['count']
-                    found = True
-                    break
-            if not found:
-                # Add non-standard categories if any
-                category_counts[cat_name] = row['count']
+            # Normalize case just in case; non-standard categories are kept as-is
+            cat_name = standard_by_lower.get(cat_name.lower(), cat_name)
+            category_counts[cat_name] = category_counts.get(cat_name, 0) + row['count']
         
         # Convert to list
         result = [{"name": cat, "count": count} for cat, count in category_counts.items()]
@@ -308,88 +717,288 @@ def _update_document_category(document_id: int, user_id: str, new_category: str)
     finally:
         conn.close()
 
-def _search_documents(user_id: str, query: str):
+# Search ranking: bm25() weight per FTS column (title, extracted_text, category).
+# A title hit outranks the same term buried in a long OCR text.
+SEARCH_WEIGHT_TITLE = float(os.getenv("SEARCH_WEIGHT_TITLE", "10"))
+SEARCH_WEIGHT_TEXT = float(os.getenv("SEARCH_WEIGHT_TEXT", "1"))
+SEARCH_WEIGHT_CATEGORY = float(os.getenv("SEARCH_WEIGHT_CATEGORY", "5"))
+# user_id gets 0 so it never affects ranking
+SEARCH_RANK = f"bm25({SEARCH_WEIGHT_TITLE}, {SEARCH_WEIGHT_TEXT}, {SEARCH_WEIGHT_CATEGORY}, 0.0)"
+DEFAULT_SEARCH_LIMIT = 20
+MAX_SEARCH_LIMIT = 100
+
+def _match_unfinished_documents(conn, user_id: str, query, page_term: str):
+    """
+    Ids of the user's pending/processing documents, newest first, that match `query`
+    only through the pages stored so far: their text reaches documents_fts when they
+    complete. Each term is looked up in the document's pages and its documents_fts row
+    (title, category, and the previous text while reprocessing), so AND/NOT work across
+    pages like they do on whole documents.
+    """
+    if page_term is None:
+        # No term can match pages: documents_fts already decides
+        return []
+
+    documents = conn.execute('''
+        SELECT d.id FROM documents d
+        WHERE d.processing_status IN ('pending', 'processing') AND d.user_id = ?
+          AND EXISTS (SELECT 1 FROM document_pages p WHERE p.id BETWEEN d.id * ? + 1 AND d.id * ? + ?)
+        ORDER BY d.id DESC
+    ''', (user_id, page_service.PAGE_ID_SPAN, page_service.PAGE_ID_SPAN, page_service.PAGE_ID_SPAN - 1)).fetchall()
+
+    def indexed_match(document_id, expression):
+        return conn.execute(
+            "SELECT 1 FROM documents_fts WHERE documents_fts MATCH ? AND rowid = ?",
+            (expression, document_id)
+        ).fetchone() is not None
+
+    matched = []
+    for document in documents:
+        document_id = document['id']
+        if indexed_match(document_id, build_match_expression(user_id, match_expression(query))):
+            continue  # ranked with the documents_fts matches
+
+        def match_term(term, column):
+            columns = (column,) if column else CONTENT_COLUMNS
+            if indexed_match(document_id, build_match_expression(user_id, term, columns)):
+                return True
+            return column in (None, "extracted_text") and conn.execute(
+                "SELECT 1 FROM document_pages_fts WHERE document_pages_fts MATCH ? AND rowid BETWEEN ? AND ?",
+                (term, *page_service.page_id_range(document_id))
+            ).fetchone() is not None
+
+        if matches_document(query, match_term):
+            matched.append(document_id)
+    return matched
+
+def _search_documents(user_id: str, query, limit: int = DEFAULT_SEARCH_LIMIT, offset: int = 0):
     """
-    Helper function to perform full-text search on documents.
+    Helper function to perform full-text search on documents. `query` is a parse_search()
+    tree, matched against each document as a whole (documents_fts). Documents still
+    being processed are matched on the pages stored so far and listed first (see
+    _match_unfinished_documents). page_match_expression() then finds each result's best
+    matching page (document_pages_fts) for `page` and the snippet; `page` is None when
+    no page matches it (e.g. a title match) and the snippet is the text preview.
+    Returns up to limit + 1 results, best match first, so the caller can tell whether
+    another page exists.
     """
+    page_term = page_match_expression(query)
     conn = get_db_connection()
-    cursor = conn.cursor()
     
     try:
-        # FTS5 Query
-        # We join back to the main documents table to get all metadata
-        # We use snippet() to highlight matches in extracted_text
-        # snippet(documents_fts, column_index, start_marker, end_marker, trailing_text, max_tokens)
-        
-        # IMPORTANT: FTS queries can be complex. We need to sanitize safely or use parameters.
-        # SQLite FTS parameters work for the match phrase.
-        
-        # For simplicity in this learning step, we use the standard match operator.
-        # Ideally, we should sanitize `query` to prevent malformed FTS syntax errors.
-        # A simple way is to wrap it in quotes if it doesn't have them, or just pass it as param.
-        
-        # Search against title, category, and extracted_text
-        # We'll construct a query that matches any.
-        
-        # Note: FTS5 requires matching the virtual table. 
-        # Rowid joins virtual table to main table.
-        
-        sql = '''
-            SELECT 
-                d.id, d.title, d.category, d.upload_date, d.processing_status,
-                snippet(documents_fts, 1, '<b>', '</b>', '...', 15) as snippet
-            FROM documents d
-            JOIN documents_fts fts ON d.id = fts.rowid
-            WHERE documents_fts MATCH ? AND d.user_id = ?
-            ORDER BY rank
-        '''
-        
-        # We'll use prefix search for better UX (append *)
-        # Wrap query in quotes to handle special characters (like hyphens) and treat as phrase
-        search_term = f'"{query}"*'
-        
-        cursor.execute(sql, (search_term, user_id))
-        rows = cursor.fetchall()
+        unfinished = _match_unfinished_documents(conn, user_id, query, page_term)
+        unfinished_ids = unfinished[offset:offset + limit + 1]
+        rows = []
+        if unfinished_ids:
+            found = {row['id']: row for row in conn.execute(f'''
+                SELECT id, title, category, upload_date, processing_status,
+                       substr(extracted_text, 1, {PREVIEW_CHARS + 1}) AS preview_text
+                FROM documents WHERE id IN ({", ".join("?" * len(unfinished_ids))})
+            ''', unfinished_ids)}
+            rows = [found[document_id] for document_id in unfinished_ids if document_id in found]
+
+        if len(unfinished_ids) <= limit:
+            # ORDER BY rank lets FTS5 sort the matches itself. No snippet is built here, so
+            # the rows skipped by OFFSET cost only their rank.
+            rows += conn.execute(f'''
+                SELECT 
+                    d.id, d.title, d.category, d.upload_date, d.processing_status,
+                    substr(d.extracted_text, 1, {PREVIEW_CHARS + 1}) AS preview_text
+                FROM documents_fts fts
+                JOIN documents d ON d.id = fts.rowid
+                WHERE documents_fts MATCH ? AND rank MATCH ? AND d.user_id = ?
+                ORDER BY rank
+                LIMIT ? OFFSET ?
+            ''', (build_match_expression(user_id, match_expression(query)), SEARCH_RANK, user_id,
+                  limit + 1 - len(unfinished_ids), max(0, offset - len(unfinished)))).fetchall()
         
         results = []
         for row in rows:
+            page = None
+            if page_term:
+                # The document's pages are a rowid range of the page index; only the best
+                # page's snippet is built
+                # snippet(table, column_index, start_marker, end_marker, trailing_text, max_tokens)
+                page = conn.execute('''
+                    SELECT p.page_number, snippet(document_pages_fts, 0, '<b>', '</b>', '...', 15) as snippet
+                    FROM document_pages_fts fts
+                    JOIN document_pages p ON p.id = fts.rowid
+                    WHERE document_pages_fts MATCH ? AND fts.rowid BETWEEN ? AND ?
+                    ORDER BY rank
+                    LIMIT 1
+                ''', (page_term, *page_service.page_id_range(row['id']))).fetchone()
             results.append({
                 "id": row['id'],
                 "title": row['title'],
                 "category": row['category'],
                 "date": row['upload_date'],
                 "status": row['processing_status'],
-                "snippet": row['snippet']
+                "page": page['page_number'] if page else None,
+                "snippet": page['snippet'] if page else _build_preview(row)
             })
             
         return results
         
-    except Exception as e:
-        print(f"Search error: {e}")
-        return []
     finally:
         conn.close()
 
+def _count_search_matches(user_id: str, query):
+    """
+    Helper function to count a search's matching documents without ranking or building snippets.
+    """
+    conn = get_db_connection()
+    
+    try:
+        row = conn.execute('''
+            SELECT COUNT(*) as count
+            FROM documents_fts fts
+            JOIN documents d ON d.id = fts.rowid
+            WHERE documents_fts MATCH ? AND d.user_id = ?
+        ''', (build_match_expression(user_id, match_expression(query)), user_id)).fetchone()
+        unfinished = _match_unfinished_documents(conn, user_id, query, page_match_expression(query))
+        return row['count'] + len(unfinished)
+        
+    finally:
+        conn.close()
+
+SEARCH_MODES = ("keyword", "semantic", "hybrid")
+SEMANTIC_MAX_RESULTS = 200   # how deep semantic/hybrid results can be paged
+RRF_K = 60                   # reciprocal rank fusion constant
+CHUNK_SNIPPET_CHARS = 200
+
+def _chunk_snippet(chunk: str):
+    chunk = " ".join(chunk.split())
+    return chunk[:CHUNK_SNIPPET_CHARS] + "..." if len(chunk) > CHUNK_SNIPPET_CHARS else chunk
+
+def _semantic_result(doc):
+    return {
+        "id": doc['id'],
+        "title": doc['title'],
+        "category": doc['category'],
+        "date": doc['upload_date'],
+        "status": doc['processing_status'],
+        "snippet": _chunk_snippet(doc['chunk']),
+        "score": doc['score']
+    }
+
+def _fuse_rankings(keyword_results, semantic_docs):
+    """
+    Reciprocal rank fusion: each document scores sum(1 / (RRF_K + rank)) over the
+    keyword (bm25) and semantic rankings it appears in. Ranks rather than raw scores
+    are combined, since bm25 and cosine similarity aren't on comparable scales.
+    Keyword snippets (with highlighted matches) are preferred over chunk snippets.
+    """
+    scores = {}
+    results = {}
+    for rank, result in enumerate(keyword_results):
+        scores[result['id']] = scores.get(result['id'], 0) + 1 / (RRF_K + rank + 1)
+        results[result['id']] = result
+    for rank, doc in enumerate(semantic_docs):
+        scores[doc['id']] = scores.get(doc['id'], 0) + 1 / (RRF_K + rank + 1)
+        results.setdefault(doc['id'], _semantic_result(doc))
+    ranked = sorted(scores, key=lambda document_id: -scores[document_id])
+    return [{**results[document_id], "score": scores[document_id]} for document_id in ranked]
+
 @router.get("/api/search")
-async def search_documents(q: str, user_id: str):
+async def search_documents(q: str, user_id: str, limit: int = DEFAULT_SEARCH_LIMIT, offset: int = 0,
+                           count_only: bool = False, mode: str = "keyword"):
     """
-    Search documents using Full Text Search.
+    Search documents using Full Text Search. `q` supports AND/OR/NOT, "phrases",
+    prefix*, (grouping) and title:/category:/text: fields; a malformed query gets a 400
+    with the problem and its position. Results are ranked best first; pass the returned
+    `next_offset` as `offset` for the next page. With `count_only` only the total number
+    of matches is returned.
+    `mode=semantic` ranks by embedding similarity to `q` (plain text), `mode=hybrid`
+    fuses the keyword and semantic rankings.
     """
-    if not q:
-        return {"success": True, "count": 0, "results": []}
+    if mode not in SEARCH_MODES:
+        raise HTTPException(status_code=400, detail=f"Unknown search mode. Use one of: {', '.join(SEARCH_MODES)}")
+    if mode != "keyword" and not embedding_service.is_enabled():
+        raise HTTPException(status_code=400, detail="Semantic search is disabled on this server.")
+    if count_only and mode != "keyword":
+        raise HTTPException(status_code=400, detail="count_only is only supported for keyword search.")
+
+    if not q.strip():
+        if count_only:
+            return {"success": True, "count": 0}
+        return {"success": True, "count": 0, "results": [], "has_more": False, "next_offset": None}
         
+    query = None
+    if mode != "semantic":
+        try:
+            query = parse_search(q)
+        except SearchQueryError as e:
+            raise HTTPException(status_code=400, detail=e.to_dict())
+
     try:
-        results = _search_documents(user_id, q)
+        if count_only:
+            return {"success": True, "count": await run_db(_count_search_matches, user_id, query)}
+
+        limit = max(1, min(limit, MAX_SEARCH_LIMIT))
+        offset = max(0, offset)
+
+        if mode == "keyword":
+            results = await run_db(_search_documents, user_id, query, limit, offset)
+            has_more = len(results) > limit
+            results = results[:limit]
+        else:
+            # Rank the top of the candidate lists and page through that
+            window = min(offset + limit + 1, SEMANTIC_MAX_RESULTS)
+            if mode == "semantic":
+                semantic_docs = await embedding_service.semantic_search(user_id, q, window)
+                ranked = [_semantic_result(doc) for doc in semantic_docs]
+            else:
+                keyword_results, semantic_docs = await asyncio.gather(
+                    run_db(_search_documents, user_id, query, window, 0),
+                    embedding_service.semantic_search(user_id, q, window),
+                )
+                ranked = _fuse_rankings(keyword_results, semantic_docs)
+            results = ranked[offset:offset + limit]
+            has_more = len(ranked) > offset + limit
+
         return {
             "success": True, 
             "count": len(results), 
-            "results": results
+            "results": results,
+            "has_more": has_more,
+            "next_offset": offset + limit if has_more else None
         }
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.get("/api/search/suggest")
+async def suggest_search(q: str, user_id: str, limit: int = suggest_service.DEFAULT_SUGGESTIONS):
+    """
+    Autocomplete for the search box: document titles and terms from the documents'
+    text containing `q` (any substring once it has 3+ characters). Cheap enough to
+    call on every keystroke; answers are cached per user and prefix for a short time.
+    """
+    prefix = suggest_service.normalize_prefix(q)
+    if not prefix:
+        return {"success": True, "suggestions": []}
+    limit = max(1, min(limit, suggest_service.MAX_SUGGESTIONS))
 
+    try:
+        suggestions = suggest_service.get_cached(user_id, prefix, limit)
+        if suggestions is None:
+            suggestions = await run_db(suggest_service.find_suggestions, user_id, prefix, limit)
+            suggest_service.store_cached(user_id, prefix, limit, suggestions)
+        return {"success": True, "suggestions": suggestions}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
 
+@router.get("/api/events")
+async def document_events(user_id: str):
+    """
+    Server-sent events for the user's documents: uploads, processing status changes
+    (with the final category), category edits and deletions. Replaces polling.
+    """
+    return StreamingResponse(
+        event_bus.stream(user_id),
+        media_type="text/event-stream",
+        # No caching or proxy buffering: each event must reach the browser immediately
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 class CategoryUpdate(pydantic.BaseModel):
     category: str
@@ -400,7 +1009,7 @@ async def update_category(document_id: int, category_update: CategoryUpdate, use
     Update the category of a document.
     """
     try:
-        success, message = _update_document_category(document_id, user_id, category_update.category)
+        success, message = await run_db(_update_document_category, document_id, user_id, category_update.category)
         
         if not success:
             if "not found" in message:
@@ -408,6 +1017,8 @@ async def update_category(document_id: int, category_update: CategoryUpdate, use
             else:
                 raise HTTPException(status_code=500, detail=message)
                 
+        suggest_service.invalidate_user(user_id)
+        event_bus.publish(user_id, "category", document_id=document_id, category=category_update.category)
         return {
             "success": True,
             "message": message,
@@ -462,9 +1073,12 @@ async def delete_document(document_id: int, user_id: str):
     Delete a document and its associated file.
     """
     try:
-        success, message = _delete_document_helper(document_id, user_id)
+        success, message = await run_db(_delete_document_helper, document_id, user_id)
         
-        if not success:
+        if success:
+            suggest_service.invalidate_user(user_id)
+            event_bus.publish(user_id, "deleted", document_id=document_id)
+        else:
             if message == "Document not found":
                 raise HTTPException(status_code=404, detail="Document not found")
             else:
@@ -479,3 +1093,135 @@ async def delete_document(document_id: int, user_id: str):
         raise he
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+
+class ReprocessRequest(pydantic.BaseModel):
+    mode: str = "resume"
+    pages: list[int] | None = None
+
+REPROCESS_MODES = ("resume", "categorize")
+
+def _queue_reprocess(document_id: int, user_id: str, options: dict):
+    """
+    Helper function to queue a document for processing again. Stored pages are kept
+    (so only missing pages are extracted) except the ones listed in options["pages"].
+    Returns (status, message) with status "queued", "already_queued", "not_found" or "invalid".
+    """
+    conn = get_db_connection()
+    cursor = conn.cursor()
+
+    try:
+        cursor.execute('SELECT file_path, pages_total FROM documents WHERE id = ? AND user_id = ?', (document_id, user_id))
+        row = cursor.fetchone()
+        if not row:
+            return "not_found", "Document not found"
+
+        pages = options.get("pages")
+        if pages and (min(pages) < 1 or max(pages) > (row['pages_total'] or page_service.PAGE_ID_SPAN - 1)):
+            return "invalid", f"Pages must be between 1 and {row['pages_total'] or 'the page count'}"
+        if options.get("mode") == "categorize":
+            cursor.execute('SELECT 1 FROM document_pages WHERE id BETWEEN ? AND ? LIMIT 1', page_service.page_id_range(document_id))
+            if not cursor.fetchone():
+                return "invalid", "The document has no extracted text to categorize"
+
+        # The job goes in first: if one is already queued or running, nothing changes
+        if not enqueue_document(document_id, user_id, row['file_path'], conn=conn, options=options or None):
+            return "already_queued", "Document is already queued for processing"
+
+        if pages:
+            cursor.execute(
+                f'DELETE FROM document_pages WHERE id IN ({", ".join("?" * len(pages))})',
+                [page_service.page_id(document_id, number) for number in pages]
+            )
+        cursor.execute(
+            "UPDATE documents SET processing_status = 'pending', error_message = NULL WHERE id = ?",
+            (document_id,)
+        )
+        conn.commit()
+        return "queued", "Document queued for processing"
+    finally:
+        conn.close()
+
+@router.post("/api/documents/{document_id}/reprocess")
+async def reprocess_document(document_id: int, user_id: str, options_request: ReprocessRequest = None):
+    """
+    Run a document through processing again, e.g. after it failed. The job goes through
+    the same queue and concurrency limits as new uploads; calling this while the document
+    is queued or processing changes nothing. Pages already extracted are reused.
+    Body (optional): `mode` "resume" (default) or "categorize" (only categorize the
+    stored text again), `pages` (page numbers to extract again, bypassing the page cache).
+    """
+    options_request = options_request or ReprocessRequest()
+    if options_request.mode not in REPROCESS_MODES:
+        raise HTTPException(status_code=400, detail=f"Unknown mode. Use one of: {', '.join(REPROCESS_MODES)}")
+    if options_request.pages and options_request.mode == "categorize":
+        raise HTTPException(status_code=400, detail="pages can't be combined with mode=categorize")
+
+    options = {}
+    if options_request.mode == "categorize":
+        options["mode"] = "categorize"
+    if options_request.pages:
+        options["pages"] = sorted(set(options_request.pages))
+
+    try:
+        status, message = await run_db(_queue_reprocess, document_id, user_id, options)
+        if status == "not_found":
+            raise HTTPException(status_code=404, detail=message)
+        if status == "invalid":
+            raise HTTPException(status_code=400, detail=message)
+
+        if status == "queued":
+            event_bus.publish_status(user_id, document_id, 'pending')
+        return {
+            "success": True,
+            "queued": status == "queued",
+            "message": message
+        }
+
+    except HTTPException as he:
+        raise he
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+def _queue_failed_documents(user_id: str):
+    """
+    Helper function to queue every failed document of a user for processing again.
+    Returns the ids of the documents queued.
+    """
+    conn = get_db_connection()
+    cursor = conn.cursor()
+
+    try:
+        cursor.execute(
+            "SELECT id, file_path FROM documents WHERE user_id = ? AND processing_status = 'failed'",
+            (user_id,)
+        )
+        queued = [
+            row['id'] for row in cursor.fetchall()
+            if enqueue_document(row['id'], user_id, row['file_path'], conn=conn)
+        ]
+        cursor.executemany(
+            "UPDATE documents SET processing_status = 'pending', error_message = NULL WHERE id = ?",
+            [(document_id,) for document_id in queued]
+        )
+        conn.commit()
+        return queued
+    finally:
+        conn.close()
+
+@router.post("/api/documents/retry-failed")
+async def retry_failed_documents(user_id: str):
+    """
+    Queue all of a user's failed documents for processing again (see reprocess). They
+    run under the same per-user limit as uploads, so a large retry can't starve others.
+    """
+    try:
+        queued = await run_db(_queue_failed_documents, user_id)
+        for document_id in queued:
+            event_bus.publish_status(user_id, document_id, 'pending')
+        return {
+            "success": True,
+            "count": len(queued),
+            "document_ids": queued
+        }
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
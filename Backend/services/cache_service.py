@@ -0,0 +1,166 @@
+import os
+import time
+import hashlib
+import asyncio
+from database import get_db_connection, run_db, with_db_connection
+
+# Content-addressed cache of LLM results, keyed by SHA-256.
+#   extraction_cache: whole files -> extracted_text + category
+#   page_cache:       rendered PDF pages -> OCR text
+# Both tables are trimmed least-recently-used first once they exceed their limits.
+CACHE_MAX_DOCUMENTS = int(os.getenv("CACHE_MAX_DOCUMENTS", "10000"))
+CACHE_MAX_PAGES = int(os.getenv("CACHE_MAX_PAGES", "50000"))
+CACHE_EVICT_EVERY = 100  # check the size limits once per this many stores
+
+_stats = {
+    "document_hits": 0,
+    "document_misses": 0,
+    "page_hits": 0,
+    "page_misses": 0,
+    "evictions": 0,
+}
+_stores_since_evict = 0
+
+
+def lookup_document(content_hash: str, conn=None):
+    """
+    Return the cached {extracted_text, category} for a file hash, or None.
+    """
+    if not content_hash:
+        return None
+
+    def _lookup(conn):
+        row = conn.execute(
+            "SELECT extracted_text, category FROM extraction_cache WHERE content_hash = ?",
+            (content_hash,)
+        ).fetchone()
+        if row:
+            conn.execute(
+                "UPDATE extraction_cache SET last_used_at = ?, hits = hits + 1 WHERE content_hash = ?",
+                (time.time(), content_hash)
+            )
+            _stats["document_hits"] += 1
+            return {"extracted_text": row['extracted_text'], "category": row['category']}
+        _stats["document_misses"] += 1
+        return None
+
+    return with_db_connection(conn, _lookup)
+
+
+def store_document(content_hash: str, extracted_text: str, category: str, conn=None):
+    if not content_hash:
+        return
+
+    def _store(conn):
+        conn.execute('''
+            INSERT OR REPLACE INTO extraction_cache (content_hash, extracted_text, category, last_used_at)
+            VALUES (?, ?, ?, ?)
+        ''', (content_hash, extracted_text, category, time.time()))
+        _maybe_evict(conn)
+
+    with_db_connection(conn, _store)
+
+
+def hash_file(file_path: str):
+    """
+    SHA-256 of a stored file, for documents uploaded before uploads were hashed.
+    """
+    hasher = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            hasher.update(block)
+    return hasher.hexdigest()
+
+
+def store_content_hash(document_id: int, content_hash: str, conn=None):
+    def _store(conn):
+        conn.execute(
+            "UPDATE documents SET content_hash = ? WHERE id = ? AND content_hash IS NULL",
+            (content_hash, document_id)
+        )
+
+    with_db_connection(conn, _store)
+
+
+async def ensure_content_hash(document_id: int, file_path: str, content_hash: str = None):
+    """
+    The document's content hash, computed from the file (and saved) for rows that predate hashing.
+    """
+    if content_hash:
+        return content_hash
+    content_hash = await asyncio.to_thread(hash_file, file_path)
+    await run_db(store_content_hash, document_id, content_hash)
+    return content_hash
+
+
+def lookup_page(page_hash: str, conn=None):
+    """
+    Return the cached OCR text for a rendered page hash, or None.
+    """
+    def _lookup(conn):
+        row = conn.execute("SELECT text FROM page_cache WHERE page_hash = ?", (page_hash,)).fetchone()
+        if row:
+            conn.execute(
+                "UPDATE page_cache SET last_used_at = ?, hits = hits + 1 WHERE page_hash = ?",
+                (time.time(), page_hash)
+            )
+            _stats["page_hits"] += 1
+            return row['text']
+        _stats["page_misses"] += 1
+        return None
+
+    return with_db_connection(conn, _lookup)
+
+
+def store_page(page_hash: str, text: str, conn=None):
+    def _store(conn):
+        conn.execute('''
+            INSERT OR REPLACE INTO page_cache (page_hash, text, last_used_at)
+            VALUES (?, ?, ?)
+        ''', (page_hash, text, time.time()))
+        _maybe_evict(conn)
+
+    with_db_connection(conn, _store)
+
+
+def _maybe_evict(conn):
+    global _stores_since_evict
+    _stores_since_evict += 1
+    if _stores_since_evict < CACHE_EVICT_EVERY:
+        return
+    _stores_since_evict = 0
+
+    for table, max_entries in (("extraction_cache", CACHE_MAX_DOCUMENTS), ("page_cache", CACHE_MAX_PAGES)):
+        count = conn.execute(f"SELECT COUNT(*) as count FROM {table}").fetchone()['count']
+        excess = count - max_entries
+        if excess > 0:
+            conn.execute(f'''
+                DELETE FROM {table} WHERE rowid IN (
+                    SELECT rowid FROM {table} ORDER BY last_used_at LIMIT ?
+                )
+            ''', (excess,))
+            _stats["evictions"] += excess
+
+
+def get_cache_stats():
+    """
+    Hit/miss counters for this process plus current cache sizes.
+    """
+    conn = get_db_connection()
+    try:
+        documents = conn.execute("SELECT COUNT(*) as count FROM extraction_cache").fetchone()['count']
+        pages = conn.execute("SELECT COUNT(*) as count FROM page_cache").fetchone()['count']
+    finally:
+        conn.close()
+
+    doc_lookups = _stats["document_hits"] + _stats["document_misses"]
+    page_lookups = _stats["page_hits"] + _stats["page_misses"]
+    return {
+        **_stats,
+        "document_hit_rate": _stats["document_hits"] / doc_lookups if doc_lookups else 0.0,
+        "page_hit_rate": _stats["page_hits"] / page_lookups if page_lookups else 0.0,
+        "document_entries": documents,
+        "page_entries": pages,
+        "max_documents": CACHE_MAX_DOCUMENTS,
+        "max_pages": CACHE_MAX_PAGES,
+    }
@@ -0,0 +1,142 @@
+import os
+import re
+import json
+import asyncio
+from langchain_core.messages import HumanMessage
+
+# Micro-batching: texts waiting for categorization are collected across documents and
+# sent as one prompt once CATEGORIZE_BATCH_SIZE are queued or the oldest has waited
+# CATEGORIZE_BATCH_WAIT_MS, whichever comes first.
+CATEGORIZE_BATCH_SIZE = int(os.getenv("CATEGORIZE_BATCH_SIZE", "10"))
+CATEGORIZE_BATCH_WAIT_MS = int(os.getenv("CATEGORIZE_BATCH_WAIT_MS", "500"))
+CATEGORIZE_TEXT_CHARS = 2000  # text sent per document
+
+VALID_CATEGORIES = ["Invoice", "Receipt", "Contract", "Note", "Letter", "Form", "Other"]
+
+_pending = []       # [(text, future)]
+_flush_timer = None
+_flush_tasks = set()  # keeps in-flight batch tasks referenced
+
+
+def normalize_category(category: str):
+    """
+    Map a raw LLM answer onto one of VALID_CATEGORIES, or "Uncategorized".
+    """
+    # Basic cleanup if LLM returns "Category: Invoice" or similar
+    for valid_cat in VALID_CATEGORIES:
+        if valid_cat.lower() in category.lower():
+            return valid_cat
+    return "Uncategorized"
+
+
+async def categorize_text(extracted_text: str):
+    """
+    Categorize a document's text. Waits for the batch it joins to be sent.
+    """
+    global _flush_timer
+    future = asyncio.get_running_loop().create_future()
+    _pending.append((extracted_text[:CATEGORIZE_TEXT_CHARS], future))
+
+    if len(_pending) >= CATEGORIZE_BATCH_SIZE:
+        _start_flush()
+    elif _flush_timer is None:
+        _flush_timer = asyncio.get_running_loop().call_later(
+            CATEGORIZE_BATCH_WAIT_MS / 1000, _start_flush
+        )
+
+    return await future
+
+
+def _start_flush():
+    global _flush_timer
+    if _flush_timer is not None:
+        _flush_timer.cancel()
+        _flush_timer = None
+
+    batch = _pending[:CATEGORIZE_BATCH_SIZE]
+    del _pending[:CATEGORIZE_BATCH_SIZE]
+    if batch:
+        task = asyncio.create_task(_flush(batch))
+        _flush_tasks.add(task)
+        task.add_done_callback(_flush_tasks.discard)
+
+    # Leftovers start a new batch window
+    if _pending:
+        _flush_timer = asyncio.get_running_loop().call_later(
+            CATEGORIZE_BATCH_WAIT_MS / 1000, _start_flush
+        )
+
+
+async def _flush(batch):
+    try:
+        if len(batch) == 1:
+            categories = [await _categorize_single(batch[0][0])]
+        else:
+            categories = await _categorize_batch([text for text, _ in batch])
+        for (_, future), category in zip(batch, categories):
+            if not future.done():
+                future.set_result(category)
+    except Exception as e:
+        for _, future in batch:
+            if not future.done():
+                future.set_exception(e)
+
+
+async def _categorize_single(text: str):
+    from services.llm_service import llm, invoke_with_retry
+
+    category_prompt = f"""
+        Analyze the following text extracted from a document and categorize it into exactly one of the following categories:
+        - Invoice
+        - Receipt
+        - Contract
+        - Note
+        - Letter
+        - Form
+        - Other
+
+        Text to analyze:
+        {text}
+
+        Return ONLY the category name. Do not include any explanation.
+        """
+
+    category_response = await invoke_with_retry(llm, [HumanMessage(content=category_prompt)])
+    return normalize_category(category_response.content.strip())
+
+
+async def _categorize_batch(texts):
+    """
+    Categorize several texts with one LLM call. Falls back to one call per text if
+    the answer is not a JSON array of the right length.
+    """
+    from services.llm_service import llm, invoke_with_retry
+
+    print(f"Categorizing batch of {len(texts)} documents...")
+    documents = "\n\n".join(f"### Document {i+1}\n{text}" for i, text in enumerate(texts))
+    batch_prompt = f"""
+        Analyze each of the following {len(texts)} documents (text extracted from scans) and categorize
+        each one into exactly one of the following categories:
+        {", ".join(VALID_CATEGORIES)}
+
+        {documents}
+
+        Return ONLY a JSON array of {len(texts)} category names, one per document, in the same order.
+        Example: ["Invoice", "Letter"]
+        """
+
+    response = await invoke_with_retry(llm, [HumanMessage(content=batch_prompt)])
+    content = response.content if isinstance(response.content, str) else str(response.content)
+
+    try:
+        # Models sometimes wrap JSON in a ```json fence
+        match = re.search(r"\[.*\]", content, re.DOTALL)
+        answers = json.loads(match.group(0)) if match else None
+    except json.JSONDecodeError:
+        answers = None
+
+    if not isinstance(answers, list) or len(answers) != len(texts):
+        print("Batch categorization returned malformed output, falling back to single calls")
+        return list(await asyncio.gather(*(_categorize_single(text) for text in texts)))
+
+    return [normalize_category(str(answer)) for answer in answers]
@@ -0,0 +1,315 @@
+import os
+import asyncio
+import numpy as np
+from database import get_db_connection, run_db
+from services import rate_limiter, page_service
+from services.vector_index import index as vector_index
+
+# Semantic search: once a document is processed the text of each page is split into
+# overlapping chunks, embedded and stored in document_chunks (unit float32 vectors).
+# Providers (EMBEDDING_PROVIDER):
+#   gemini - Gemini embedding API, through the shared rate limiter (default)
+#   local  - sentence-transformers model on the CPU (pip install sentence-transformers)
+#   none   - semantic search disabled
+EMBEDDING_PROVIDER = os.getenv("EMBEDDING_PROVIDER", "gemini").lower()
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "")
+EMBEDDING_DIMENSIONS = int(os.getenv("EMBEDDING_DIMENSIONS", "768"))  # gemini only
+EMBEDDING_CHUNK_CHARS = int(os.getenv("EMBEDDING_CHUNK_CHARS", "1000"))
+EMBEDDING_CHUNK_OVERLAP = 200
+EMBEDDING_BATCH_SIZE = 32
+SEMANTIC_MIN_SCORE = float(os.getenv("SEMANTIC_MIN_SCORE", "0"))  # cosine similarity floor for a hit
+MAX_CHUNKS_PER_DOCUMENT = 200
+
+
+class GeminiEmbeddings:
+
+    def __init__(self):
+        from langchain_google_genai import GoogleGenerativeAIEmbeddings
+        model = EMBEDDING_MODEL or "gemini-embedding-001"
+        self.model_id = f"gemini/{model}/{EMBEDDING_DIMENSIONS}"
+        self._client = GoogleGenerativeAIEmbeddings(model=model)
+
+    async def embed_documents(self, texts):
+        tokens = sum(len(text) // 4 for text in texts) or 1
+        return await rate_limiter.call_with_retry(
+            lambda: self._client.aembed_documents(
+                texts, task_type="RETRIEVAL_DOCUMENT", output_dimensionality=EMBEDDING_DIMENSIONS
+            ),
+            tokens,
+        )
+
+    async def embed_query(self, text):
+        return await rate_limiter.call_with_retry(
+            lambda: self._client.aembed_query(
+                text, task_type="RETRIEVAL_QUERY", output_dimensionality=EMBEDDING_DIMENSIONS
+            ),
+            len(text) // 4 or 1,
+        )
+
+
+class LocalEmbeddings:
+
+    def __init__(self):
+        try:
+            from sentence_transformers import SentenceTransformer
+        except ImportError:
+            raise RuntimeError("EMBEDDING_PROVIDER=local needs the sentence-transformers package")
+        model = EMBEDDING_MODEL or "sentence-transformers/all-MiniLM-L6-v2"
+        self.model_id = f"local/{model}"
+        self._model = SentenceTransformer(model, device="cpu")
+
+    async def embed_documents(self, texts):
+        return await asyncio.to_thread(self._model.encode, texts, normalize_embeddings=True)
+
+    async def embed_query(self, text):
+        return (await self.embed_documents([text]))[0]
+
+
+PROVIDERS = {
+    "gemini": GeminiEmbeddings,
+    "local": LocalEmbeddings,
+}
+
+_provider = None
+
+
+def is_enabled():
+    return EMBEDDING_PROVIDER in PROVIDERS
+
+
+def get_provider():
+    global _provider
+    if _provider is None:
+        if not is_enabled():
+            raise RuntimeError("Semantic search is disabled (EMBEDDING_PROVIDER=none)")
+        _provider = PROVIDERS[EMBEDDING_PROVIDER]()
+    return _provider
+
+
+def _normalize(vector):
+    vector = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+def chunk_text(text: str):
+    """
+    Split text into ~EMBEDDING_CHUNK_CHARS pieces that overlap by EMBEDDING_CHUNK_OVERLAP,
+    cutting at a paragraph, sentence or word boundary where possible.
+    """
+    text = text.strip()
+    chunks = []
+    start = 0
+    while start < len(text) and len(chunks) < MAX_CHUNKS_PER_DOCUMENT:
+        end = min(start + EMBEDDING_CHUNK_CHARS, len(text))
+        if end < len(text):
+            window_start = start + EMBEDDING_CHUNK_CHARS // 2
+            for separator in ("\n\n", ". ", "\n", " "):
+                cut = text.rfind(separator, window_start, end)
+                if cut != -1:
+                    end = cut + len(separator)
+                    break
+        chunk = text[start:end].strip()
+        if chunk:
+            chunks.append(chunk)
+        if end >= len(text):
+            break
+        start = max(end - EMBEDDING_CHUNK_OVERLAP, start + 1)
+    return chunks
+
+
+# Database steps of index_document (run on the DB thread pool via run_db)
+def _load_for_indexing(document_id: int, model_id: str):
+    """
+    Returns (user_id, pages, budget) if the document still needs chunks for `model_id`,
+    or None: `pages` are its [(page_number, text)] without chunks yet, `budget` the
+    chunks it may still get (MAX_CHUNKS_PER_DOCUMENT in all).
+    Identical files uploaded before reuse their chunks instead of being embedded again.
+    """
+    conn = get_db_connection()
+    try:
+        doc = conn.execute('''
+            SELECT id, user_id, extracted_text, content_hash, processing_status, pages_total
+            FROM documents WHERE id = ?
+        ''', (document_id,)).fetchone()
+        if not doc or doc['processing_status'] != 'completed' or not doc['extracted_text']:
+            return None
+
+        existing = conn.execute(
+            "SELECT COUNT(*) AS count, COUNT(page_number) AS pages FROM document_chunks WHERE document_id = ? AND model = ?",
+            (document_id, model_id)
+        ).fetchone()
+        if existing['count'] > existing['pages']:
+            # Chunks of the whole text from before chunks were per page; they go away
+            # when a page changes
+            return None
+
+        if not existing['count'] and doc['content_hash']:
+            twin = conn.execute('''
+                SELECT c.document_id FROM documents d
+                JOIN document_chunks c ON c.document_id = d.id AND c.model = ?
+                WHERE d.content_hash = ? AND d.id != ? AND d.extracted_text = ?
+                LIMIT 1
+            ''', (model_id, doc['content_hash'], document_id, doc['extracted_text'])).fetchone()
+            if twin:
+                conn.execute('''
+                    INSERT INTO document_chunks (document_id, user_id, page_number, chunk_index, text, model, embedding)
+                    SELECT ?, ?, page_number, chunk_index, text, model, embedding
+                    FROM document_chunks WHERE document_id = ? AND model = ?
+                    ORDER BY page_number, chunk_index
+                ''', (document_id, doc['user_id'], twin['document_id'], model_id))
+                conn.commit()
+                return None
+
+        # Pages past the page budget aren't part of the text
+        pages = conn.execute('''
+            SELECT p.page_number, p.text FROM document_pages p
+            WHERE p.id BETWEEN ? AND ?
+              AND NOT EXISTS (
+                  SELECT 1 FROM document_chunks c
+                  WHERE c.document_id = ? AND c.page_number = p.page_number AND c.model = ?
+              )
+            ORDER BY p.id
+        ''', (*page_service.page_id_range(document_id, doc['pages_total'] or page_service.PAGE_ID_SPAN - 1),
+              document_id, model_id)).fetchall()
+        budget = MAX_CHUNKS_PER_DOCUMENT - existing['count']
+        return doc['user_id'], [(row['page_number'], row['text']) for row in pages], budget
+    finally:
+        conn.close()
+
+
+def _store_chunks(document_id: int, user_id: str, pages, model_id: str, chunks, vectors):
+    """
+    Store the chunks of `pages` ({page_number: text}) whose text is still the one
+    embedded. `chunks` are (page_number, chunk_index, text). Returns how many were stored.
+    """
+    conn = get_db_connection()
+    try:
+        # A page may have been re-extracted (or the document deleted) while we were embedding
+        current = set()
+        for page_number, text in pages.items():
+            row = conn.execute(
+                "SELECT text FROM document_pages WHERE id = ?", (page_service.page_id(document_id, page_number),)
+            ).fetchone()
+            if row and row['text'] == text:
+                current.add(page_number)
+                conn.execute(
+                    "DELETE FROM document_chunks WHERE document_id = ? AND page_number = ? AND model = ?",
+                    (document_id, page_number, model_id)
+                )
+        rows = [
+            (document_id, user_id, page_number, i, chunk, model_id, _normalize(vector).tobytes())
+            for (page_number, i, chunk), vector in zip(chunks, vectors)
+            if page_number in current
+        ]
+        conn.executemany('''
+            INSERT INTO document_chunks (document_id, user_id, page_number, chunk_index, text, model, embedding)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', rows)
+        conn.commit()
+        return len(rows)
+    finally:
+        conn.close()
+
+
+async def index_document(document_id: int):
+    """
+    Chunk and embed the pages of a processed document that have no chunks yet (all
+    of them the first time, only the re-extracted ones after a page reprocess).
+    Does nothing if semantic search is disabled or the document isn't completed.
+    """
+    if not is_enabled():
+        return
+    provider = get_provider()
+    loaded = await run_db(_load_for_indexing, document_id, provider.model_id)
+    if loaded is None:
+        return
+    user_id, pages, budget = loaded
+
+    chunks = [
+        (page_number, i, chunk)
+        for page_number, text in pages
+        for i, chunk in enumerate(chunk_text(text))
+    ][:max(budget, 0)]
+    if not chunks:
+        return
+    texts = [chunk for _, _, chunk in chunks]
+    vectors = []
+    for i in range(0, len(texts), EMBEDDING_BATCH_SIZE):
+        vectors.extend(await provider.embed_documents(texts[i:i + EMBEDDING_BATCH_SIZE]))
+
+    stored = await run_db(_store_chunks, document_id, user_id, dict(pages), provider.model_id, chunks, vectors)
+    if stored:
+        print(f"Document {document_id}: indexed {stored} chunks of {len(pages)} pages for semantic search")
+
+
+def _find_unindexed_documents(model_id: str):
+    conn = get_db_connection()
+    try:
+        rows = conn.execute('''
+            SELECT d.id FROM documents d
+            WHERE d.processing_status = 'completed' AND d.extracted_text IS NOT NULL
+              AND NOT EXISTS (
+                  SELECT 1 FROM document_chunks c WHERE c.document_id = d.id AND c.model = ?
+              )
+            ORDER BY d.id
+        ''', (model_id,)).fetchall()
+        return [row['id'] for row in rows]
+    finally:
+        conn.close()
+
+
+async def backfill():
+    """
+    Index every completed document that has no chunks yet (e.g. processed before
+    semantic search existed, or with another embedding model). Returns the count.
+    """
+    document_ids = await run_db(_find_unindexed_documents, get_provider().model_id)
+    for document_id in document_ids:
+        try:
+            await index_document(document_id)
+        except Exception as e:
+            print(f"Error indexing document {document_id}: {e}")
+    return len(document_ids)
+
+
+def _search_chunks(user_id: str, query_vector, k: int, model_id: str):
+    """
+    The user's `k` best matching documents as dicts with the document fields, the
+    similarity `score` and the best matching `chunk`, best first.
+    """
+    # Several chunks can come from the same document: look at more than k
+    hits = vector_index.search(user_id, query_vector, k * 4, model_id)
+    if not hits:
+        return []
+    scores = dict(hits)
+
+    conn = get_db_connection()
+    try:
+        placeholders = ",".join("?" * len(scores))
+        rows = conn.execute(f'''
+            SELECT c.id AS chunk_id, c.text AS chunk, d.id, d.title, d.category, d.upload_date, d.processing_status
+            FROM document_chunks c
+            JOIN documents d ON d.id = c.document_id
+            WHERE c.id IN ({placeholders}) AND d.user_id = ?
+        ''', (*scores, user_id)).fetchall()
+    finally:
+        conn.close()
+
+    if len(rows) < len(scores):
+        vector_index.report_stale(len(scores) - len(rows))
+
+    documents = {}
+    for row in rows:
+        score = scores[row['chunk_id']]
+        if score <= SEMANTIC_MIN_SCORE:
+            continue
+        if row['id'] not in documents or score > documents[row['id']]['score']:
+            documents[row['id']] = {**dict(row), "score": score}
+    return sorted(documents.values(), key=lambda doc: -doc['score'])[:k]
+
+
+async def semantic_search(user_id: str, query: str, k: int):
+    provider = get_provider()
+    query_vector = _normalize(await provider.embed_query(query))
+    return await run_db(_search_chunks, user_id, query_vector, k, provider.model_id)
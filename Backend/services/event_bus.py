@@ -0,0 +1,99 @@
+import os
+import json
+import asyncio
+
+# In-process pub/sub for document changes, streamed to browsers as server-sent events
+# (GET /api/events). Events reach the streams open in this process: the job workers
+# run inside the API process, so status changes are seen. A client that reconnects
+# or falls behind gets a "resync" event and refetches what it shows.
+#
+# Event types (JSON data always carries "type"):
+#   created   {document_ids}                              new uploads
+#   status    {document_id, status, category, preview, error}   processing / completed / failed
+#   progress  {document_id, pages_done, pages_total}      a page was extracted
+#   category  {document_id, category}                     category changed by the user
+#   deleted   {document_id}
+#   resync    {}                                          events were dropped, refetch
+EVENTS_QUEUE_SIZE = 256           # undelivered events kept per stream before it is resynced
+EVENTS_KEEPALIVE_SECONDS = float(os.getenv("EVENTS_KEEPALIVE_SECONDS", "15"))
+EVENTS_RETRY_MS = 5000            # browser reconnect delay after a dropped stream
+PREVIEW_CHARS = 150
+
+_subscribers = {}  # user_id -> set of asyncio.Queue, one per open stream
+_loop = None
+
+
+def subscribe(user_id: str):
+    global _loop
+    _loop = asyncio.get_running_loop()
+    queue = asyncio.Queue(maxsize=EVENTS_QUEUE_SIZE)
+    _subscribers.setdefault(user_id, set()).add(queue)
+    return queue
+
+
+def unsubscribe(user_id: str, queue):
+    queues = _subscribers.get(user_id)
+    if queues is not None:
+        queues.discard(queue)
+        if not queues:
+            del _subscribers[user_id]
+
+
+def _deliver(user_id: str, event: dict):
+    for queue in _subscribers.get(user_id, ()):
+        if queue.full():
+            # The client isn't keeping up: drop its backlog and have it refetch instead
+            while not queue.empty():
+                queue.get_nowait()
+            queue.put_nowait({"type": "resync"})
+        queue.put_nowait(event)
+
+
+def publish(user_id: str, event_type: str, **data):
+    """
+    Send an event to every open stream of a user. Safe to call from DB threads.
+    """
+    if _loop is None or user_id not in _subscribers:
+        return
+    event = {"type": event_type, **data}
+    try:
+        running_loop = asyncio.get_running_loop()
+    except RuntimeError:
+        running_loop = None
+    # asyncio.Queue isn't thread-safe: hand the event to the loop that owns the queues
+    if running_loop is _loop:
+        _deliver(user_id, event)
+    else:
+        _loop.call_soon_threadsafe(_deliver, user_id, event)
+
+
+def publish_status(user_id: str, document_id: int, status: str, category: str = None,
+                   extracted_text: str = None, error: str = None):
+    preview = None
+    if extracted_text:
+        preview = extracted_text[:PREVIEW_CHARS] + "..." if len(extracted_text) > PREVIEW_CHARS else extracted_text
+    publish(user_id, "status", document_id=document_id, status=status,
+            category=category, preview=preview, error=error)
+
+
+def subscriber_count():
+    return sum(len(queues) for queues in _subscribers.values())
+
+
+async def stream(user_id: str):
+    """
+    Server-sent event stream of a user's document events, with keep-alive comments
+    so proxies don't close an idle connection.
+    """
+    queue = subscribe(user_id)
+    try:
+        yield f"retry: {EVENTS_RETRY_MS}\n\n"
+        while True:
+            try:
+                event = await asyncio.wait_for(queue.get(), timeout=EVENTS_KEEPALIVE_SECONDS)
+            except asyncio.TimeoutError:
+                yield ": keepalive\n\n"
+                continue
+            yield f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
+    finally:
+        unsubscribe(user_id, queue)
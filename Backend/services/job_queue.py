@@ -0,0 +1,320 @@
+import os
+import json
+import time
+import uuid
+import asyncio
+from database import get_db_connection, run_db
+from services.llm_service import process_document
+from services import embedding_service, thumbnail_service, event_bus
+
+# Queue configuration (override via environment / .env)
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))                    # worker coroutines in this process
+JOB_MAX_RUNNING = int(os.getenv("JOB_MAX_RUNNING", str(JOB_WORKERS)))  # running jobs across all processes
+JOB_MAX_PER_USER = int(os.getenv("JOB_MAX_PER_USER", "2"))          # running jobs per user
+JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", "120"))
+JOB_HEARTBEAT_SECONDS = float(os.getenv("JOB_HEARTBEAT_SECONDS", "30"))
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "2"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+
+# Identifies this process as the lease owner of the jobs it runs
+WORKER_ID = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+
+_workers = []
+_wakeup = None
+_loop = None
+
+
+def enqueue_document(document_id: int, user_id: str, file_path: str, conn=None, options: dict = None):
+    """
+    Add a processing job for a document, with optional process_document options.
+    Does nothing if the document already has a queued or running job; returns
+    whether a job was added. Pass `conn` to enqueue inside the caller's
+    transaction (the caller commits).
+    """
+    own_conn = conn is None
+    if own_conn:
+        conn = get_db_connection()
+
+    try:
+        cursor = conn.execute('''
+            INSERT OR IGNORE INTO processing_jobs (document_id, user_id, file_path, options)
+            VALUES (?, ?, ?, ?)
+        ''', (document_id, user_id, file_path, json.dumps(options) if options else None))
+        queued = cursor.rowcount > 0
+        if own_conn:
+            conn.commit()
+    finally:
+        if own_conn:
+            conn.close()
+
+    if queued:
+        notify_workers()
+    return queued
+
+
+def notify_workers():
+    """
+    Wake idle workers so a freshly enqueued job starts without waiting for the next poll.
+    """
+    if _wakeup is None:
+        return
+    try:
+        running_loop = asyncio.get_running_loop()
+    except RuntimeError:
+        running_loop = None
+    # enqueue_document may run on a DB thread (run_db); asyncio.Event isn't thread-safe
+    if running_loop is _loop:
+        _wakeup.set()
+    else:
+        _loop.call_soon_threadsafe(_wakeup.set)
+
+
+def recover_jobs():
+    """
+    Requeue jobs whose lease expired (their worker crashed or was restarted) and
+    enqueue documents left 'pending'/'processing' without any active job.
+    Jobs that keep dying are failed after JOB_MAX_ATTEMPTS.
+    """
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    now = time.time()
+
+    try:
+        # Give up on jobs that exhausted their attempts
+        cursor.execute('''
+            SELECT id, document_id, user_id FROM processing_jobs
+            WHERE status = 'running' AND lease_expires_at < ? AND attempts >= ?
+        ''', (now, JOB_MAX_ATTEMPTS))
+        abandoned = cursor.fetchall()
+        for row in abandoned:
+            error_msg = f"Processing abandoned after {JOB_MAX_ATTEMPTS} attempts"
+            cursor.execute(
+                "UPDATE processing_jobs SET status = 'failed', last_error = ?, lease_owner = NULL, updated_at = CURRENT_TIMESTAMP WHERE id = ?",
+                (error_msg, row['id'])
+            )
+            cursor.execute(
+                "UPDATE documents SET processing_status = ?, error_message = ? WHERE id = ?",
+                ('failed', error_msg, row['document_id'])
+            )
+
+        # Put the rest back in the queue
+        cursor.execute('''
+            UPDATE processing_jobs
+            SET status = 'queued', lease_owner = NULL, lease_expires_at = NULL, updated_at = CURRENT_TIMESTAMP
+            WHERE status = 'running' AND lease_expires_at < ?
+        ''', (now,))
+        requeued = cursor.rowcount
+
+        # Documents orphaned by the old BackgroundTasks flow or a crash before enqueue
+        cursor.execute('''
+            INSERT OR IGNORE INTO processing_jobs (document_id, user_id, file_path)
+            SELECT d.id, d.user_id, d.file_path
+            FROM documents d
+            WHERE d.processing_status IN ('pending', 'processing')
+              AND NOT EXISTS (
+                  SELECT 1 FROM processing_jobs j
+                  WHERE j.document_id = d.id AND j.status IN ('queued', 'running')
+              )
+        ''')
+        orphaned = cursor.rowcount
+        conn.commit()
+
+        for row in abandoned:
+            event_bus.publish_status(row['user_id'], row['document_id'], 'failed',
+                                     error=f"Processing abandoned after {JOB_MAX_ATTEMPTS} attempts")
+
+        if abandoned or requeued or orphaned:
+            print(f"Job recovery: {requeued} requeued, {orphaned} orphaned documents enqueued, {len(abandoned)} abandoned")
+    finally:
+        conn.close()
+
+
+def _claim_job():
+    """
+    Atomically lease the oldest queued job that fits the global and per-user limits.
+    Returns the job row or None.
+    """
+    conn = get_db_connection()
+    cursor = conn.cursor()
+
+    try:
+        # IMMEDIATE takes the write lock up front so two processes can't claim the same job
+        cursor.execute("BEGIN IMMEDIATE")
+
+        cursor.execute("SELECT COUNT(*) as count FROM processing_jobs WHERE status = 'running'")
+        if cursor.fetchone()['count'] >= JOB_MAX_RUNNING:
+            conn.rollback()
+            return None
+
+        cursor.execute('''
+            SELECT j.id, j.document_id, j.user_id, j.file_path, j.options
+            FROM processing_jobs j
+            WHERE j.status = 'queued'
+              AND (
+                  SELECT COUNT(*) FROM processing_jobs r
+                  WHERE r.user_id = j.user_id AND r.status = 'running'
+              ) < ?
+            ORDER BY j.id
+            LIMIT 1
+        ''', (JOB_MAX_PER_USER,))
+        job = cursor.fetchone()
+
+        if not job:
+            conn.rollback()
+            return None
+
+        cursor.execute('''
+            UPDATE processing_jobs
+            SET status = 'running', attempts = attempts + 1, lease_owner = ?, lease_expires_at = ?,
+                updated_at = CURRENT_TIMESTAMP
+            WHERE id = ?
+        ''', (WORKER_ID, time.time() + JOB_LEASE_SECONDS, job['id']))
+        conn.commit()
+        return job
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+
+def _extend_lease(job_id: int):
+    conn = get_db_connection()
+    try:
+        conn.execute(
+            "UPDATE processing_jobs SET lease_expires_at = ? WHERE id = ? AND lease_owner = ? AND status = 'running'",
+            (time.time() + JOB_LEASE_SECONDS, job_id, WORKER_ID)
+        )
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def _finish_job(job_id: int, document_id: int):
+    """
+    Close out a job, mirroring the final document status written by process_document.
+    """
+    conn = get_db_connection()
+    cursor = conn.cursor()
+
+    try:
+        cursor.execute("SELECT processing_status, error_message FROM documents WHERE id = ?", (document_id,))
+        row = cursor.fetchone()
+
+        if row and row['processing_status'] == 'failed':
+            status, error_msg = 'failed', row['error_message']
+        else:
+            # Completed, or the document was deleted while processing
+            status, error_msg = 'done', None
+
+        cursor.execute('''
+            UPDATE processing_jobs
+            SET status = ?, last_error = ?, lease_owner = NULL, lease_expires_at = NULL,
+                updated_at = CURRENT_TIMESTAMP
+            WHERE id = ? AND lease_owner = ?
+        ''', (status, error_msg, job_id, WORKER_ID))
+        conn.commit()
+    finally:
+        conn.close()
+
+
+async def _heartbeat(job_id: int):
+    while True:
+        await asyncio.sleep(JOB_HEARTBEAT_SECONDS)
+        try:
+            await run_db(_extend_lease, job_id)
+        except Exception as e:
+            print(f"Heartbeat error for job {job_id}: {e}")
+
+
+async def _after_processing(document_id: int):
+    # Runs after the job is closed: the document is already usable, and a preview
+    # or embedding failure must not fail it (previews render lazily on request,
+    # manage.py embed-backfill retries the embeddings)
+    try:
+        await thumbnail_service.pregenerate(document_id)
+    except Exception as e:
+        print(f"Error rendering previews for document {document_id}: {e}")
+    try:
+        await embedding_service.index_document(document_id)
+    except Exception as e:
+        print(f"Error indexing document {document_id} for semantic search: {e}")
+
+
+async def _worker_loop(worker_index: int):
+    last_recovery = 0.0
+
+    while True:
+        try:
+            # Any worker may notice expired leases from other (dead) processes
+            if time.time() - last_recovery > JOB_LEASE_SECONDS:
+                await run_db(recover_jobs)
+                last_recovery = time.time()
+
+            job = await run_db(_claim_job)
+        except Exception as e:
+            print(f"Worker {worker_index}: error claiming job: {e}")
+            job = None
+
+        if job is None:
+            # Idle until an enqueue wakes us or the poll interval passes
+            _wakeup.clear()
+            try:
+                await asyncio.wait_for(_wakeup.wait(), timeout=JOB_POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            continue
+
+        print(f"Worker {worker_index}: running job {job['id']} for document {job['document_id']}")
+        heartbeat = asyncio.create_task(_heartbeat(job['id']))
+        try:
+            options = json.loads(job['options']) if job['options'] else None
+            await process_document(job['document_id'], job['file_path'], options)
+            await run_db(_finish_job, job['id'], job['document_id'])
+            await _after_processing(job['document_id'])
+        except asyncio.CancelledError:
+            # Shutdown: leave the job 'running' so its lease expires and it is retried
+            raise
+        except Exception as e:
+            print(f"Worker {worker_index}: job {job['id']} crashed: {e}")
+        finally:
+            heartbeat.cancel()
+
+
+async def start_workers():
+    """
+    Recover interrupted work and start the worker pool. Called from the app lifespan.
+    """
+    global _wakeup, _loop
+    _wakeup = asyncio.Event()
+    _loop = asyncio.get_running_loop()
+
+    await run_db(recover_jobs)
+    for i in range(JOB_WORKERS):
+        _workers.append(asyncio.create_task(_worker_loop(i)))
+    print(f"Started {JOB_WORKERS} processing workers ({WORKER_ID})")
+
+
+async def stop_workers():
+    """
+    Cancel the worker pool and requeue the jobs it was running.
+    """
+    global _wakeup, _loop
+    for task in _workers:
+        task.cancel()
+    await asyncio.gather(*_workers, return_exceptions=True)
+    _workers.clear()
+    # Jobs enqueued from now on wait for the next start_workers(), not the closed loop
+    _wakeup = _loop = None
+
+    # Hand interrupted jobs straight back to the queue instead of waiting for the lease
+    conn = get_db_connection()
+    try:
+        conn.execute('''
+            UPDATE processing_jobs
+            SET status = 'queued', lease_owner = NULL, lease_expires_at = NULL, updated_at = CURRENT_TIMESTAMP
+            WHERE status = 'running' AND lease_owner = ?
+        ''', (WORKER_ID,))
+        conn.commit()
+    finally:
+        conn.close()
@@ -1,176 +1,299 @@
 
 import os
-import fitz  # PyMuPDF
 from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain_core.messages import HumanMessage
-from database import get_db_connection
-import base64
+from database import get_db_connection, run_db
+from services.render_service import render_pdf_pages, count_pdf_pages, prepare_image_file
+from services import cache_service, page_service, event_bus, suggest_service
+from services.categorizer import categorize_text
 
 # Initialize the Vision Model
 # Using gemini-1.5-flash for cost efficiency
-llm = ChatGoogleGenerativeAI(model="gemini-2.5-flash-lite")
+# SDK retries are disabled (max_retries=1): invoke_with_retry owns retries so it can
+# honour the server's retry hint and the shared rate limiter.
+llm = ChatGoogleGenerativeAI(model="gemini-2.5-flash-lite", max_retries=1)
 
 import asyncio
-from google.api_core.exceptions import ResourceExhausted
+from services import rate_limiter
 
-async def invoke_with_retry(llm, messages, max_retries=3, initial_delay=10):
-    for attempt in range(max_retries):
-        try:
-            return await llm.ainvoke(messages)
-        except ResourceExhausted as e:
-            print(f"Quota exceeded (attempt {attempt + 1}/{max_retries})...")
-            if attempt == max_retries - 1:
-                raise e
-            # Wait with exponential backoff (retry after 60s as suggested by API usually, but starting smaller + checked error msg says ~60s)
-            # The error message said "Please retry in 59.23s", so let's be safe with 65s for 429s specifically if we interpret that.
-            # But generic backoff: 30, 60, 120
-            delay = 60 * (attempt + 1) 
-            print(f"Retrying in {delay} seconds...")
-            await asyncio.sleep(delay)
-
-async def process_document(document_id: int, file_path: str):
+async def invoke_with_retry(llm, messages, max_retries=6):
     """
-    Background task to process the document:
-    1. Extract images (first 2 pages for PDF, or the image itself).
-    2. Send to Gemini Vision for text extraction.
-    3. Update database with result.
+    Call the LLM through the process-wide rate limiter, retrying quota errors
+    (see rate_limiter.call_with_retry).
     """
-    print(f"Starting processing for document {document_id}...")
+    tokens = rate_limiter.estimate_tokens(messages)
+    return await rate_limiter.call_with_retry(lambda: llm.ainvoke(messages), tokens, max_retries)
+
+# Max concurrent OCR calls, shared by all documents being processed
+OCR_CONCURRENCY = int(os.getenv("OCR_CONCURRENCY", "8"))
+_ocr_semaphore = asyncio.Semaphore(OCR_CONCURRENCY)
+
+# Page budget: PDF pages processed per document (0 = all). Pages past it are ignored.
+MAX_PAGES = int(os.getenv("MAX_PAGES", "100"))
+# Pages of one document being extracted at a time, which bounds the rendered pages held in memory
+DOCUMENT_PAGE_CONCURRENCY = int(os.getenv("DOCUMENT_PAGE_CONCURRENCY", str(OCR_CONCURRENCY)))
+
+async def _extract_page_text(page_index: int, page: dict, use_cache: bool = True):
+    """
+    OCR a single rasterized PDF page, waiting for a free slot in the shared OCR limit.
+    Pages with a local text layer and pages already seen (same rendered bytes) skip the LLM.
+    `use_cache=False` OCRs the page again even if it was seen (the new text replaces the cached one).
+    """
+    if "text" in page:
+        print(f"Page {page_index+1}: using embedded text layer")
+        return page["text"]
+
+    b64_data, page_hash = page["b64_data"], page["page_hash"]
+    if use_cache:
+        cached_text = await run_db(cache_service.lookup_page, page_hash)
+        if cached_text is not None:
+            print(f"Page {page_index+1}: page cache hit")
+            return cached_text
+
+    image_content = {"type": "image_url", "image_url": {"url": f"data:{page['mime_type']};base64,{b64_data}"}}
+    
+    extraction_prompt = f"Extract all the text content from this page (Page {page_index+1}). Output only the extracted text, preserving the structure as much as possible."
     
+    message = HumanMessage(
+        content=[
+            {"type": "text", "text": extraction_prompt},
+            image_content
+        ]
+    )
+
+    async with _ocr_semaphore:
+        print(f"Processing page {page_index+1}...")
+        response = await invoke_with_retry(llm, [message])
+
+    page_text = response.content
+    if not isinstance(page_text, str):
+        page_text = str(page_text)
+
+    await run_db(cache_service.store_page, page_hash, page_text)
+    return page_text
+
+# Database steps of process_document (run on the DB thread pool via run_db)
+def _start_processing(document_id: int, use_cache: bool = True):
+    """
+    Mark the document as processing. If the same file was already processed (possibly
+    queued before the first copy finished) complete it from the extraction cache,
+    unless `use_cache` is False. Returns (user_id, content_hash, cached_result or None).
+    """
     conn = get_db_connection()
     cursor = conn.cursor()
-    
+
     try:
-        # Update status to processing
         cursor.execute("UPDATE documents SET processing_status = ? WHERE id = ?", ('processing', document_id))
+        cursor.execute("SELECT user_id, content_hash FROM documents WHERE id = ?", (document_id,))
+        row = cursor.fetchone()
+        user_id = row['user_id'] if row else None
+        content_hash = row['content_hash'] if row else None
+
+        cached = cache_service.lookup_document(content_hash, conn=conn) if use_cache else None
+        if cached:
+            cursor.execute(
+                "UPDATE documents SET processing_status = ?, extracted_text = ?, category = ? WHERE id = ?",
+                ('completed', cached['extracted_text'], cached['category'], document_id)
+            )
+            page_service.store_pages(document_id, cached['extracted_text'], conn=conn)
         conn.commit()
+        return user_id, content_hash, cached
+    finally:
+        conn.close()
+
+def _save_result(document_id: int, content_hash: str, extracted_text: str, category: str):
+    conn = get_db_connection()
+    try:
+        # The search/suggest indexes are only redone for values that changed (their
+        # triggers compare old and new), so a categorize-only run, whose text is rebuilt
+        # from unchanged pages, reindexes nothing but a new category. After a page
+        # reprocess the whole text is reindexed (~50 ms for 100 pages), but only the
+        # re-extracted pages are embedded again (document_chunks are kept per page).
+        conn.execute(
+            "UPDATE documents SET processing_status = ?, extracted_text = ?, category = ? WHERE id = ?", 
+            ('completed', extracted_text, category, document_id)
+        )
+        cache_service.store_document(content_hash, extracted_text, category, conn=conn)
+        conn.commit()
+    finally:
+        conn.close()
+
+def _save_failure(document_id: int, error_msg: str):
+    """
+    Mark the document as failed. Returns its user_id (None if it was deleted).
+    """
+    conn = get_db_connection()
+    try:
+        row = conn.execute(
+            "UPDATE documents SET processing_status = ?, error_message = ? WHERE id = ? RETURNING user_id", 
+            ('failed', error_msg, document_id)
+        ).fetchone()
+        conn.commit()
+        return row['user_id'] if row else None
+    finally:
+        conn.close()
+
+def _publish_progress(user_id: str, document_id: int, pages_done: int, pages_total: int):
+    event_bus.publish(user_id, "progress", document_id=document_id, pages_done=pages_done, pages_total=pages_total)
+
+async def _extract_pdf(document_id: int, user_id: str, file_path: str, redo_pages=()):
+    """
+    Extract the pages of a PDF within the page budget. Each page is stored as soon as
+    it is done, so an interrupted run resumes where it stopped, and searches find it
+    before the document completes.
+    Pages in `redo_pages` skip the page cache. Returns the full extracted text.
+    """
+    page_count = await count_pdf_pages(file_path)
+    pages_total = min(page_count, MAX_PAGES) if MAX_PAGES > 0 else page_count
+    if pages_total < page_count:
+        print(f"Document {document_id}: processing the first {pages_total} of {page_count} pages (MAX_PAGES)")
 
-        if not os.path.exists(file_path):
-            raise FileNotFoundError(f"File not found: {file_path}")
+    done = await run_db(page_service.start_pages, document_id, pages_total)
+    _publish_progress(user_id, document_id, len(done), pages_total)
+    todo = [i for i in range(pages_total) if i + 1 not in done]
+    print(f"Processing {len(todo)} pages from PDF ({len(done)} already done)...")
+
+    slots = asyncio.Semaphore(DOCUMENT_PAGE_CONCURRENCY)
+
+    async def _process_page(i: int, page: dict):
+        try:
+            page_text = await _extract_page_text(i, page, use_cache=i + 1 not in redo_pages)
+            pages_done = await run_db(page_service.save_page, document_id, i + 1, page_text)
+        finally:
+            slots.release()
+        if pages_done is not None:  # None: deleted meanwhile
+            _publish_progress(user_id, document_id, pages_done, pages_total)
+
+    # Pages are rendered in the pool and sent to OCR as soon as they are ready, with at
+    # most DOCUMENT_PAGE_CONCURRENCY pages in flight
+    page_tasks = []
+    try:
+        async for i, page in render_pdf_pages(file_path, todo):
+            await slots.acquire()
+            page_tasks.append(asyncio.create_task(_process_page(i, page)))
+        await asyncio.gather(*page_tasks)
+    except BaseException:
+        for task in page_tasks:
+            task.cancel()
+        raise
+
+    pages = await run_db(page_service.load_pages, document_id)
+    return page_service.join_pages((number, text) for number, text in pages if number <= pages_total)
+
+async def _extract_image(document_id: int, user_id: str, file_path: str, file_ext: str):
+    """
+    OCR an uploaded image, stored as the document's only page. Returns the text.
+    """
+    done = await run_db(page_service.start_pages, document_id, 1)
+    if done:
+        # Extracted by an earlier run that failed later (e.g. while categorizing)
+        print("Image text already extracted")
+        return (await run_db(page_service.load_pages, document_id))[0][1]
+
+    print("Processing image file...")
+    _publish_progress(user_id, document_id, 0, 1)
+
+    mime_types = {'.jpg': 'image/jpeg', '.jpeg': 'image/jpeg', '.png': 'image/png'}
+    image = await prepare_image_file(file_path, mime_types.get(file_ext, 'image/jpeg'))
+    
+    image_content = {"type": "image_url", "image_url": {"url": f"data:{image['mime_type']};base64,{image['b64_data']}"}}
+    
+    extraction_prompt = "Extract all the text content from this image. Output only the extracted text, preserving the structure as much as possible."
+    
+    message = HumanMessage(
+        content=[
+            {"type": "text", "text": extraction_prompt},
+            image_content
+        ]
+    )
+    
+    async with _ocr_semaphore:
+        response = await invoke_with_retry(llm, [message])
+    text = response.content
+    if not isinstance(text, str):
+        text = str(text)
+
+    await run_db(page_service.save_page, document_id, 1, text)
+    _publish_progress(user_id, document_id, 1, 1)
+    return text
+
+async def _load_text(document_id: int, is_pdf: bool):
+    """
+    The document's text rebuilt from its stored pages.
+    """
+    pages = await run_db(page_service.load_pages, document_id)
+    if not pages:
+        raise ValueError("The document has no extracted text to categorize.")
+    return page_service.join_pages(pages) if is_pdf else pages[0][1]
+
+async def process_document(document_id: int, file_path: str, options: dict = None):
+    """
+    Background task to process the document:
+    1. Extract the text of each page (up to MAX_PAGES for PDF, or the image itself),
+       through the text layer or Gemini Vision, storing pages as they finish.
+    2. Categorize the text.
+    3. Update database with result.
+    Pages already stored are kept (see routes.documents reprocess). `options`:
+      {"mode": "categorize"}  only categorize the stored text again
+      {"pages": [2, 5]}       OCR these pages without the page cache (the caller deletes
+                              their stored text first, so they are extracted again)
+      {"mode": "index"}       nothing to extract (a re-upload completed from the extraction
+                              cache); the job only runs the post-processing steps
+    """
+    options = options or {}
+    if options.get("mode") == "index":
+        return
+    categorize_only = options.get("mode") == "categorize"
+    redo_pages = set(options.get("pages") or [])
+    print(f"Starting processing for document {document_id}...")
+    
+    try:
+        # Update status to processing. A reprocess of selected pages or of the category
+        # must not be answered from the whole-file cache.
+        user_id, content_hash, cached = await run_db(
+            _start_processing, document_id, not (categorize_only or redo_pages)
+        )
+        if cached:
+            print(f"Document {document_id} served from extraction cache.")
+            suggest_service.invalidate_user(user_id)
+            event_bus.publish_status(user_id, document_id, 'completed', cached['category'], cached['extracted_text'])
+            return
+        event_bus.publish_status(user_id, document_id, 'processing')
 
-        # 1. Prepare and Process Content
         file_ext = os.path.splitext(file_path)[1].lower()
-        extracted_text_parts = []
-        
-        if file_ext == '.pdf':
-            doc = fitz.open(file_path)
-            # Process up to first 2 pages
-            num_pages = min(2, len(doc))
-            print(f"Processing {num_pages} pages from PDF...")
-            
-            for i in range(num_pages):
-                print(f"Processing page {i+1}/{num_pages}...")
-                page = doc.load_page(i)
-                pix = page.get_pixmap()
-                img_data = pix.tobytes("png")
-                b64_data = base64.b64encode(img_data).decode("utf-8")
-                
-                # Create message for this specific page
-                image_content = {"type": "image_url", "image_url": {"url": f"data:image/png;base64,{b64_data}"}}
-                
-                extraction_prompt = f"Extract all the text content from this page (Page {i+1}). Output only the extracted text, preserving the structure as much as possible."
-                
-                message = HumanMessage(
-                    content=[
-                        {"type": "text", "text": extraction_prompt},
-                        image_content
-                    ]
-                )
-                
-                # Call LLM for this page
-                response = await invoke_with_retry(llm, [message])
-                page_text = response.content
-                if not isinstance(page_text, str):
-                    page_text = str(page_text)
-                    
-                extracted_text_parts.append(f"--- Page {i+1} ---\n{page_text}")
-                
-            doc.close()
-            
-        elif file_ext in ['.jpg', '.jpeg', '.png']:
-            print("Processing image file...")
-            with open(file_path, "rb") as image_file:
-                img_data = image_file.read()
-                b64_data = base64.b64encode(img_data).decode("utf-8")
-                mime_types = {'.jpg': 'image/jpeg', '.jpeg': 'image/jpeg', '.png': 'image/png'}
-                mime_type = mime_types.get(file_ext, 'image/jpeg')
-                
-                image_content = {"type": "image_url", "image_url": {"url": f"data:{mime_type};base64,{b64_data}"}}
-                
-                extraction_prompt = "Extract all the text content from this image. Output only the extracted text, preserving the structure as much as possible."
-                
-                message = HumanMessage(
-                    content=[
-                        {"type": "text", "text": extraction_prompt},
-                        image_content
-                    ]
-                )
-                
-                response = await invoke_with_retry(llm, [message])
-                text = response.content
-                if not isinstance(text, str):
-                    text = str(text)
-                extracted_text_parts.append(text)
-                
+
+        if categorize_only:
+            extracted_text = await _load_text(document_id, file_ext == '.pdf')
         else:
-             raise ValueError(f"Unsupported file type: {file_ext}")
+            if not await asyncio.to_thread(os.path.exists, file_path):
+                raise FileNotFoundError(f"File not found: {file_path}")
 
-        if not extracted_text_parts:
+            # 1. Prepare and Process Content
+            if file_ext == '.pdf':
+                extracted_text = await _extract_pdf(document_id, user_id, file_path, redo_pages)
+            elif file_ext in ['.jpg', '.jpeg', '.png']:
+                extracted_text = await _extract_image(document_id, user_id, file_path, file_ext)
+            else:
+                 raise ValueError(f"Unsupported file type: {file_ext}")
+
+        if not extracted_text:
             raise ValueError("No content could be extracted from the file.")
 
-        # Combine extracted text
-        extracted_text = "\n\n".join(extracted_text_parts)
         print(f"Extracted text length: {len(extracted_text)}")
         
-        # 2b. Call LLM for Categorization
+        # 2. Call LLM for Categorization (batched with other documents)
         print("Starting categorization...")
-        category_prompt = f"""
-        Analyze the following text extracted from a document and categorize it into exactly one of the following categories:
-        - Invoice
-        - Receipt
-        - Contract
-        - Note
-        - Letter
-        - Form
-        - Other
-
-        Text to analyze:
-        {extracted_text[:2000]}  # Analyze first 2000 chars
-
-        Return ONLY the category name. Do not include any explanation.
-        """
-        
-        category_message = HumanMessage(content=category_prompt)
-        category_response = await invoke_with_retry(llm, [category_message])
-        category = category_response.content.strip()
-        
-        # Validate category
-        valid_categories = ["Invoice", "Receipt", "Contract", "Note", "Letter", "Form", "Other"]
-        # Basic cleanup if LLM returns "Category: Invoice" or similar
-        for valid_cat in valid_categories:
-            if valid_cat.lower() in category.lower():
-                category = valid_cat
-                break
-        else:
-            category = "Uncategorized"
+        category = await categorize_text(extracted_text)
             
         print(f"Document categorized as: {category}")
 
         # 3. Save Result
-        cursor.execute(
-            "UPDATE documents SET processing_status = ?, extracted_text = ?, category = ? WHERE id = ?", 
-            ('completed', extracted_text, category, document_id)
-        )
-        conn.commit()
+        await run_db(_save_result, document_id, content_hash, extracted_text, category)
         print(f"Document {document_id} processed successfully.")
+        suggest_service.invalidate_user(user_id)
+        event_bus.publish_status(user_id, document_id, 'completed', category, extracted_text)
 
     except Exception as e:
         print(f"Error processing document {document_id}: {e}")
-        error_msg = str(e)
-        cursor.execute(
-            "UPDATE documents SET processing_status = ?, error_message = ? WHERE id = ?", 
-            ('failed', error_msg, document_id)
-        )
-        conn.commit()
-    finally:
-        conn.close()
+        user_id = await run_db(_save_failure, document_id, str(e))
+        event_bus.publish_status(user_id, document_id, 'failed', error=str(e))
@@ -0,0 +1,130 @@
+import re
+from database import with_db_connection
+
+# Text of each processed page, written as soon as the page is extracted
+# (document_pages), so an interrupted run resumes where it stopped. Each page is indexed
+# on its own (document_pages_fts) to tell which page a search result matches on, and
+# re-extracting a page reindexes only that page. documents.extracted_text keeps the
+# whole text, written when the document completes: PDF pages joined under
+# "--- Page N ---" markers, images as their plain text. Searches match against it
+# (documents_fts), so terms can be on different pages; until then a document being
+# processed is matched term by term on the pages stored so far (routes.documents).
+PAGE_MARKER = re.compile(r"^--- Page (\d+) ---\n", re.MULTILINE)
+
+# A page's row id is derived from its document and number, so the pages of a document
+# are one contiguous id range (a primary key range scan, also for the FTS index) and
+# need no secondary index: document 152, page 3 -> 152000003.
+PAGE_ID_SPAN = 1000000
+
+
+def page_id(document_id: int, page_number: int):
+    if not 0 < page_number < PAGE_ID_SPAN:
+        raise ValueError(f"Page number out of range: {page_number}")
+    return document_id * PAGE_ID_SPAN + page_number
+
+
+def page_id_range(document_id: int, last_page: int = PAGE_ID_SPAN - 1):
+    """
+    (first, last) row ids of a document's pages, for `id BETWEEN ? AND ?`.
+    """
+    return document_id * PAGE_ID_SPAN + 1, document_id * PAGE_ID_SPAN + last_page
+
+
+def split_pages(extracted_text: str):
+    """
+    [(page_number, text)] of an extracted text. Text without page markers is page 1.
+    """
+    if not extracted_text:
+        return []
+    parts = PAGE_MARKER.split(extracted_text)
+    if len(parts) == 1:
+        return [(1, extracted_text)]
+    # parts: [before the first marker, number, text, number, text, ...]
+    return [(int(number), text.rstrip("\n")) for number, text in zip(parts[1::2], parts[2::2])]
+
+
+def join_pages(pages):
+    """
+    Inverse of split_pages for PDFs: pages is [(page_number, text)] in page order.
+    """
+    return "\n\n".join(f"--- Page {number} ---\n{text}" for number, text in pages)
+
+
+def start_pages(document_id: int, pages_total: int, conn=None):
+    """
+    Record how many pages will be processed. Returns the page numbers already stored
+    by an earlier, interrupted run, which don't need to be extracted again.
+    """
+    def _start(conn):
+        rows = conn.execute(
+            "SELECT page_number FROM document_pages WHERE id BETWEEN ? AND ?",
+            page_id_range(document_id, pages_total)
+        ).fetchall()
+        done = {row['page_number'] for row in rows}
+        conn.execute(
+            "UPDATE documents SET pages_done = ?, pages_total = ? WHERE id = ?",
+            (len(done), pages_total, document_id)
+        )
+        return done
+
+    return with_db_connection(conn, _start)
+
+
+def save_page(document_id: int, page_number: int, text: str, conn=None):
+    """
+    Store one extracted page and count it as done. Returns the new pages_done
+    (None if the document was deleted meanwhile).
+    """
+    def _save(conn):
+        if not conn.execute("SELECT 1 FROM documents WHERE id = ?", (document_id,)).fetchone():
+            return None
+        # An upsert rather than INSERT OR REPLACE: a replaced row wouldn't fire the delete trigger
+        conn.execute('''
+            INSERT INTO document_pages (id, document_id, page_number, text) VALUES (?, ?, ?, ?)
+            ON CONFLICT (id) DO UPDATE SET text = excluded.text
+        ''', (page_id(document_id, page_number), document_id, page_number, text))
+        first, _ = page_id_range(document_id)
+        row = conn.execute('''
+            UPDATE documents SET pages_done = (
+                SELECT COUNT(*) FROM document_pages WHERE id BETWEEN ? AND ? + pages_total - 1
+            )
+            WHERE id = ?
+            RETURNING pages_done
+        ''', (first, first, document_id)).fetchone()
+        return row['pages_done'] if row else None
+
+    return with_db_connection(conn, _save)
+
+
+def load_pages(document_id: int, conn=None):
+    """
+    [(page_number, text)] of a document, in page order.
+    """
+    def _load(conn):
+        rows = conn.execute(
+            "SELECT page_number, text FROM document_pages WHERE id BETWEEN ? AND ? ORDER BY id",
+            page_id_range(document_id)
+        ).fetchall()
+        return [(row['page_number'], row['text']) for row in rows]
+
+    return with_db_connection(conn, _load)
+
+
+def store_pages(document_id: int, extracted_text: str, conn=None):
+    """
+    Replace a document's pages with those of an already extracted text
+    (documents completed from the extraction cache).
+    """
+    def _store(conn):
+        pages = split_pages(extracted_text)
+        conn.execute("DELETE FROM document_pages WHERE id BETWEEN ? AND ?", page_id_range(document_id))
+        conn.executemany(
+            "INSERT INTO document_pages (id, document_id, page_number, text) VALUES (?, ?, ?, ?)",
+            [(page_id(document_id, number), document_id, number, text) for number, text in pages]
+        )
+        conn.execute(
+            "UPDATE documents SET pages_done = ?, pages_total = ? WHERE id = ?",
+            (len(pages), len(pages), document_id)
+        )
+
+    with_db_connection(conn, _store)
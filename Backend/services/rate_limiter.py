@@ -0,0 +1,188 @@
+import os
+import re
+import time
+import random
+import asyncio
+from google.api_core.exceptions import ResourceExhausted
+
+# Client-side Gemini quota, shared by every LLM call in this process. Calls wait for
+# capacity here instead of bursting into the server's limit and stalling on 429s.
+GEMINI_RPM = int(os.getenv("GEMINI_RPM", "60"))          # requests per minute
+GEMINI_TPM = int(os.getenv("GEMINI_TPM", "250000"))      # tokens per minute
+BACKOFF_BASE_SECONDS = float(os.getenv("BACKOFF_BASE_SECONDS", "2"))
+BACKOFF_MAX_SECONDS = float(os.getenv("BACKOFF_MAX_SECONDS", "120"))
+
+# Rough token cost of one image part (Gemini bills a fixed amount per image tile)
+IMAGE_TOKEN_ESTIMATE = 258
+
+
+class TokenBucket:
+    """
+    Classic token bucket: holds up to `capacity` tokens, refilled continuously at
+    `capacity` per minute.
+    """
+
+    def __init__(self, capacity: float):
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.capacity / 60)
+        self.updated_at = now
+
+    def wait_time(self, amount: float):
+        """
+        Seconds until `amount` tokens are available (0 if they are available now).
+        """
+        self._refill()
+        # A single request larger than the bucket only has to wait for a full bucket
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) * 60 / self.capacity
+
+    def take(self, amount: float):
+        self._refill()
+        self.tokens -= min(amount, self.capacity)
+
+    def drain(self):
+        self._refill()
+        self.tokens = 0.0
+
+
+_request_bucket = TokenBucket(GEMINI_RPM)
+_token_bucket = TokenBucket(GEMINI_TPM)
+_lock = None
+_circuit_open_until = 0.0
+
+_stats = {"requests": 0, "throttled_seconds": 0.0, "rate_limited": 0}
+
+
+def _get_lock():
+    global _lock
+    if _lock is None:
+        _lock = asyncio.Lock()
+    return _lock
+
+
+async def acquire(tokens: int):
+    """
+    Wait until one request of roughly `tokens` tokens fits the quota (and the circuit
+    breaker is closed), then reserve it. Callers queue here in FIFO order.
+    """
+    started = time.monotonic()
+    async with _get_lock():
+        while True:
+            delay = max(
+                _circuit_open_until - time.monotonic(),
+                _request_bucket.wait_time(1),
+                _token_bucket.wait_time(tokens),
+            )
+            if delay <= 0:
+                break
+            await asyncio.sleep(delay)
+
+        _request_bucket.take(1)
+        _token_bucket.take(tokens)
+
+    _stats["requests"] += 1
+    _stats["throttled_seconds"] += time.monotonic() - started
+
+
+def report_rate_limited(retry_after: float):
+    """
+    Called after a 429. Opens the circuit breaker so every caller pauses for
+    `retry_after` seconds, and empties the buckets so traffic ramps back up slowly.
+    """
+    global _circuit_open_until
+    _stats["rate_limited"] += 1
+    _circuit_open_until = max(_circuit_open_until, time.monotonic() + retry_after)
+    _request_bucket.drain()
+    _token_bucket.drain()
+
+
+def backoff_delay(attempt: int, retry_after: float = None):
+    """
+    Jittered exponential backoff, never shorter than the server's retry hint.
+    """
+    delay = random.uniform(0, min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * (2 ** attempt)))
+    if retry_after is not None:
+        # Small jitter so paused callers don't all return in the same instant
+        delay = max(delay, retry_after + random.uniform(0, 1))
+    return delay
+
+
+def parse_retry_after(error: Exception):
+    """
+    Extract the server's suggested delay from a quota error, e.g.
+    "Please retry in 59.23s" or "retry_delay { seconds: 59 }". Returns None if absent.
+    """
+    message = str(error)
+    match = re.search(r"retry in ([\d.]+)\s*s", message, re.IGNORECASE)
+    if not match:
+        match = re.search(r"retry_delay\s*\{\s*seconds:\s*(\d+)", message)
+    if not match:
+        match = re.search(r"['\"]retryDelay['\"]:\s*['\"]([\d.]+)s", message)
+    return float(match.group(1)) if match else None
+
+
+def estimate_tokens(messages):
+    """
+    Approximate input tokens of a list of LangChain messages (~4 chars per token).
+    """
+    tokens = 0
+    for message in messages:
+        content = message.content
+        if isinstance(content, str):
+            tokens += len(content) // 4
+            continue
+        for part in content:
+            if part.get("type") == "text":
+                tokens += len(part.get("text", "")) // 4
+            else:
+                tokens += IMAGE_TOKEN_ESTIMATE
+    return max(tokens, 1)
+
+
+def is_quota_error(e: Exception):
+    # google.api_core raises ResourceExhausted; the google-genai based client
+    # surfaces the same condition as an HTTP 429 error
+    if isinstance(e, ResourceExhausted):
+        return True
+    if getattr(e, "code", None) == 429 or getattr(e, "status_code", None) == 429:
+        return True
+    message = str(e)
+    return "429" in message or "RESOURCE_EXHAUSTED" in message
+
+
+async def call_with_retry(call, tokens: int, max_retries: int = 6):
+    """
+    Run `call()` (a coroutine factory making one Gemini request of roughly `tokens`
+    tokens) through the limiter. On quota errors all callers pause (circuit breaker)
+    for the server's retry hint or a jittered exponential backoff, then the call is
+    retried, so work waits instead of failing.
+    """
+    for attempt in range(max_retries):
+        await acquire(tokens)
+        try:
+            return await call()
+        except Exception as e:
+            if not is_quota_error(e):
+                raise
+            print(f"Quota exceeded (attempt {attempt + 1}/{max_retries})...")
+            if attempt == max_retries - 1:
+                raise e
+            delay = backoff_delay(attempt, parse_retry_after(e))
+            report_rate_limited(delay)
+            print(f"Retrying in {delay:.1f} seconds...")
+
+
+def get_limiter_stats():
+    return {
+        **_stats,
+        "rpm_limit": GEMINI_RPM,
+        "tpm_limit": GEMINI_TPM,
+        "circuit_open_seconds": max(0.0, _circuit_open_until - time.monotonic()),
+    }
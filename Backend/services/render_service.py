@@ -0,0 +1,275 @@
+import os
+import math
+import base64
+import hashlib
+import asyncio
+import collections
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import fitz  # PyMuPDF
+
+# Rendering runs outside the event loop so uploads, search and listing stay responsive.
+# "process" (default) sidesteps the GIL entirely; "thread" avoids the spawn cost on small boxes.
+RENDER_WORKERS = int(os.getenv("RENDER_WORKERS", str(min(4, os.cpu_count() or 1))))
+RENDER_EXECUTOR = os.getenv("RENDER_EXECUTOR", "process")
+RENDER_LOOKAHEAD = 2 * RENDER_WORKERS  # pages rendered ahead of OCR, per document
+
+# Text-layer fast path: born-digital pages are read with get_text() instead of being OCR'd.
+TEXT_LAYER_ENABLED = os.getenv("TEXT_LAYER_ENABLED", "1") == "1"
+TEXT_LAYER_MIN_CHARS = int(os.getenv("TEXT_LAYER_MIN_CHARS", "50"))
+TEXT_LAYER_MIN_QUALITY = 0.9        # share of non-space chars that are printable, non-garbage
+TEXT_LAYER_MIN_DENSITY = 5.0        # chars per square inch, checked on image-heavy pages
+TEXT_LAYER_IMAGE_COVERAGE = 0.5     # page share covered by images that makes a page "image-heavy"
+
+# Rasterization profile for pages and images sent to OCR. Scans are rendered at the
+# resolution they were scanned at, drawn pages at OCR_DPI (OCR_MAX_DPI for small print),
+# always within OCR_MAX_PIXELS (image tokens grow with pixels). Grayscale by default.
+OCR_DPI = int(os.getenv("OCR_DPI", "100"))
+OCR_MIN_DPI = 72
+OCR_MAX_DPI = int(os.getenv("OCR_MAX_DPI", "150"))
+OCR_SMALL_PRINT_PT = 8.0            # font size below which a page counts as small print
+OCR_MAX_PIXELS = int(os.getenv("OCR_MAX_PIXELS", "1500000"))
+OCR_GRAYSCALE = os.getenv("OCR_GRAYSCALE", "1") == "1"
+OCR_JPEG_QUALITY = int(os.getenv("OCR_JPEG_QUALITY", "75"))
+# auto: the smaller of JPEG and PNG (text on a clean background is often smaller as PNG)
+OCR_IMAGE_FORMAT = os.getenv("OCR_IMAGE_FORMAT", "auto").lower()
+
+_executor = None
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        if RENDER_EXECUTOR == "thread":
+            _executor = ThreadPoolExecutor(max_workers=RENDER_WORKERS, thread_name_prefix="render")
+        else:
+            # spawn: forking a process that already runs uvicorn threads is unsafe
+            _executor = ProcessPoolExecutor(
+                max_workers=RENDER_WORKERS,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        print(f"Started {RENDER_EXECUTOR} render pool with {RENDER_WORKERS} workers")
+    return _executor
+
+
+def shutdown_render_pool():
+    """
+    Stop the render workers. Called from the app lifespan on shutdown.
+    """
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+# --- Worker functions (run inside the pool; must stay top-level and picklable) ---
+
+def _count_pages(file_path: str):
+    with fitz.open(file_path) as doc:
+        return len(doc)
+
+
+def _usable_text_layer(page, text: str):
+    """
+    Decide whether a page's embedded text can replace OCR.
+    Rejects empty/near-empty layers, garbled layers (broken font encodings show up as
+    U+FFFD or control chars), and scans that only carry a few words of real text.
+    """
+    chars = [c for c in text if not c.isspace()]
+    if len(chars) < TEXT_LAYER_MIN_CHARS:
+        return False
+
+    good = sum(1 for c in chars if c.isprintable() and c != "\ufffd")
+    if good / len(chars) < TEXT_LAYER_MIN_QUALITY:
+        return False
+
+    page_area = page.rect.width * page.rect.height
+    if page_area <= 0:
+        return False
+
+    image_area = 0.0
+    for info in page.get_image_info():
+        x0, y0, x1, y1 = info["bbox"]
+        image_area += max(0.0, x1 - x0) * max(0.0, y1 - y0)
+
+    if image_area / page_area >= TEXT_LAYER_IMAGE_COVERAGE:
+        # Mostly a scanned image: trust the text only if it is as dense as real page text
+        density = len(chars) / (page_area / (72 * 72))
+        if density < TEXT_LAYER_MIN_DENSITY:
+            return False
+
+    return True
+
+
+def _has_small_print(page):
+    """
+    Whether most of the page's text (by characters) is set below OCR_SMALL_PRINT_PT.
+    """
+    small = total = 0
+    for block in page.get_text("dict")["blocks"]:
+        for line in block.get("lines", []):
+            for span in line["spans"]:
+                chars = len(span["text"].strip())
+                total += chars
+                if span["size"] < OCR_SMALL_PRINT_PT:
+                    small += chars
+    return total > 0 and small * 2 > total
+
+
+def _choose_dpi(page):
+    page_area = page.rect.width * page.rect.height
+    if page_area <= 0:
+        return OCR_MIN_DPI
+
+    dpi = OCR_DPI
+    for info in page.get_image_info():
+        x0, y0, x1, y1 = info["bbox"]
+        image_area = max(0.0, x1 - x0) * max(0.0, y1 - y0)
+        if image_area >= page_area * TEXT_LAYER_IMAGE_COVERAGE:
+            # A scan: more pixels than it was scanned with add nothing
+            dpi = 72 * math.sqrt(info["width"] * info["height"] / image_area)
+            break
+    else:
+        if _has_small_print(page):
+            dpi = OCR_MAX_DPI
+
+    dpi = max(OCR_MIN_DPI, min(dpi, OCR_MAX_DPI))
+    return min(dpi, 72 * math.sqrt(OCR_MAX_PIXELS / page_area))
+
+
+def _encode_for_ocr(pix):
+    """
+    (image bytes, mime type) of a pixmap in the OCR_IMAGE_FORMAT.
+    """
+    if OCR_IMAGE_FORMAT == "png":
+        return pix.tobytes("png"), "image/png"
+    jpeg = pix.tobytes("jpg", jpg_quality=OCR_JPEG_QUALITY)
+    if OCR_IMAGE_FORMAT == "auto":
+        png = pix.tobytes("png")
+        if len(png) < len(jpeg):
+            return png, "image/png"
+    return jpeg, "image/jpeg"
+
+
+def _rasterize_for_ocr(page, dpi: float):
+    zoom = dpi / 72
+    colorspace = fitz.csGRAY if OCR_GRAYSCALE else fitz.csRGB
+    pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), colorspace=colorspace, alpha=False)
+    return _encode_for_ocr(pix)
+
+
+def _render_page(file_path: str, page_index: int):
+    """
+    Returns {"text": ...} for pages with a usable text layer, otherwise
+    {"b64_data": ..., "mime_type": ..., "page_hash": ...} with the page rendered for OCR.
+    """
+    with fitz.open(file_path) as doc:
+        page = doc.load_page(page_index)
+
+        if TEXT_LAYER_ENABLED:
+            text = page.get_text()
+            if _usable_text_layer(page, text):
+                return {"text": text.strip()}
+
+        img_data, mime_type = _rasterize_for_ocr(page, _choose_dpi(page))
+    # Identical pages render to identical bytes, so the hash keys the page OCR cache
+    page_hash = hashlib.sha256(img_data).hexdigest()
+    return {"b64_data": base64.b64encode(img_data).decode("utf-8"), "mime_type": mime_type, "page_hash": page_hash}
+
+
+def _render_thumbnail(file_path: str, page_index: int, width: int, quality: int, out_path: str):
+    """
+    Render one page `width` pixels wide as a JPEG into `out_path` (images open as a
+    single page). Returns False if the file has no such page.
+    """
+    with fitz.open(file_path) as doc:
+        if page_index >= len(doc):
+            return False
+        page = doc.load_page(page_index)
+        zoom = width / page.rect.width
+        pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), alpha=False)
+        data = pix.tobytes("jpg", jpg_quality=quality)
+    # Written under a temporary name and renamed, so a reader never sees half a file
+    tmp_path = f"{out_path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, out_path)
+    return True
+
+
+def _prepare_image(file_path: str, mime_type: str):
+    """
+    Returns {"b64_data": ..., "mime_type": ...} for an uploaded image: re-encoded with the
+    OCR profile (grayscale, at most OCR_MAX_PIXELS), or the original file if that is smaller.
+    """
+    with open(file_path, "rb") as image_file:
+        original = image_file.read()
+
+    with fitz.open(file_path) as doc:
+        page = doc.load_page(0)
+        info = page.get_image_info()[0]
+        pixels = info["width"] * info["height"]
+        # Native resolution, scaled down to the pixel budget
+        zoom = info["width"] / page.rect.width * min(1.0, math.sqrt(OCR_MAX_PIXELS / pixels))
+        img_data, encoded_type = _rasterize_for_ocr(page, 72 * zoom)
+
+    if len(original) <= len(img_data) and pixels <= OCR_MAX_PIXELS:
+        img_data, encoded_type = original, mime_type
+    return {"b64_data": base64.b64encode(img_data).decode("utf-8"), "mime_type": encoded_type}
+
+
+# --- Async API ---
+
+async def _run(func, *args):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_get_executor(), func, *args)
+
+
+async def count_pdf_pages(file_path: str):
+    """
+    Number of pages in a PDF.
+    """
+    return await _run(_count_pages, file_path)
+
+
+async def render_pdf_pages(file_path: str, page_indexes):
+    """
+    Prepare the given pages of a PDF in parallel across the pool, at most
+    RENDER_LOOKAHEAD pages ahead of the consumer (rendered pages wait in memory).
+    Yields (page_index, page) in the given order as soon as each page is ready, where page
+    is {"text": ...} (local text layer) or {"b64_data": ..., "mime_type": ..., "page_hash": ...} (needs OCR).
+    """
+    page_indexes = iter(page_indexes)
+    futures = collections.deque()
+
+    def _submit_next():
+        for i in page_indexes:
+            futures.append((i, asyncio.ensure_future(_run(_render_page, file_path, i))))
+            return
+
+    try:
+        for _ in range(RENDER_LOOKAHEAD):
+            _submit_next()
+        while futures:
+            i, future = futures.popleft()
+            page = await future
+            _submit_next()
+            yield i, page
+    finally:
+        # Consumer stopped early or a page failed: drop the pages still queued
+        for _, future in futures:
+            future.cancel()
+
+
+async def prepare_image_file(file_path: str, mime_type: str):
+    """
+    Prepare an uploaded image for OCR. Returns {"b64_data": ..., "mime_type": ...}.
+    """
+    return await _run(_prepare_image, file_path, mime_type)
+
+
+async def render_thumbnail(file_path: str, page_index: int, width: int, quality: int, out_path: str):
+    """
+    Render a preview image of one page into `out_path`. False if the page doesn't exist.
+    """
+    return await _run(_render_thumbnail, file_path, page_index, width, quality, out_path)
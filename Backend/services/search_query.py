@@ -0,0 +1,282 @@
+import re
+
+# Translates the search box syntax into an FTS5 MATCH expression:
+#   invoice 2024            both terms (implicit AND)
+#   invoice OR receipt      either term; AND / OR / NOT must be upper case
+#   invoice NOT draft       first term without the second
+#   "annual report"         exact phrase
+#   inv*                    prefix
+#   title:acme  category:invoice  text:total   field-scoped (also works on phrases and groups)
+#   (a OR b) c              grouping
+# Every term is emitted as a quoted FTS5 string, so user input can never inject
+# FTS5 syntax. The last plain word is searched as a prefix, so results show up while typing
+# (unless it is excluded with NOT).
+SEARCH_FIELDS = {
+    "title": "title",
+    "category": "category",
+    "text": "extracted_text",
+    "content": "extracted_text",
+}
+CONTENT_COLUMNS = ("title", "extracted_text", "category")
+OPERATORS = {"AND", "OR", "NOT"}
+SEARCH_MAX_TERMS = 32
+
+# A word runs until whitespace, a parenthesis or a quote
+_WORD = re.compile(r'[^\s()"]+')
+
+
+class SearchQueryError(Exception):
+    """
+    The search query can't be parsed. `position` is the offset in the query where the problem is.
+    """
+
+    def __init__(self, message: str, position: int = None):
+        super().__init__(message)
+        self.message = message
+        self.position = position
+
+    def to_dict(self):
+        return {"error": "invalid_query", "message": self.message, "position": self.position}
+
+
+def quote_term(text: str):
+    """
+    `text` as an FTS5 string literal (matched as a phrase of its tokens).
+    """
+    return '"' + text.replace('"', '""') + '"'
+
+
+def _tokenize(query: str):
+    """
+    Split a query into (kind, value, position) tokens. Kinds: "(", ")", "op",
+    "field", "phrase", "word". Phrase and word values are (text, is_prefix).
+    """
+    tokens = []
+    i = 0
+    while i < len(query):
+        char = query[i]
+        if char.isspace():
+            i += 1
+        elif char in "()":
+            tokens.append((char, char, i))
+            i += 1
+        elif char == '"':
+            end = query.find('"', i + 1)
+            if end == -1:
+                raise SearchQueryError("Unclosed quote", i)
+            prefix = query.startswith("*", end + 1)
+            tokens.append(("phrase", (query[i + 1:end], prefix), i))
+            i = end + 2 if prefix else end + 1
+        else:
+            word = _WORD.match(query, i).group()
+            name, colon, rest = word.partition(":")
+            if colon and name.lower() in SEARCH_FIELDS:
+                # title:acme -> field token, then the rest is scanned as usual
+                tokens.append(("field", SEARCH_FIELDS[name.lower()], i))
+                i += len(name) + 1
+                continue
+            if word in OPERATORS:
+                tokens.append(("op", word, i))
+            else:
+                prefix = word.endswith("*")
+                tokens.append(("word", (word.rstrip("*"), prefix), i))
+            i += len(word)
+    return tokens
+
+
+class _Parser:
+    """
+    Recursive descent over the tokens, building the query tree:
+        or_expr  := and_expr ("OR" and_expr)*
+        and_expr := not_expr (["AND"] not_expr)*
+        not_expr := unary ("NOT" unary)*
+        unary    := field unary | "(" or_expr ")" | phrase | word
+    Nodes are ("term", fts5_string), ("field", column, node) and (operator, left, right)
+    with operator "AND", "OR" or "NOT".
+    """
+
+    def __init__(self, query: str):
+        self.query = query
+        self.tokens = _tokenize(query)
+        self.pos = 0
+        self.terms = 0
+        self.negated = 0
+        # Index of the last plain word typed, which gets an implicit prefix
+        words = [n for n, token in enumerate(self.tokens) if token[0] == "word"]
+        self.last_word = words[-1] if words and self.tokens[-1][0] == "word" else None
+
+    def _peek(self):
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else None
+
+    def parse(self):
+        if not self.tokens:
+            raise SearchQueryError("Search query is empty", 0)
+        expression = self._or_expr()
+        token = self._peek()
+        if token is not None:
+            if token[0] == ")":
+                raise SearchQueryError("Unmatched closing parenthesis", token[2])
+            raise SearchQueryError(f"Unexpected '{token[1]}'", token[2])
+        if expression is None:
+            raise SearchQueryError("Search query has no searchable terms", 0)
+        return expression
+
+    def _combine(self, op, left, right):
+        # Words without any letters/digits (e.g. "-" or "&") index to nothing; drop them
+        if left is None:
+            return right
+        if right is None:
+            return left
+        return (op, left, right)
+
+    def _or_expr(self):
+        expression = self._and_expr()
+        while self._peek() and self._peek()[:2] == ("op", "OR"):
+            self.pos += 1
+            expression = self._combine("OR", expression, self._and_expr())
+        return expression
+
+    def _and_expr(self):
+        expression = self._not_expr()
+        while True:
+            token = self._peek()
+            if token is None or token[0] == ")" or token[:2] == ("op", "OR"):
+                return expression
+            if token[:2] == ("op", "AND"):
+                self.pos += 1
+            expression = self._combine("AND", expression, self._not_expr())
+
+    def _not_expr(self):
+        expression = self._unary()
+        while self._peek() and self._peek()[:2] == ("op", "NOT"):
+            position = self._peek()[2]
+            self.pos += 1
+            self.negated += 1
+            excluded = self._unary()
+            self.negated -= 1
+            if expression is None:
+                # FTS5 NOT is binary: there must be something to exclude from
+                raise SearchQueryError("NOT needs a search term before it", position)
+            if excluded is not None:
+                expression = ("NOT", expression, excluded)
+        return expression
+
+    def _unary(self):
+        token = self._peek()
+        if token is None:
+            raise SearchQueryError("Search query ends unexpectedly", len(self.query))
+        kind, value, position = token
+
+        if kind == "field":
+            self.pos += 1
+            operand = self._unary()
+            return ("field", value, operand) if operand is not None else None
+
+        if kind == "(":
+            self.pos += 1
+            expression = self._or_expr()
+            if self._peek() is None or self._peek()[0] != ")":
+                raise SearchQueryError("Unclosed parenthesis", position)
+            self.pos += 1
+            return expression
+
+        if kind in ("phrase", "word"):
+            text, prefix = value
+            # Not after NOT: "invoice NOT draft" must not exclude "drafting"
+            if kind == "word" and self.pos == self.last_word and not self.negated:
+                prefix = True
+            self.pos += 1
+            if not re.search(r"\w", text):
+                return None
+            self.terms += 1
+            if self.terms > SEARCH_MAX_TERMS:
+                raise SearchQueryError(f"Too many search terms (max {SEARCH_MAX_TERMS})", position)
+            return ("term", quote_term(text) + (" *" if prefix else ""))
+
+        if kind == ")":
+            raise SearchQueryError("Unmatched closing parenthesis", position)
+        raise SearchQueryError(f"'{value}' needs a search term on both sides", position)
+
+
+def parse_search(query: str):
+    """
+    Parse a user's search query into a query tree (see _Parser).
+    Raises SearchQueryError for malformed input.
+    """
+    return _Parser(query).parse()
+
+
+def match_expression(tree):
+    """
+    The FTS5 MATCH expression of a query tree. Operands are parenthesized, so FTS5's
+    own precedence never comes into play.
+    """
+    if tree[0] == "term":
+        return tree[1]
+    if tree[0] == "field":
+        return f"{{{tree[1]}}} : ({match_expression(tree[2])})"
+    return f"({match_expression(tree[1])} {tree[0]} {match_expression(tree[2])})"
+
+
+def page_match_expression(tree):
+    """
+    FTS5 expression matching any term of the query that can match a document's text
+    (not after NOT, not in a title:/category: field). Used to find the page a matching
+    document matches best on; None if there is no such term.
+    """
+    terms = []
+
+    def collect(node, column):
+        if node[0] == "term":
+            if column in (None, "extracted_text"):
+                terms.append(node[1])
+        elif node[0] == "field":
+            collect(node[2], node[1])
+        else:
+            collect(node[1], column)
+            if node[0] != "NOT":
+                collect(node[2], column)
+
+    collect(tree, None)
+    return " OR ".join(dict.fromkeys(terms)) or None
+
+
+def matches_document(tree, match_term, column=None):
+    """
+    Evaluate a query tree for one document, term by term: `match_term(term, column)`
+    tells whether an FTS5 term matches the document in `column` (None: any column).
+    For documents whose text isn't in one index yet (see routes.documents).
+    """
+    if tree[0] == "term":
+        return match_term(tree[1], column)
+    if tree[0] == "field":
+        return matches_document(tree[2], match_term, tree[1])
+    left = matches_document(tree[1], match_term, column)
+    if tree[0] == "OR":
+        return left or matches_document(tree[2], match_term, column)
+    if tree[0] == "AND":
+        return left and matches_document(tree[2], match_term, column)
+    return left and not matches_document(tree[2], match_term, column)
+
+
+def parse_search_query(query: str):
+    """
+    Turn a user's search query into an FTS5 MATCH expression.
+    Raises SearchQueryError for malformed input.
+    """
+    return match_expression(parse_search(query))
+
+
+def build_match_expression(user_id: str, search_term: str, columns=CONTENT_COLUMNS, trigram: bool = False):
+    """
+    Full MATCH expression for one user's search. The search term only looks at
+    `columns`; the user_id column narrows the match to the user's rows inside the
+    index, so other tenants' matches are never ranked. The phrase can also match ids
+    that merely start the same way, so callers still check d.user_id.
+    A trigram index can only match ids of 3+ characters; shorter ids skip the narrowing.
+    """
+    expression = f"{{{' '.join(columns)}}} : ({search_term})"
+    usable = len(user_id) >= 3 if trigram else re.search(r"\w", user_id)
+    if usable:
+        expression = f"user_id : ^{quote_term(user_id)} AND {expression}"
+    return expression
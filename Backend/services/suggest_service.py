@@ -0,0 +1,138 @@
+import os
+import re
+import time
+from collections import OrderedDict
+from database import get_db_connection
+from services.search_query import build_match_expression, quote_term
+
+# Search-as-you-type suggestions. Prefixes of 3+ characters go to the trigram index
+# (documents_trigram), which matches anywhere inside titles and OCR'd text, e.g. the
+# middle of an invoice number. Shorter prefixes use a title prefix query on documents_fts.
+TRIGRAM_MIN_CHARS = 3
+DEFAULT_SUGGESTIONS = 8
+MAX_SUGGESTIONS = 20
+MAX_PREFIX_CHARS = 64
+CONTEXT_CHARS = 48  # text fetched on each side of a match to cut the matching term out of
+
+# Responses are cached per (user, prefix) for a short time: a user typing "inv",
+# deleting and retyping it doesn't query again. The cache is only touched from the
+# event loop, so it needs no lock.
+SUGGEST_CACHE_SECONDS = float(os.getenv("SUGGEST_CACHE_SECONDS", "30"))
+SUGGEST_CACHE_SIZE = int(os.getenv("SUGGEST_CACHE_SIZE", "2000"))
+
+_cache = OrderedDict()  # (user_id, prefix, limit) -> (expires_at, suggestions)
+
+# Characters that can belong to a suggested term besides letters/digits (INV-2024/0817)
+_TERM_CHARS = r"[\w\-/.#]"
+
+
+def normalize_prefix(prefix: str):
+    return " ".join(prefix.split())[:MAX_PREFIX_CHARS]
+
+
+def get_cached(user_id: str, prefix: str, limit: int):
+    key = (user_id, prefix.lower(), limit)
+    entry = _cache.get(key)
+    if entry is None:
+        return None
+    expires_at, suggestions = entry
+    if expires_at < time.monotonic():
+        del _cache[key]
+        return None
+    _cache.move_to_end(key)
+    return suggestions
+
+
+def store_cached(user_id: str, prefix: str, limit: int, suggestions):
+    _cache[(user_id, prefix.lower(), limit)] = (time.monotonic() + SUGGEST_CACHE_SECONDS, suggestions)
+    while len(_cache) > SUGGEST_CACHE_SIZE:
+        _cache.popitem(last=False)
+
+
+def invalidate_user(user_id: str):
+    """
+    Drop a user's cached suggestions after their documents changed (upload, processed,
+    category change, delete).
+    """
+    for key in [key for key in _cache if key[0] == user_id]:
+        del _cache[key]
+
+
+def _extract_term(context: str, prefix: str):
+    """
+    The whole term around the first occurrence of `prefix` in `context`, e.g.
+    "INV-2024-00817" for prefix "2024-0".
+    """
+    match = re.search(f"{_TERM_CHARS}*{re.escape(prefix)}{_TERM_CHARS}*", context, re.IGNORECASE)
+    if not match:
+        return None
+    return match.group().strip(".-/#")
+
+
+def find_suggestions(user_id: str, prefix: str, limit: int = DEFAULT_SUGGESTIONS):
+    """
+    Up to `limit` suggestions for a typed prefix: matching document titles first, then
+    matching terms from the documents' text. Each is {"text", "type", "document_id"}.
+    """
+    conn = get_db_connection()
+    suggestions = []
+    seen = set()
+
+    def add(text, kind, document_id):
+        if text and text.lower() not in seen and len(suggestions) < limit:
+            seen.add(text.lower())
+            suggestions.append({"text": text, "type": kind, "document_id": document_id})
+
+    try:
+        if len(prefix) < TRIGRAM_MIN_CHARS:
+            # Too short for trigrams: title words starting with the prefix
+            if not re.search(r"\w", prefix):
+                return []
+            rows = conn.execute('''
+                SELECT d.id, d.title
+                FROM documents_fts fts
+                JOIN documents d ON d.id = fts.rowid
+                WHERE documents_fts MATCH ? AND d.user_id = ?
+                ORDER BY rank
+                LIMIT ?
+            ''', (build_match_expression(user_id, quote_term(prefix) + " *", columns=("title",)), user_id, limit)).fetchall()
+            for row in rows:
+                add(row['title'], "title", row['id'])
+            return suggestions
+
+        phrase = quote_term(prefix)
+        rows = conn.execute('''
+            SELECT d.id, d.title
+            FROM documents_trigram t
+            JOIN documents d ON d.id = t.rowid
+            WHERE documents_trigram MATCH ? AND d.user_id = ?
+            ORDER BY rank
+            LIMIT ?
+        ''', (build_match_expression(user_id, phrase, columns=("title",), trigram=True), user_id, limit)).fetchall()
+        for row in rows:
+            add(row['title'], "title", row['id'])
+
+        if len(suggestions) < limit:
+            # Best matching documents first; only their window around the match is read
+            rows = conn.execute('''
+                SELECT d.id, substr(d.extracted_text, max(instr(lower(d.extracted_text), lower(?)) - ?, 1), ?) AS context
+                FROM (
+                    SELECT t.rowid AS id
+                    FROM documents_trigram t
+                    JOIN documents u ON u.id = t.rowid
+                    WHERE documents_trigram MATCH ? AND u.user_id = ?
+                    ORDER BY rank
+                    LIMIT ?
+                ) m
+                JOIN documents d ON d.id = m.id
+            ''', (
+                prefix, CONTEXT_CHARS, len(prefix) + 2 * CONTEXT_CHARS,
+                build_match_expression(user_id, phrase, columns=("extracted_text",), trigram=True), user_id,
+                limit * 2,
+            )).fetchall()
+            for row in rows:
+                add(_extract_term(row['context'] or "", prefix), "term", row['id'])
+
+        return suggestions
+    finally:
+        conn.close()
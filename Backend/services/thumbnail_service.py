@@ -0,0 +1,103 @@
+import os
+import asyncio
+from database import get_db_connection, run_db
+from services import render_service, cache_service
+
+# Preview images for the document list and viewer, rendered once and kept on disk.
+# Files are content-addressed: THUMBNAIL_DIR/ab/<sha256>-<size>-p<page>.jpg, so
+# identical uploads share their previews and a preview never changes once written.
+# JPEG because PyMuPDF encodes it natively (WebP would need Pillow).
+THUMBNAIL_DIR = os.getenv("THUMBNAIL_DIR", "thumbnails")
+THUMBNAIL_SIZES = {"small": 160, "medium": 320, "large": 800}  # width in pixels
+DEFAULT_THUMBNAIL_SIZE = "medium"
+THUMBNAIL_QUALITY = int(os.getenv("THUMBNAIL_QUALITY", "75"))
+# Rendered right after processing so the list never waits on them (comma-separated sizes)
+THUMBNAIL_PREGENERATE = [
+    size.strip() for size in os.getenv("THUMBNAIL_PREGENERATE", DEFAULT_THUMBNAIL_SIZE).split(",")
+    if size.strip() in THUMBNAIL_SIZES
+]
+THUMBNAIL_CACHE_CONTROL = "private, max-age=31536000, immutable"
+
+# Renders in progress, by output path: concurrent requests for the same preview share one
+_pending = {}
+
+
+def thumbnail_path(content_hash: str, size: str, page: int):
+    return os.path.join(THUMBNAIL_DIR, content_hash[:2], f"{content_hash}-{size}-p{page}.jpg")
+
+
+def thumbnail_etag(content_hash: str, size: str, page: int):
+    return f'"{content_hash}-{size}-p{page}"'
+
+
+async def _render(file_path: str, path: str, size: str, page: int):
+    await asyncio.to_thread(os.makedirs, os.path.dirname(path), exist_ok=True)
+    rendered = await render_service.render_thumbnail(
+        file_path, page - 1, THUMBNAIL_SIZES[size], THUMBNAIL_QUALITY, path
+    )
+    return path if rendered else None
+
+
+async def get_thumbnail(file_path: str, content_hash: str, size: str = DEFAULT_THUMBNAIL_SIZE, page: int = 1):
+    """
+    Path of the preview of `page` (1-based) at `size`, rendering it on first use.
+    None if the file has no such page.
+    """
+    path = thumbnail_path(content_hash, size, page)
+    if await asyncio.to_thread(os.path.exists, path):
+        return path
+
+    future = _pending.get(path)
+    if future is None:
+        future = asyncio.ensure_future(_render(file_path, path, size, page))
+        _pending[path] = future
+        future.add_done_callback(lambda _: _pending.pop(path, None))
+    # Shielded: a client disconnecting doesn't cancel the render other requests wait on
+    return await asyncio.shield(future)
+
+
+def _get_document_source(document_id: int):
+    conn = get_db_connection()
+    try:
+        return conn.execute(
+            "SELECT id, file_path, content_hash FROM documents WHERE id = ?", (document_id,)
+        ).fetchone()
+    finally:
+        conn.close()
+
+
+async def pregenerate(document_id: int):
+    """
+    Render the THUMBNAIL_PREGENERATE sizes of a document's first page.
+    """
+    row = await run_db(_get_document_source, document_id)
+    if not row or not await asyncio.to_thread(os.path.exists, row['file_path']):
+        return
+    content_hash = await cache_service.ensure_content_hash(row['id'], row['file_path'], row['content_hash'])
+    for size in THUMBNAIL_PREGENERATE:
+        await get_thumbnail(row['file_path'], content_hash, size)
+
+
+def _referenced_hashes():
+    conn = get_db_connection()
+    try:
+        rows = conn.execute("SELECT DISTINCT content_hash FROM documents WHERE content_hash IS NOT NULL").fetchall()
+        return {row['content_hash'] for row in rows}
+    finally:
+        conn.close()
+
+
+def prune():
+    """
+    Delete previews whose content no longer belongs to any document. Returns the count removed.
+    """
+    if not os.path.isdir(THUMBNAIL_DIR):
+        return 0
+    referenced = _referenced_hashes()
+    removed = 0
+    for directory, _, filenames in os.walk(THUMBNAIL_DIR):
+        for filename in filenames:
+            if filename.split("-", 1)[0] not in referenced:
+                os.remove(os.path.join(directory, filename))
+                removed += 1
+    return removed
@@ -0,0 +1,358 @@
+import os
+import uuid
+import asyncio
+import hashlib
+import tarfile
+import zipfile
+from python_multipart.multipart import MultipartParser, parse_options_header
+from python_multipart.exceptions import FormParserError
+
+# Uploads are parsed straight off the request stream: each file is size-checked,
+# type-sniffed, hashed and written to disk in a single pass, without Starlette
+# spooling the body to a temp file first.
+WRITE_BUFFER_SIZE = 1024 * 1024   # bytes collected before each (threaded) disk write
+SNIFF_BYTES = 16                  # leading bytes needed to recognise the file type
+MAX_FIELD_SIZE = 64 * 1024        # plain form fields (user_id, ...)
+MULTIPART_OVERHEAD = 64 * 1024    # allowance for boundaries/headers in the Content-Length check
+
+# Magic bytes -> (extension, content type)
+MAGIC_TYPES = [
+    (b"%PDF-", ".pdf", "application/pdf"),
+    (b"\x89PNG\r\n\x1a\n", ".png", "image/png"),
+    (b"\xff\xd8\xff", ".jpg", "image/jpeg"),
+]
+
+
+class UploadError(Exception):
+    """
+    An upload was rejected. Carries the HTTP status the route should answer with.
+    """
+
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+def sniff_file_type(head: bytes):
+    """
+    Real (extension, content_type) of a file from its first bytes, or (None, None).
+    """
+    for magic, ext, content_type in MAGIC_TYPES:
+        if head.startswith(magic):
+            return ext, content_type
+    return None, None
+
+
+class IncomingFile:
+    """
+    One uploaded file being streamed to `upload_dir`. The final name is a UUID with
+    the extension of the sniffed type, so a renamed file can't smuggle in another type.
+    """
+
+    def __init__(self, filename: str, upload_dir: str, max_size: int, allowed_extensions):
+        self.filename = filename
+        self.upload_dir = upload_dir
+        self.max_size = max_size
+        self.allowed_extensions = allowed_extensions
+        self.size = 0
+        self.ext = None
+        self.content_type = None
+        self.file_path = None
+        self._hasher = hashlib.sha256()
+        self._head = b""
+        self._buffer = bytearray()
+        self._fh = None
+
+    async def write(self, data: bytes):
+        self.size += len(data)
+        if self.size > self.max_size:
+            raise UploadError(413, f"File too large. Maximum size is {self.max_size // (1024 * 1024)} MB.")
+
+        self._hasher.update(data)
+        self._buffer += data
+
+        if self._fh is None:
+            if len(self._buffer) < SNIFF_BYTES:
+                return
+            await self._open()
+
+        if len(self._buffer) >= WRITE_BUFFER_SIZE:
+            await self._flush()
+
+    async def _open(self):
+        self.ext, self.content_type = sniff_file_type(bytes(self._buffer[:SNIFF_BYTES]))
+        if self.ext is None or self.ext not in self.allowed_extensions:
+            raise UploadError(400, "Invalid file content. Only JPG, PNG, and PDF allowed.")
+
+        self.file_path = os.path.join(self.upload_dir, f"{uuid.uuid4()}{self.ext}")
+        self._fh = await asyncio.to_thread(open, self.file_path, "wb")
+
+    async def _flush(self):
+        if self._buffer:
+            data = bytes(self._buffer)
+            self._buffer.clear()
+            await asyncio.to_thread(self._fh.write, data)
+
+    async def finish(self):
+        """
+        Flush and close the file. Returns its metadata.
+        """
+        if self.size == 0:
+            raise UploadError(400, "Uploaded file is empty.")
+        if self._fh is None:
+            # Tiny file: never reached SNIFF_BYTES
+            await self._open()
+        await self._flush()
+        await asyncio.to_thread(self._fh.close)
+
+        return {
+            "title": self.filename,
+            "filename": os.path.basename(self.file_path),
+            "file_path": self.file_path,
+            "content_type": self.content_type,
+            "file_size": self.size,
+            "content_hash": self._hasher.hexdigest(),
+        }
+
+    async def discard(self):
+        """
+        Close and delete a partially written file.
+        """
+        if self._fh is not None:
+            await asyncio.to_thread(self._fh.close)
+            self._fh = None
+        if self.file_path and os.path.exists(self.file_path):
+            await asyncio.to_thread(os.remove, self.file_path)
+
+
+async def receive_multipart(request, upload_dir: str, max_file_size: int, allowed_extensions,
+                            file_field: str = "file", max_files: int = 1, collect_errors: bool = False):
+    """
+    Stream a multipart/form-data request. Files in `file_field` are written to
+    `upload_dir` (up to `max_files`; extra file parts are skipped).
+    Returns (fields, files): plain form fields as a dict and a list of file metadata.
+    Raises UploadError (e.g. 413 as soon as a file passes `max_file_size`). With
+    `collect_errors` a rejected file doesn't fail the request: it is skipped and
+    listed in `files` as {"title", "error"} instead.
+    """
+    content_type, params = parse_options_header(request.headers.get("content-type", ""))
+    if content_type != b"multipart/form-data" or b"boundary" not in params:
+        raise UploadError(400, "Expected a multipart/form-data upload.")
+
+    # Reject obviously oversized bodies before reading a single byte
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit():
+        if int(content_length) > max_files * max_file_size + MULTIPART_OVERHEAD:
+            raise UploadError(413, f"Upload too large. Maximum size is {max_file_size // (1024 * 1024)} MB per file.")
+
+    if not os.path.exists(upload_dir):
+        os.makedirs(upload_dir)
+
+    # The parser callbacks are synchronous; they queue events that are handled
+    # (with awaits for disk writes) after each chunk is fed in.
+    events = []
+    part = {}
+
+    def on_header_field(data, start, end):
+        part["header_field"] = part.get("header_field", b"") + data[start:end]
+
+    def on_header_value(data, start, end):
+        part["header_value"] = part.get("header_value", b"") + data[start:end]
+
+    def on_header_end():
+        if part.pop("header_field", b"").lower() == b"content-disposition":
+            part["disposition"] = part.get("header_value", b"")
+        part.pop("header_value", None)
+
+    def on_headers_finished():
+        _, options = parse_options_header(part.pop("disposition", b""))
+        name = options.get(b"name", b"").decode("utf-8", "replace")
+        filename = options.get(b"filename")
+        events.append(("begin", name, filename.decode("utf-8", "replace") if filename is not None else None))
+
+    def on_part_data(data, start, end):
+        events.append(("data", data[start:end]))
+
+    def on_part_end():
+        events.append(("end",))
+
+    parser = MultipartParser(params[b"boundary"], {
+        "on_header_field": on_header_field,
+        "on_header_value": on_header_value,
+        "on_header_end": on_header_end,
+        "on_headers_finished": on_headers_finished,
+        "on_part_data": on_part_data,
+        "on_part_end": on_part_end,
+    })
+
+    fields = {}
+    files = []
+    current = None        # IncomingFile, bytearray (form field), str (rejected file) or None (skipped part)
+    current_name = None
+
+    try:
+        async for chunk in request.stream():
+            try:
+                parser.write(chunk)
+            except FormParserError:
+                raise UploadError(400, "Invalid multipart data.")
+
+            for event in events:
+                try:
+                    if event[0] == "begin":
+                        _, current_name, filename = event
+                        if filename is None:
+                            current = bytearray()
+                        elif current_name == file_field and len(files) < max_files:
+                            current = filename
+                            ext = os.path.splitext(filename)[1].lower()
+                            if ext not in allowed_extensions:
+                                raise UploadError(400, "Invalid file type. Only JPG, PNG, and PDF allowed.")
+                            current = IncomingFile(filename, upload_dir, max_file_size, allowed_extensions)
+                        else:
+                            current = None
+                    elif event[0] == "data":
+                        if isinstance(current, IncomingFile):
+                            await current.write(event[1])
+                        elif isinstance(current, bytearray):
+                            current += event[1]
+                            if len(current) > MAX_FIELD_SIZE:
+                                raise UploadError(413, f"Form field '{current_name}' too large.")
+                    elif event[0] == "end":
+                        if isinstance(current, IncomingFile):
+                            files.append(await current.finish())
+                        elif isinstance(current, bytearray):
+                            fields[current_name] = current.decode("utf-8", "replace")
+                        current = None
+                except UploadError as ue:
+                    if not collect_errors or not isinstance(current, (IncomingFile, str)):
+                        raise
+                    # Report the file and skip the rest of its part (`current` stays its name)
+                    if isinstance(current, IncomingFile):
+                        await current.discard()
+                        current = current.filename
+                    files.append({"title": current, "error": ue.detail})
+                    if event[0] == "end":
+                        current = None
+            events.clear()
+
+        parser.finalize()
+    except BaseException:
+        # Client aborted, limit exceeded or bad data: leave nothing behind on disk
+        if isinstance(current, IncomingFile):
+            await current.discard()
+        for info in files:
+            if "file_path" in info and os.path.exists(info["file_path"]):
+                os.remove(info["file_path"])
+        raise
+
+    return fields, files
+
+
+async def receive_body(request, file_path: str, max_size: int):
+    """
+    Stream a raw request body (e.g. an archive) to `file_path`. Returns its size.
+    Raises UploadError 413 once the body passes `max_size`.
+    """
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > max_size:
+        raise UploadError(413, f"Upload too large. Maximum size is {max_size // (1024 * 1024)} MB.")
+
+    size = 0
+    buffer = bytearray()
+    fh = await asyncio.to_thread(open, file_path, "wb")
+    try:
+        async for chunk in request.stream():
+            size += len(chunk)
+            if size > max_size:
+                raise UploadError(413, f"Upload too large. Maximum size is {max_size // (1024 * 1024)} MB.")
+            buffer += chunk
+            if len(buffer) >= WRITE_BUFFER_SIZE:
+                data = bytes(buffer)
+                buffer.clear()
+                await asyncio.to_thread(fh.write, data)
+        await asyncio.to_thread(fh.write, bytes(buffer))
+    except BaseException:
+        await asyncio.to_thread(fh.close)
+        await asyncio.to_thread(os.remove, file_path)
+        raise
+    await asyncio.to_thread(fh.close)
+    return size
+
+
+def store_file(fileobj, filename: str, upload_dir: str, max_size: int, allowed_extensions):
+    """
+    Blocking counterpart of IncomingFile for files read from an archive: copy `fileobj`
+    to `upload_dir` with the same checks, hashing as it goes. Returns the file metadata.
+    """
+    ext = os.path.splitext(filename)[1].lower()
+    if ext not in allowed_extensions:
+        raise UploadError(400, "Invalid file type. Only JPG, PNG, and PDF allowed.")
+
+    block = fileobj.read(WRITE_BUFFER_SIZE)
+    if not block:
+        raise UploadError(400, "Uploaded file is empty.")
+    ext, content_type = sniff_file_type(block[:SNIFF_BYTES])
+    if ext is None or ext not in allowed_extensions:
+        raise UploadError(400, "Invalid file content. Only JPG, PNG, and PDF allowed.")
+
+    file_path = os.path.join(upload_dir, f"{uuid.uuid4()}{ext}")
+    hasher = hashlib.sha256()
+    size = 0
+    try:
+        with open(file_path, "wb") as out:
+            while block:
+                size += len(block)
+                if size > max_size:
+                    raise UploadError(413, f"File too large. Maximum size is {max_size // (1024 * 1024)} MB.")
+                hasher.update(block)
+                out.write(block)
+                block = fileobj.read(WRITE_BUFFER_SIZE)
+    except BaseException:
+        if os.path.exists(file_path):
+            os.remove(file_path)
+        raise
+
+    return {
+        "title": os.path.basename(filename),
+        "filename": os.path.basename(file_path),
+        "file_path": file_path,
+        "content_type": content_type,
+        "file_size": size,
+        "content_hash": hasher.hexdigest(),
+    }
+
+
+def archive_format(archive_path: str):
+    """
+    "zip", "tar" (plain or gzip/bzip2/xz compressed) or None.
+    """
+    if zipfile.is_zipfile(archive_path):
+        return "zip"
+    if tarfile.is_tarfile(archive_path):
+        return "tar"
+    return None
+
+
+def _is_metadata_entry(name: str):
+    # Resource forks and Finder metadata that macOS adds to archives
+    return name.startswith("__MACOSX/") or os.path.basename(name).startswith("._")
+
+
+def iter_archive(archive_path: str):
+    """
+    Yield (name, open_entry) for each regular file in a ZIP or TAR archive;
+    open_entry() returns a readable file object. Members are read one at a
+    time, the archive is never extracted as a whole.
+    """
+    if archive_format(archive_path) == "zip":
+        with zipfile.ZipFile(archive_path) as archive:
+            for info in archive.infolist():
+                if not info.is_dir() and not _is_metadata_entry(info.filename):
+                    yield info.filename, lambda info=info: archive.open(info)
+    else:
+        with tarfile.open(archive_path, "r:*") as archive:
+            for member in archive:
+                if member.isfile() and not _is_metadata_entry(member.name):
+                    yield member.name, lambda member=member: archive.extractfile(member)
@@ -0,0 +1,107 @@
+import threading
+import numpy as np
+from database import get_db_connection
+
+# In-memory brute-force index over document_chunks. All unit vectors sit in one
+# contiguous float32 matrix, so a query is a single matrix-vector product (a few ms
+# for 100k x 768 on one core) plus an argpartition for the top k.
+#
+# The SQLite table is the source of truth. Chunks added by any process are picked up
+# on the next search (ids only grow). Deleted or replaced chunks are noticed when
+# their hits no longer resolve; once enough are stale the matrix is rebuilt.
+STALE_REBUILD_RATIO = 0.2
+INITIAL_CAPACITY = 1024
+
+
+class VectorIndex:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._reset(None)
+
+    def _reset(self, model):
+        self.model = model
+        self.vectors = None             # (capacity, dims) float32, rows [0, size) in use
+        self.chunk_ids = np.zeros(INITIAL_CAPACITY, dtype=np.int64)
+        self.size = 0
+        self.last_id = 0
+        self.stale = 0
+        self.user_rows = {}             # user_id -> list of row numbers
+        self._user_arrays = {}          # user_id -> np.array of user_rows[user_id]
+
+    def _append(self, chunk_id: int, user_id: str, vector):
+        if self.vectors is None:
+            self.vectors = np.zeros((INITIAL_CAPACITY, len(vector)), dtype=np.float32)
+        if self.size == len(self.vectors):
+            # Grow by doubling. Searches already holding the old matrix keep using it.
+            self.vectors = np.concatenate([self.vectors, np.zeros_like(self.vectors)])
+            self.chunk_ids = np.concatenate([self.chunk_ids, np.zeros_like(self.chunk_ids)])
+        self.vectors[self.size] = vector
+        self.chunk_ids[self.size] = chunk_id
+        self.user_rows.setdefault(user_id, []).append(self.size)
+        self._user_arrays.pop(user_id, None)
+        self.size += 1
+
+    def _sync(self, model: str):
+        if model != self.model or (self.size and self.stale > self.size * STALE_REBUILD_RATIO):
+            self._reset(model)
+
+        conn = get_db_connection()
+        try:
+            rows = conn.execute('''
+                SELECT id, user_id, embedding FROM document_chunks
+                WHERE id > ? AND model = ?
+                ORDER BY id
+            ''', (self.last_id, model)).fetchall()
+        finally:
+            conn.close()
+
+        for row in rows:
+            vector = np.frombuffer(row['embedding'], dtype=np.float32)
+            if self.vectors is not None and len(vector) != self.vectors.shape[1]:
+                continue
+            self._append(row['id'], row['user_id'], vector)
+            self.last_id = row['id']
+
+    def search(self, user_id: str, query_vector, k: int, model: str):
+        """
+        Top `k` (chunk_id, score) of the user's chunks by cosine similarity, best first.
+        """
+        with self._lock:
+            self._sync(model)
+            if user_id not in self.user_rows or self.vectors is None:
+                return []
+            rows = self._user_arrays.get(user_id)
+            if rows is None:
+                rows = self._user_arrays[user_id] = np.array(self.user_rows[user_id], dtype=np.int64)
+            vectors, chunk_ids, size = self.vectors, self.chunk_ids, self.size
+
+        query = np.asarray(query_vector, dtype=np.float32)
+        if len(query) != vectors.shape[1]:
+            return []
+
+        # One pass over the whole matrix is cheaper than gathering the user's rows first
+        scores = (vectors[:size] @ query)[rows]
+        k = min(k, len(rows))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(int(chunk_ids[rows[i]]), float(scores[i])) for i in top]
+
+    def report_stale(self, count: int):
+        """
+        Called when `count` hits pointed at chunks that no longer exist.
+        """
+        with self._lock:
+            self.stale += count
+
+    def stats(self):
+        return {
+            "model": self.model,
+            "chunks": self.size,
+            "users": len(self.user_rows),
+            "stale": self.stale,
+            "memory_bytes": 0 if self.vectors is None else int(self.vectors.nbytes),
+        }
+
+
+index = VectorIndex()
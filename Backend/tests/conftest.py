@@ -0,0 +1,35 @@
+import os
+import pytest
+
+# The LLM client is created at import time but never called by the tests
+os.environ.setdefault("GOOGLE_API_KEY", "not-needed-for-tests")
+os.environ.setdefault("EMBEDDING_PROVIDER", "none")
+os.environ.setdefault("RENDER_EXECUTOR", "thread")
+
+import database
+from fastapi.testclient import TestClient
+from services.vector_index import index as vector_index
+
+
+@pytest.fixture
+def db(tmp_path):
+    """
+    A fresh, fully migrated database for the test.
+    """
+    database.close_db_pool()
+    database.DB_NAME = str(tmp_path / "documents.db")
+    database.init_db()
+    vector_index._reset(None)
+    yield database
+    database.close_db_pool()
+
+
+@pytest.fixture
+def client(db, tmp_path, monkeypatch):
+    """
+    The app with its job workers running, storing uploads under tmp_path.
+    """
+    import main
+    monkeypatch.chdir(tmp_path)
+    with TestClient(main.app) as client:
+        yield client
@@ -0,0 +1,55 @@
+from database import get_db_connection
+from routes.documents import _search_documents, _count_search_matches
+from services import page_service
+from services.search_query import parse_search
+
+
+def _insert_document(user_id, title, status="completed", text=None):
+    conn = get_db_connection()
+    try:
+        document_id = conn.execute('''
+            INSERT INTO documents (user_id, filename, file_path, title, content_type, file_size,
+                                   extracted_text, processing_status)
+            VALUES (?, ?, ?, ?, 'application/pdf', 1, ?, ?)
+        ''', (user_id, f"{title}.pdf", f"uploads/{title}.pdf", title, text, status)).lastrowid
+        if text is not None:
+            page_service.store_pages(document_id, text, conn=conn)
+        conn.commit()
+        return document_id
+    finally:
+        conn.close()
+
+
+def _search(user_id, q, limit=20, offset=0):
+    return [result["id"] for result in _search_documents(user_id, parse_search(q), limit, offset)]
+
+
+def test_processing_document_is_searchable_by_its_stored_pages(db):
+    completed = _insert_document("u1", "old", text="--- Page 1 ---\nAcme invoice\n")
+    processing = _insert_document("u1", "scan", status="processing")
+    page_service.start_pages(processing, 3)
+    page_service.save_page(processing, 1, "Acme Corporation")
+    page_service.save_page(processing, 3, "Invoice total 120 EUR")
+
+    # Terms on different pages, like a completed document; not yet ranked, so listed first
+    assert _search("u1", "acme invoice") == [processing, completed]
+    assert _count_search_matches("u1", parse_search("acme invoice")) == 2
+    assert _search("u1", "acme invoice", limit=1, offset=1) == [completed]
+    assert _search("u1", "acme NOT total") == [completed]
+    assert _search("u1", "title:scan corporation") == [processing]
+    assert _search("u1", "title:old corporation") == []
+    assert _search("u2", "acme") == []
+    result, = _search_documents("u1", parse_search("total"))
+    assert (result["id"], result["page"]) == (processing, 3)
+
+    # Once completed its text is in documents_fts and it is ranked like the others
+    conn = get_db_connection()
+    try:
+        conn.execute(
+            "UPDATE documents SET processing_status = 'completed', extracted_text = ? WHERE id = ?",
+            (page_service.join_pages(page_service.load_pages(processing, conn=conn)), processing)
+        )
+        conn.commit()
+    finally:
+        conn.close()
+    assert sorted(_search("u1", "acme invoice")) == [completed, processing]
@@ -0,0 +1,57 @@
+import pytest
+from services.search_query import (
+    parse_search, parse_search_query, page_match_expression, matches_document, SearchQueryError
+)
+
+
+def test_terms_are_anded_and_last_word_is_a_prefix():
+    assert parse_search_query("invoice 2024") == '("invoice" AND "2024" *)'
+
+
+def test_negated_last_word_is_not_a_prefix():
+    # "invoice NOT draft" must not also exclude "drafting"
+    assert parse_search_query("invoice NOT draft") == '("invoice" NOT "draft")'
+    assert parse_search_query("invoice NOT title:draft") == '("invoice" NOT {title} : ("draft"))'
+
+
+def test_explicit_prefix_after_not_is_kept():
+    assert parse_search_query("invoice NOT draft*") == '("invoice" NOT "draft" *)'
+
+
+def test_fields_and_phrases():
+    assert parse_search_query('title:acme "grand total"') == '({title} : ("acme") AND "grand total")'
+
+
+def test_fts_syntax_is_quoted():
+    assert parse_search_query("a-b c^d") == '("a-b" AND "c^d" *)'
+
+
+def test_page_terms_skip_negated_and_title_terms():
+    assert page_match_expression(parse_search("title:acme total NOT draft")) == '"total"'
+    assert page_match_expression(parse_search("title:acme")) is None
+
+
+def test_matches_document_term_by_term():
+    # The document's words per column, as a stand-in for the FTS lookups
+    document = {"title": {"acme"}, "extracted_text": {"invoice", "total"}}
+
+    def match_term(term, column):
+        word = term.split('"')[1]
+        return any(word in words for name, words in document.items() if column in (None, name))
+
+    assert matches_document(parse_search("acme invoice"), match_term)
+    assert matches_document(parse_search("title:acme OR title:total"), match_term)
+    assert not matches_document(parse_search("title:invoice"), match_term)
+    assert not matches_document(parse_search("invoice NOT total"), match_term)
+
+
+@pytest.mark.parametrize("query, position", [
+    ('"open', 0),
+    ("(a b", 0),
+    ("a b)", 3),
+    ("NOT a", 0),
+])
+def test_malformed_queries_report_position(query, position):
+    with pytest.raises(SearchQueryError) as error:
+        parse_search_query(query)
+    assert error.value.position == position
@@ -0,0 +1,130 @@
+import re
+import time
+import asyncio
+import zlib
+import hashlib
+import numpy as np
+import pymupdf
+import pytest
+from database import get_db_connection
+from routes import documents
+from services import cache_service, embedding_service, page_service
+
+
+class WordEmbeddings:
+    """
+    Deterministic bag-of-words vectors, so similarity follows shared words.
+    """
+    model_id = "test/words"
+    embedded = []
+
+    async def embed_documents(self, texts):
+        self.embedded.extend(texts)
+        vectors = []
+        for text in texts:
+            vector = np.zeros(64, dtype=np.float32)
+            for word in re.findall(r"\w+", text.lower()):
+                vector[zlib.crc32(word.encode()) % 64] += 1
+            vectors.append(vector)
+        return vectors
+
+    async def embed_query(self, text):
+        return (await self.embed_documents([text]))[0]
+
+
+@pytest.fixture
+def word_embeddings(monkeypatch):
+    monkeypatch.setitem(embedding_service.PROVIDERS, "words", WordEmbeddings)
+    monkeypatch.setattr(embedding_service, "EMBEDDING_PROVIDER", "words")
+    monkeypatch.setattr(embedding_service, "_provider", None)
+    WordEmbeddings.embedded = []
+    return WordEmbeddings
+
+
+def _pdf_bytes(text):
+    pdf = pymupdf.open()
+    pdf.new_page().insert_text((72, 72), text)
+    return pdf.tobytes()
+
+
+def _semantic_search(client, user_id, q, timeout=10):
+    """
+    Semantic search results, waiting for the job queue to index the documents.
+    """
+    deadline = time.time() + timeout
+    while True:
+        results = client.get("/api/search", params={"q": q, "user_id": user_id, "mode": "semantic"}).json()["results"]
+        if results or time.time() > deadline:
+            return results
+        time.sleep(0.1)
+
+
+def test_reupload_served_from_cache_is_indexed(client, word_embeddings):
+    content = _pdf_bytes("Quarterly electricity bill")
+    # Processed before (by another user), so the upload is completed from the extraction cache
+    cache_service.store_document(hashlib.sha256(content).hexdigest(), "Quarterly electricity bill", "Utilities")
+
+    response = client.post("/api/documents", data={"user_id": "u1"},
+                           files={"file": ("bill.pdf", content, "application/pdf")})
+    assert response.status_code == 201
+    document_id = response.json()["document"]["id"]
+    assert client.get(f"/api/documents/{document_id}", params={"user_id": "u1"}).json()["document"]["status"] == "completed"
+
+    results = _semantic_search(client, "u1", "electricity bill")
+    assert [result["id"] for result in results] == [document_id]
+
+
+def _chunks(document_id):
+    conn = get_db_connection()
+    try:
+        rows = conn.execute(
+            "SELECT id, page_number, text FROM document_chunks WHERE document_id = ? ORDER BY page_number",
+            (document_id,)
+        ).fetchall()
+        return [tuple(row) for row in rows]
+    finally:
+        conn.close()
+
+
+def _complete(document_id, extracted_text=None):
+    """
+    What process_document saves at the end: the text rebuilt from the stored pages.
+    """
+    conn = get_db_connection()
+    try:
+        extracted_text = extracted_text or page_service.join_pages(page_service.load_pages(document_id, conn=conn))
+        conn.execute(
+            "UPDATE documents SET processing_status = 'completed', extracted_text = ? WHERE id = ?",
+            (extracted_text, document_id)
+        )
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def test_reextracted_page_is_the_only_one_embedded_again(db, word_embeddings):
+    conn = get_db_connection()
+    try:
+        document_id = conn.execute(
+            "INSERT INTO documents (user_id, filename, file_path, title) VALUES ('u1', 'a.pdf', 'uploads/a.pdf', 'a')"
+        ).lastrowid
+        conn.commit()
+    finally:
+        conn.close()
+    page_service.store_pages(document_id, "--- Page 1 ---\nalpha\n\n--- Page 2 ---\nbeta\n\n--- Page 3 ---\ngamma")
+    _complete(document_id)
+
+    asyncio.run(embedding_service.index_document(document_id))
+    assert word_embeddings.embedded == ["alpha", "beta", "gamma"]
+    before = _chunks(document_id)
+
+    # A reprocess of page 2: the page is deleted, extracted again and the text saved
+    assert documents._queue_reprocess(document_id, "u1", {"pages": [2]})[0] == "queued"
+    page_service.save_page(document_id, 2, "delta")
+    _complete(document_id)
+    asyncio.run(embedding_service.index_document(document_id))
+
+    assert word_embeddings.embedded == ["alpha", "beta", "gamma", "delta"]
+    after = _chunks(document_id)
+    assert [after[0], after[2]] == [before[0], before[2]]
+    assert after[1][1:] == (2, "delta")
@@ -0,0 +1,38 @@
+import asyncio
+from database import get_db_connection
+from services import cache_service, suggest_service, llm_service
+
+
+def _insert_document(user_id, title, content_hash):
+    conn = get_db_connection()
+    try:
+        document_id = conn.execute('''
+            INSERT INTO documents (user_id, filename, file_path, title, content_type, file_size, content_hash)
+            VALUES (?, ?, ?, ?, 'application/pdf', 1, ?)
+        ''', (user_id, f"{title}.pdf", f"uploads/{title}.pdf", title, content_hash)).lastrowid
+        conn.commit()
+        return document_id
+    finally:
+        conn.close()
+
+
+def _suggest(user_id, prefix):
+    """
+    What the suggest route answers: the cached suggestions, else a fresh query.
+    """
+    suggestions = suggest_service.get_cached(user_id, prefix, 8)
+    if suggestions is None:
+        suggestions = suggest_service.find_suggestions(user_id, prefix, 8)
+        suggest_service.store_cached(user_id, prefix, 8, suggestions)
+    return suggestions
+
+
+def test_processed_document_is_suggested_right_away(db):
+    cache_service.store_document("hash-1", "Invoice INV-2024-00817", "Finance")
+    document_id = _insert_document("u1", "scan", "hash-1")
+    assert _suggest("u1", "2024-0") == []
+
+    # Served from the extraction cache: completes without touching the file or the LLM
+    asyncio.run(llm_service.process_document(document_id, "uploads/scan.pdf"))
+
+    assert [s["text"] for s in _suggest("u1", "2024-0")] == ["INV-2024-00817"]
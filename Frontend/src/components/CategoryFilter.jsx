@@ -1,32 +1,39 @@
-import { useState, useEffect } from 'react';
+import { useState, useEffect, useRef } from 'react';
+import useDocumentEvents from '../hooks/useDocumentEvents';
 
 const CategoryFilter = ({ category, setCategory }) => {
     const [categories, setCategories] = useState([]);
 
-    useEffect(() => {
-        const fetchCategories = async () => {
-            try {
-                const userId = localStorage.getItem('user_id');
-                if (!userId) return;
-
-                const API_BASE_URL = import.meta.env.VITE_BACKEND_BASE_URL || "https://docscanner-and-organizer.onrender.com";
-                const response = await fetch(`${API_BASE_URL}/api/documents/categories?user_id=${userId}`);
-                if (response.ok) {
-                    const data = await response.json();
-                    setCategories(data.categories);
-                }
-            } catch (error) {
-                console.error("Error fetching categories:", error);
+    const fetchCategories = async () => {
+        try {
+            const userId = localStorage.getItem('user_id');
+            if (!userId) return;
+
+            const API_BASE_URL = import.meta.env.VITE_BACKEND_BASE_URL || "https://docscanner-and-organizer.onrender.com";
+            const response = await fetch(`${API_BASE_URL}/api/documents/categories?user_id=${userId}`);
+            if (response.ok) {
+                const data = await response.json();
+                setCategories(data.categories);
             }
-        };
+        } catch (error) {
+            console.error("Error fetching categories:", error);
+        }
+    };
 
+    useEffect(() => {
         fetchCategories();
-        // Set up interval to refresh counts periodically (e.g., every 10 seconds)
-        const intervalId = setInterval(fetchCategories, 10000);
-        return () => clearInterval(intervalId);
-
     }, []);
 
+    // Refresh the counts when documents come, go or change category (coalesced per second)
+    const refreshTimer = useRef(null);
+    useEffect(() => () => clearTimeout(refreshTimer.current), []);
+
+    useDocumentEvents((type, data) => {
+        if (type === 'status' && data.status !== 'completed') return;
+        clearTimeout(refreshTimer.current);
+        refreshTimer.current = setTimeout(fetchCategories, 1000);
+    });
+
     return (
         <div className="relative">
             <select
@@ -1,7 +1,14 @@
+import { useState } from 'react';
 import { useNavigate } from 'react-router-dom';
 
-const DocumentCard = ({ id, title, category, date, preview, status }) => {
+const DocumentCard = ({ id, title, category, date, preview, status, pages_done, pages_total, page }) => {
     const navigate = useNavigate();
+    const [thumbnailFailed, setThumbnailFailed] = useState(false);
+
+    const API_BASE_URL = import.meta.env.VITE_BACKEND_BASE_URL || "https://docscanner-and-organizer.onrender.com";
+    const userId = localStorage.getItem('user_id');
+    // Rendered first page served by the backend (a few KB, cached by the browser for good)
+    const thumbnailUrl = `${API_BASE_URL}/api/documents/${id}/thumbnail?user_id=${userId}`;
 
     const formattedDate = new Date(date).toLocaleDateString();
 
@@ -33,6 +40,19 @@ const DocumentCard = ({ id, title, category, date, preview, status }) => {
                 {/* Abstract Pattern overlay */}
                 <div className="absolute inset-0 opacity-10 bg-white"></div>
 
+                {/* Page preview; falls back to the gradient card if it can't be rendered */}
+                {!thumbnailFailed && (
+                    <img
+                        src={`${thumbnailUrl}&size=medium`}
+                        srcSet={`${thumbnailUrl}&size=medium 1x, ${thumbnailUrl}&size=large 2x`}
+                        alt=""
+                        loading="lazy"
+                        decoding="async"
+                        onError={() => setThumbnailFailed(true)}
+                        className="absolute inset-0 w-full h-full object-cover object-top bg-white group-hover:scale-105 transition-transform duration-300"
+                    />
+                )}
+
                 {/* Top Badge */}
                 <div className="flex justify-between items-start z-10">
                     <div className="bg-white/20 backdrop-blur-md border border-white/10 text-white text-[10px] font-bold px-2 py-1 rounded-lg uppercase tracking-wider">
@@ -41,13 +61,15 @@ const DocumentCard = ({ id, title, category, date, preview, status }) => {
                     {status === 'processing' && (
                         <div className="flex items-center gap-1.5 bg-black/30 backdrop-blur-md px-2 py-1 rounded-full border border-white/10">
                             <div className="w-1.5 h-1.5 rounded-full bg-blue-400 animate-pulse"></div>
-                            <span className="text-[10px] font-medium text-white/90">Processing</span>
+                            <span className="text-[10px] font-medium text-white/90">
+                                {pages_total > 1 ? `Processing ${pages_done ?? 0}/${pages_total} pages` : 'Processing'}
+                            </span>
                         </div>
                     )}
                 </div>
 
-                {/* Central Icon or Mini Preview */}
-                <div className="flex-1 flex items-center justify-center z-10">
+                {/* Central Icon or Mini Preview (behind the page preview when there is one) */}
+                <div className={`flex-1 flex items-center justify-center z-10 ${thumbnailFailed ? '' : 'invisible'}`}>
                     {preview && status === 'completed' ? (
                         <div className="w-full h-24 bg-white/90 dark:bg-gray-900/90 rounded-lg shadow-lg p-3 transform group-hover:scale-105 transition-transform duration-300 relative overflow-hidden">
                             {/* Mini formatted text look */}
@@ -78,6 +100,8 @@ const DocumentCard = ({ id, title, category, date, preview, status }) => {
                     <p className="mt-1 text-xs text-gray-500 dark:text-gray-400 font-medium flex items-center gap-1">
                         <svg className="w-3 h-3" fill="none" stroke="currentColor" viewBox="0 0 24 24"><path strokeLinecap="round" strokeLinejoin="round" strokeWidth="2" d="M8 7V3m8 4V3m-9 8h10M5 21h14a2 2 0 002-2V7a2 2 0 00-2-2H5a2 2 0 00-2 2v12a2 2 0 002 2z"></path></svg>
                         {formattedDate}
+                        {/* Search results: the page the best match is on */}
+                        {page && <span className="text-indigo-500 dark:text-indigo-400">· Match on page {page}</span>}
                     </p>
                 </div>
 
@@ -1,10 +1,19 @@
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useRef } from 'react';
 import DocumentCard from './DocumentCard';
+import useDocumentEvents from '../hooks/useDocumentEvents';
+
+// Placeholder previews the list API gives documents without extracted text
+const STATUS_PREVIEWS = {
+    processing: 'Processing document...',
+    failed: 'Processing failed.',
+};
 
 const DocumentList = ({ searchQuery = '', selectedCategory = 'All Categories', refreshTrigger = 0, onDocumentsLoaded }) => {
     const [documents, setDocuments] = useState([]);
     const [loading, setLoading] = useState(true);
     const [error, setError] = useState(null);
+    const [nextCursor, setNextCursor] = useState(null);
+    const [loadingMore, setLoadingMore] = useState(false);
 
     const API_BASE_URL = import.meta.env.VITE_BACKEND_BASE_URL || "https://docscanner-and-organizer.onrender.com";
 
@@ -34,6 +43,11 @@ const DocumentList = ({ searchQuery = '', selectedCategory = 'All Categories', r
             const response = await fetch(url);
 
             if (!response.ok) {
+                // Malformed search syntax comes back as a 400 with an explanation
+                if (searchQuery && response.status === 400) {
+                    const body = await response.json().catch(() => null);
+                    if (body?.detail?.message) throw new Error(`Invalid search: ${body.detail.message}`);
+                }
                 throw new Error('Failed to fetch documents');
             }
 
@@ -47,9 +61,12 @@ const DocumentList = ({ searchQuery = '', selectedCategory = 'All Categories', r
                     preview: result.snippet // Use snippet for preview
                 }));
                 setDocuments(searchResults);
+                // Search pages by offset (results are ranked, not date ordered)
+                setNextCursor(data.next_offset != null ? String(data.next_offset) : null);
                 if (onDocumentsLoaded) onDocumentsLoaded(searchResults.length);
             } else {
                 setDocuments(data.documents);
+                setNextCursor(data.next_cursor || null);
                 if (onDocumentsLoaded) onDocumentsLoaded(data.count || data.documents.length);
             }
 
@@ -61,6 +78,43 @@ const DocumentList = ({ searchQuery = '', selectedCategory = 'All Categories', r
         }
     };
 
+    // Fetch the next page of the list (or of the search results) and append it
+    const loadMore = async () => {
+        if (!nextCursor) return;
+        try {
+            setLoadingMore(true);
+            const userId = localStorage.getItem('user_id');
+            let url = `${API_BASE_URL}/api/documents?user_id=${userId}&cursor=${encodeURIComponent(nextCursor)}`;
+            if (searchQuery) {
+                url = `${API_BASE_URL}/api/search?q=${encodeURIComponent(searchQuery)}&user_id=${userId}&offset=${nextCursor}`;
+            } else if (selectedCategory && selectedCategory !== 'All Categories') {
+                url += `&category=${encodeURIComponent(selectedCategory)}`;
+            }
+
+            const response = await fetch(url);
+            if (!response.ok) {
+                throw new Error('Failed to fetch documents');
+            }
+
+            const data = await response.json();
+            const page = searchQuery
+                ? data.results.map(result => ({ ...result, preview: result.snippet }))
+                : data.documents;
+            const combined = [...documents, ...page];
+            setDocuments(combined);
+            if (searchQuery) {
+                setNextCursor(data.next_offset != null ? String(data.next_offset) : null);
+            } else {
+                setNextCursor(data.next_cursor || null);
+            }
+            if (onDocumentsLoaded) onDocumentsLoaded(combined.length);
+        } catch (err) {
+            setError(err.message);
+        } finally {
+            setLoadingMore(false);
+        }
+    };
+
     useEffect(() => {
         // Debounce search
         const timerId = setTimeout(() => {
@@ -70,24 +124,45 @@ const DocumentList = ({ searchQuery = '', selectedCategory = 'All Categories', r
         return () => clearTimeout(timerId);
     }, [searchQuery, selectedCategory, refreshTrigger]); // Added selectedCategory to dependencies
 
-    // Polling logic: Check every 5 seconds if any document is processing, ONLY if not searching
-    useEffect(() => {
-        if (searchQuery) return; // Don't poll while searching to avoid overwriting results
+    // Live updates pushed by the server (no polling). Changes to documents on screen are
+    // applied in place; anything that changes which documents are listed refetches once,
+    // with bursts (e.g. a bulk upload) coalesced into a single background request.
+    const fetchRef = useRef(fetchDocuments);
+    fetchRef.current = fetchDocuments;
+    const refreshTimer = useRef(null);
 
-        const hasProcessing = documents.some(doc => doc.status === 'processing');
-        let intervalId;
+    const scheduleRefresh = () => {
+        clearTimeout(refreshTimer.current);
+        refreshTimer.current = setTimeout(() => fetchRef.current(true), 1000);
+    };
 
-        if (hasProcessing) {
-            intervalId = setInterval(() => {
-                console.log("Polling for updates...");
-                fetchDocuments(true);
-            }, 5000);
+    useEffect(() => () => clearTimeout(refreshTimer.current), []);
+
+    useDocumentEvents((type, data) => {
+        if (type === 'status' || type === 'category') {
+            setDocuments((docs) => docs.map((doc) => doc.id !== data.document_id ? doc : {
+                ...doc,
+                status: data.status || doc.status,
+                category: data.category || doc.category,
+                // Search results show a match snippet in place of the preview
+                preview: searchQuery ? doc.preview : data.preview || STATUS_PREVIEWS[data.status] || doc.preview,
+            }));
+        } else if (type === 'progress') {
+            setDocuments((docs) => docs.map((doc) => doc.id !== data.document_id ? doc : {
+                ...doc,
+                pages_done: data.pages_done,
+                pages_total: data.pages_total,
+            }));
+        } else if (type === 'deleted') {
+            setDocuments((docs) => docs.filter((doc) => doc.id !== data.document_id));
         }
 
-        return () => {
-            if (intervalId) clearInterval(intervalId);
-        };
-    }, [documents, searchQuery]);
+        if (searchQuery) return; // Don't overwrite search results
+        const filtered = selectedCategory && selectedCategory !== 'All Categories';
+        if (type === 'created' || type === 'resync' || (filtered && (type === 'category' || data.status === 'completed'))) {
+            scheduleRefresh();
+        }
+    });
 
     // No client-side filtering needed anymore
     const filteredDocuments = documents;
@@ -130,10 +205,23 @@ const DocumentList = ({ searchQuery = '', selectedCategory = 'All Categories', r
     }
 
     return (
-        <div className="grid grid-cols-1 sm:grid-cols-2 lg:grid-cols-3 xl:grid-cols-4 gap-6">
-            {filteredDocuments.map((doc) => (
-                <DocumentCard key={doc.id} {...doc} />
-            ))}
+        <div>
+            <div className="grid grid-cols-1 sm:grid-cols-2 lg:grid-cols-3 xl:grid-cols-4 gap-6">
+                {filteredDocuments.map((doc) => (
+                    <DocumentCard key={doc.id} {...doc} />
+                ))}
+            </div>
+            {nextCursor && (
+                <div className="mt-8 text-center">
+                    <button
+                        onClick={loadMore}
+                        disabled={loadingMore}
+                        className="text-sm text-indigo-600 hover:text-indigo-500 font-medium disabled:opacity-50"
+                    >
+                        {loadingMore ? 'Loading...' : 'Load more'}
+                    </button>
+                </div>
+            )}
         </div>
     );
 };
@@ -1,4 +1,39 @@
+import { useState, useEffect } from 'react';
+
 const SearchBar = ({ query, setQuery }) => {
+    const [suggestions, setSuggestions] = useState([]);
+
+    const API_BASE_URL = import.meta.env.VITE_BACKEND_BASE_URL || "https://docscanner-and-organizer.onrender.com";
+
+    // Autocomplete from the lightweight suggest endpoint (titles and terms in the documents)
+    useEffect(() => {
+        const userId = localStorage.getItem('user_id');
+        if (!query.trim() || !userId) {
+            setSuggestions([]);
+            return;
+        }
+
+        const controller = new AbortController();
+        const timerId = setTimeout(async () => {
+            try {
+                const response = await fetch(
+                    `${API_BASE_URL}/api/search/suggest?q=${encodeURIComponent(query)}&user_id=${userId}`,
+                    { signal: controller.signal }
+                );
+                if (!response.ok) return;
+                const data = await response.json();
+                setSuggestions(data.suggestions || []);
+            } catch (err) {
+                // Aborted by the next keystroke, or the server is unreachable: no suggestions
+            }
+        }, 100);
+
+        return () => {
+            clearTimeout(timerId);
+            controller.abort();
+        };
+    }, [query]);
+
     return (
         <div className="relative flex-grow max-w-md">
             <div className="absolute inset-y-0 left-0 pl-3 flex items-center pointer-events-none">
@@ -10,9 +45,15 @@ const SearchBar = ({ query, setQuery }) => {
                 type="text"
                 value={query}
                 onChange={(e) => setQuery(e.target.value)}
+                list="search-suggestions"
                 className="block w-full pl-10 pr-3 py-2 border border-gray-300 dark:border-gray-700 rounded-lg leading-5 bg-white dark:bg-gray-800 text-gray-900 dark:text-white placeholder-gray-500 focus:outline-none focus:ring-2 focus:ring-indigo-500 focus:border-indigo-500 sm:text-sm shadow-sm"
                 placeholder="Search documents..."
             />
+            <datalist id="search-suggestions">
+                {suggestions.map((suggestion) => (
+                    <option key={`${suggestion.type}-${suggestion.text}`} value={suggestion.text} />
+                ))}
+            </datalist>
         </div>
     );
 };
@@ -65,7 +65,6 @@ const UploadModal = ({ isOpen, onClose, onUploadSuccess }) => {
 
         const formData = new FormData();
         formData.append('file', file);
-        formData.append('file', file);
 
         const userId = localStorage.getItem('user_id');
         if (!userId) {
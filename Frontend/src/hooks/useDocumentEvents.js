@@ -0,0 +1,51 @@
+import { useEffect, useRef } from 'react';
+
+const API_BASE_URL = import.meta.env.VITE_BACKEND_BASE_URL || "https://docscanner-and-organizer.onrender.com";
+const EVENT_TYPES = ['created', 'status', 'progress', 'category', 'deleted', 'resync'];
+
+// One EventSource per tab, shared by every component listening for document events
+const listeners = new Set();
+let source = null;
+
+const emit = (type, data) => {
+    listeners.forEach((listener) => listener(type, data));
+};
+
+const connect = () => {
+    const userId = localStorage.getItem('user_id');
+    if (!userId) return;
+
+    source = new EventSource(`${API_BASE_URL}/api/events?user_id=${encodeURIComponent(userId)}`);
+    EVENT_TYPES.forEach((type) => {
+        source.addEventListener(type, (e) => emit(type, JSON.parse(e.data)));
+    });
+
+    // EventSource reconnects by itself; whatever happened while it was down was missed
+    let connectedBefore = false;
+    source.addEventListener('open', () => {
+        if (connectedBefore) emit('resync', {});
+        connectedBefore = true;
+    });
+};
+
+// Calls handler(type, data) for each server-sent document event (see GET /api/events)
+const useDocumentEvents = (handler) => {
+    const handlerRef = useRef(handler);
+    handlerRef.current = handler;
+
+    useEffect(() => {
+        const listener = (type, data) => handlerRef.current(type, data);
+        listeners.add(listener);
+        if (!source) connect();
+
+        return () => {
+            listeners.delete(listener);
+            if (listeners.size === 0 && source) {
+                source.close();
+                source = null;
+            }
+        };
+    }, []);
+};
+
+export default useDocumentEvents;
@@ -63,6 +63,26 @@ const DocumentDetail = () => {
         }
     };
 
+    // Queue a failed document for processing again (pages already extracted are reused)
+    const handleRetry = async () => {
+        try {
+            const userId = localStorage.getItem('user_id') || 'test_user_id';
+            const response = await fetch(`${API_BASE_URL}/api/documents/${id}/reprocess?user_id=${userId}`, {
+                method: 'POST',
+            });
+
+            if (response.ok) {
+                setDocument({ ...document, status: 'pending' });
+            } else {
+                const data = await response.json();
+                alert(`Failed to retry: ${data.detail || 'Unknown error'}`);
+            }
+        } catch (err) {
+            console.error("Error retrying document:", err);
+            alert("An error occurred while retrying the document.");
+        }
+    };
+
     if (loading) {
         return (
             <div className="min-h-screen bg-gray-50 dark:bg-gray-900 flex items-center justify-center">
@@ -122,6 +142,14 @@ const DocumentDetail = () => {
                                 onCategoryUpdate={(newCategory) => setDocument({ ...document, category: newCategory })}
                             />
                         </div>
+                        {document.status === 'failed' && (
+                            <button
+                                onClick={handleRetry}
+                                className="ml-3 inline-flex items-center px-4 py-2 border border-transparent rounded-md shadow-sm text-sm font-medium text-white bg-indigo-600 hover:bg-indigo-700 focus:outline-none focus:ring-2 focus:ring-offset-2 focus:ring-indigo-500"
+                            >
+                                Retry
+                            </button>
+                        )}
                         <button
                             onClick={handleDelete}
                             className="ml-3 inline-flex items-center px-4 py-2 border border-transparent rounded-md shadow-sm text-sm font-medium text-white bg-red-600 hover:bg-red-700 focus:outline-none focus:ring-2 focus:ring-offset-2 focus:ring-red-500"